@@ -3,20 +3,22 @@ import warnings
 warnings.filterwarnings("ignore")
 
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 
 from time import sleep
 
 from utils import (
-    input_checker,
+    inputs_checker,
     build_training_df,
-    get_afinidade_df,
-    get_results,
+    inicia_job,
+    acompanha_job,
     sh,
     show_result,
     get_prev_results_infos,
+    show_historico_metricas,
+    show_etapas,
 )
+from utils.inputs_handler import ETAPAS_TREINO
 
 
 st.logo("imagens/logo_ita.png", size="large")
@@ -29,19 +31,25 @@ def selecionar_result(result_idx, texto):
     st.session_state["texto"] = texto
 
 
-# --- Body ---
+def inputs_prontos():
+    return all(
+        Path(f"dados/temporarios/{nome}.csv").exists()
+        for nome in ("df_training", "df_consultores")
+    )
 
-tab1, tab2 = st.tabs(["Novo Planejamento", "Historico de Planejamentos"])
-with tab1:
+
+# Cada parte da pagina e um fragmento: mexer num widget roda de novo so o
+# fragmento dele, o app inteiro so quando o estado compartilhado muda (novos
+# inputs, job iniciado ou terminado)
+
+
+@st.fragment
+def painel_inputs():
     st.subheader("Inputs")
 
-    try:
-        df_training = pd.read_csv(Path("dados/temporarios/df_training.csv"))
-        df_consultores = pd.read_csv(Path("dados/temporarios/df_consultores.csv"))
+    inputs_ready = inputs_prontos()
+    if inputs_ready:
         st.success("Inputs prontos!")
-        inputs_ready = True
-    except FileNotFoundError as e:
-        inputs_ready = False
 
     re_button = st.button(
         "Carregar novos inputs",
@@ -49,26 +57,50 @@ with tab1:
     )
 
     if not inputs_ready or re_button:
-        inputs = []
-        inputs.append(input_checker("escolas_atuais"))
-        inputs.append(input_checker("local_consultores"))
-        inputs.append(input_checker("ticket_medio"))
-        inputs.append(input_checker("microdados_ed_basica"))
-        inputs.append(input_checker("RESULTADOS"))
+        inputs = inputs_checker(
+            [
+                "escolas_atuais",
+                "local_consultores",
+                "ticket_medio",
+                "microdados_ed_basica",
+                "RESULTADOS",
+            ]
+        )
 
         inputs = [v for v in inputs if v is not None]
         if len(inputs) == 5:
             build_training_df(inputs)
             inputs[1].to_csv(Path("dados/temporarios/df_consultores.csv"), index=False)
             st.cache_data.clear()
-            st.rerun()
+            st.rerun(scope="app")
 
+    if ETAPAS_TREINO.exists():
+        with st.expander("Etapas da montagem dos inputs"):
+            show_etapas(ETAPAS_TREINO)
+
+
+@st.fragment
+def ajustes():
     sh("Ajustes")
 
     usar_afinidade = st.toggle(
         "Usar Afinidade (beta)",
         help="Caso não use afinidade o sistema irá distribuir iguais valores de potencial de venda para cada consultor",
     )
+    metodo_afinidade = st.selectbox(
+        "Modelo de afinidade",
+        ["exato", "aproximado", "propensao"],
+        format_func={
+            "exato": "One-Class SVM",
+            "aproximado": "One-Class SVM aproximado (rápido)",
+            "propensao": "Propensão por clusters",
+        }.get,
+        disabled=not usar_afinidade,
+    )
+    multinivel = st.toggle(
+        "Modo multinível",
+        help="Agrupa as escolas em micro-regiões antes de distribuir, bem mais rápido para muitas escolas com uma pequena perda de qualidade",
+    )
     st.write("\n")
     col1, _ = st.columns(2)
     with col1:
@@ -80,29 +112,36 @@ with tab1:
             step=0.05,
         )
 
+    perfilar = st.toggle(
+        "Perfilar execução",
+        help="Diagnóstico: grava onde o tempo do planejamento foi gasto (flame graph), deixa a rodada um pouco mais lenta",
+    )
+
     st.write("\n")
 
     st.session_state["calcular"] = st.button(
-        "Calcular", type="primary", disabled=not inputs_ready, width="stretch"
+        "Calcular", type="primary", disabled=not inputs_prontos(), width="stretch"
     )
 
     # st.session_state["calcular"] = True  # ATENCAO
 
     if st.session_state.get("calcular"):
         st.session_state["calcular"] = False
-        with st.spinner("Calculando...", show_time=True):
-            df_afinidade = get_afinidade_df(df_training, usar_afinidade)
-            df_resultado = get_results(
-                df_afinidade, df_training, df_consultores, usar_afinidade, cobertura
-            )
-
-            # df_resultado = pd.read_csv("dados/temporarios/df_resultado.csv")  # ATENCAO
-            # sleep(5)  # ATENCAO
-
-        show_result(-1)
+        # roda num processo separado, o id fica na url para reconectar ao recarregar
+        st.query_params["job"] = inicia_job(
+            {
+                "usar_afinidade": usar_afinidade,
+                "metodo_afinidade": metodo_afinidade,
+                "cobertura": cobertura,
+                "multinivel": multinivel,
+                "perfilar": perfilar,
+            }
+        )
+        st.rerun(scope="app")
 
 
-with tab2:
+@st.fragment
+def historico():
     st.subheader("Resultados anteriores")
 
     prev_results_infos = get_prev_results_infos()
@@ -117,12 +156,31 @@ with tab2:
             width="stretch",
             on_click=selecionar_result,
             args=(result_idx, texto),
+            key=f"resultado_{result_idx}",  # o texto pode repetir
         )
 
     result_idx = st.session_state.get("result_idx")
     if result_idx != None:
         show_result(result_idx, st.session_state.get("texto"))
 
+    with st.expander("Desempenho do solver"):
+        show_historico_metricas()
+
+
+# --- Body ---
+
+tab1, tab2 = st.tabs(["Novo Planejamento", "Historico de Planejamentos"])
+with tab1:
+    painel_inputs()
+    ajustes()
+
+    if "job" in st.query_params:
+        acompanha_job(st.query_params["job"])
+
+
+with tab2:
+    historico()
+
 
 # --- Rodapé ---
 sh()
@@ -0,0 +1,120 @@
+"""
+Benchmark do score de afinidade: OneClassSVM exato x aproximado
+
+Para universos sinteticos de escolas mede o tempo de treino e de pontuacao de
+cada metodo do _ocsvm_prob e a correlacao de ranking (Spearman) entre eles
+
+Uso (a partir da pasta do projeto):
+    python benchmarks/benchmark_afinidade.py
+    python benchmarks/benchmark_afinidade.py --tamanhos 10000 50000
+"""
+
+import sys, json, time, argparse, tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils import ml_scripts
+
+# --- CONFIGURAÇÕES DE TESTE ---
+
+TAMANHOS = [10_000, 50_000, 200_000]  # escolas no universo
+FRACAO_CLIENTES = 0.10
+N_FEATURES = 30
+TOP_N = 1000  # sobreposicao entre as TOP_N escolas de cada metodo
+SEED = 2025
+
+PASTA_SAIDA = Path(__file__).resolve().parent / "resultados"
+
+# ---------------------------------------------------------
+
+
+def gera_universo(n_escolas, seed=SEED):
+    """
+    Features numericas com clientes deslocados em algumas direcoes, no formato
+    esperado pelo _ocsvm_prob (coluna "cliente" e CO_ENTIDADE)
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_escolas, N_FEATURES))
+    cliente = (rng.random(n_escolas) < FRACAO_CLIENTES).astype(int)
+    X[cliente == 1, : N_FEATURES // 5] += rng.normal(1.0, 0.3, N_FEATURES // 5)
+
+    df = pd.DataFrame(X, columns=[f"feat_{i}" for i in range(N_FEATURES)])
+    df["cliente"] = cliente
+    df["CO_ENTIDADE"] = np.arange(n_escolas)
+
+    return df
+
+
+def _mede(metodo, df):
+    inicio = time.perf_counter()
+    modelo = ml_scripts._treina_ocsvm(df, metodo=metodo)
+    treino = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    probs = ml_scripts._pontua_ocsvm(modelo, df)
+    pontuacao = time.perf_counter() - inicio
+
+    return probs, round(treino, 3), round(pontuacao, 3)
+
+
+def roda_tamanho(n_escolas):
+    print(f"\n>>> N_ESCOLAS={n_escolas}")
+    df = gera_universo(n_escolas)
+    registro = {"n_escolas": n_escolas, "n_clientes": int(df["cliente"].sum())}
+
+    resultados = {}
+    for metodo in ["exato", "aproximado"]:
+        probs, treino, pontuacao = _mede(metodo, df)
+        resultados[metodo] = probs
+        registro[f"{metodo}_treino_s"] = treino
+        registro[f"{metodo}_pontuacao_s"] = pontuacao
+        print(f"    {metodo}: treino {treino}s | pontuacao {pontuacao}s")
+
+    exato, aprox = resultados["exato"], resultados["aproximado"]
+    registro["spearman"] = round(spearmanr(exato, aprox).statistic, 4)
+
+    top = min(TOP_N, n_escolas)
+    top_exato = set(np.argsort(exato)[-top:])
+    top_aprox = set(np.argsort(aprox)[-top:])
+    registro[f"sobreposicao_top_{TOP_N}"] = round(len(top_exato & top_aprox) / top, 4)
+
+    registro["speedup"] = round(
+        (registro["exato_treino_s"] + registro["exato_pontuacao_s"])
+        / (registro["aproximado_treino_s"] + registro["aproximado_pontuacao_s"]),
+        2,
+    )
+    print(f"    spearman {registro['spearman']} | speedup {registro['speedup']}x")
+
+    return registro
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--tamanhos", nargs="+", type=int, default=TAMANHOS)
+    args = parser.parse_args()
+
+    data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
+    PASTA_SAIDA.mkdir(exist_ok=True)
+    saida = PASTA_SAIDA / f"bench_afinidade_{data_hora}.jsonl"
+
+    # cache de parametros temporario, para a busca do exato entrar no tempo
+    with tempfile.TemporaryDirectory() as pasta_tmp:
+        ml_scripts.CACHE_PARAMS = Path(pasta_tmp) / "ocsvm_params.json"
+
+        with open(saida, "w") as f:
+            for n_escolas in args.tamanhos:
+                registro = roda_tamanho(n_escolas)
+                f.write(json.dumps(registro) + "\n")
+                f.flush()  # Salva no disco imediatamente
+
+    print(f"\nCONCLUÍDO! Arquivo gerado: {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark do k-means nativo (utils/kmeans_nd.c) contra o sklearn
+
+Para cada cenario roda KMeansNativo, KMeans e MiniBatchKMeans com uma
+inicializacao so e mede o tempo e o SSE (inercia) final, em float64 e float32
+
+Uso (a partir da pasta do projeto):
+    python benchmarks/benchmark_kmeans.py
+    python benchmarks/benchmark_kmeans.py --cenarios 40000x60x4 100000x2x300
+"""
+
+import sys, json, time, argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.datasets import make_blobs
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils.kmeans_nativo import KMeansNativo, disponivel
+
+# --- CONFIGURAÇÕES DE TESTE ---
+
+# (n_pontos, dimensoes, k)
+CENARIOS = [
+    (40_000, 60, 4),  # propensao: escolas x features do censo
+    (200_000, 30, 8),
+    (100_000, 2, 300),  # pre-agrupamento geografico do modo multinivel
+]
+DTYPES = [np.float64, np.float32]
+SEED = 2025
+
+PASTA_SAIDA = Path(__file__).resolve().parent / "resultados"
+
+# ---------------------------------------------------------
+
+
+def _modelos(k):
+    return {
+        "nativo": KMeansNativo(n_clusters=k, n_init=1, random_state=SEED),
+        "sklearn": KMeans(n_clusters=k, n_init=1, random_state=SEED),
+        "minibatch": MiniBatchKMeans(n_clusters=k, n_init=1, random_state=SEED),
+    }
+
+
+def roda_cenario(n_pontos, dimensoes, k):
+    print(f"\n>>> N={n_pontos} D={dimensoes} K={k}")
+    X, _ = make_blobs(
+        n_samples=n_pontos, n_features=dimensoes, centers=k, random_state=SEED
+    )
+
+    registros = []
+    for dtype in DTYPES:
+        Xd = X.astype(dtype)
+        for nome, modelo in _modelos(k).items():
+            inicio = time.perf_counter()
+            modelo.fit(Xd)
+            tempo = time.perf_counter() - inicio
+
+            registro = {
+                "n_pontos": n_pontos,
+                "dimensoes": dimensoes,
+                "k": k,
+                "dtype": np.dtype(dtype).name,
+                "modelo": nome,
+                "tempo_s": round(tempo, 3),
+                "inercia": float(modelo.inertia_),
+                "n_iter": int(modelo.n_iter_),
+            }
+            print(
+                f"    {registro['dtype']} {nome}: {registro['tempo_s']}s"
+                f" | SSE {registro['inercia']:.6g} | {registro['n_iter']} iteracoes"
+            )
+            registros.append(registro)
+
+    return registros
+
+
+def _le_cenario(texto):
+    n_pontos, dimensoes, k = texto.lower().split("x")
+    return int(n_pontos), int(dimensoes), int(k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--cenarios",
+        nargs="+",
+        type=_le_cenario,
+        default=CENARIOS,
+        help="cenarios no formato PONTOSxDIMENSOESxK, ex: 40000x60x4",
+    )
+    args = parser.parse_args()
+
+    if not disponivel():
+        sys.exit("kmeans nativo indisponivel (precisa do gcc com OpenMP)")
+
+    data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
+    PASTA_SAIDA.mkdir(exist_ok=True)
+    saida = PASTA_SAIDA / f"bench_kmeans_{data_hora}.jsonl"
+
+    with open(saida, "w") as f:
+        for cenario in args.cenarios:
+            for registro in roda_cenario(*cenario):
+                f.write(json.dumps(registro) + "\n")
+            f.flush()  # Salva no disco imediatamente
+
+    print(f"\nCONCLUÍDO! Arquivo gerado: {saida}")
+
+
+if __name__ == "__main__":
+    main()
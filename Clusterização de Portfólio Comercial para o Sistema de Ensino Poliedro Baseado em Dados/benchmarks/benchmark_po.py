@@ -0,0 +1,296 @@
+"""
+Benchmark do otimizador de planejamento
+
+Gera instancias sinteticas (escolas e consultores espalhados pelo Brasil) e mede
+separadamente as fases de distancias, montagem do modelo, solver e extracao da
+solucao, com o pico de memoria de cada fase
+
+O solver e chamado como no app (po_scripts._resolve_highs: HiGHS_CMD com o
+binario de solvers/ no windows, log e gapRel), o log de cada instancia fica em
+benchmarks/resultados
+
+Uso (a partir da pasta do projeto):
+    python benchmarks/benchmark_po.py
+    python benchmarks/benchmark_po.py --grandes
+    python benchmarks/benchmark_po.py --tamanhos 1000x5 5000x20
+    python benchmarks/benchmark_po.py --comparar antes.jsonl depois.jsonl
+"""
+
+import sys, json, time, argparse, subprocess, threading
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import psutil
+import pulp
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils import po_scripts
+
+# --- CONFIGURAÇÕES DE TESTE ---
+
+# (n_escolas, n_consultores)
+TAMANHOS = [
+    (1_000, 5),
+    (5_000, 20),
+]
+# so com --grandes: o modelo completo de 100k x 200 tem 20M de variaveis e
+# precisa de dezenas de GB e horas
+TAMANHOS_GRANDES = [
+    (20_000, 50),
+    (100_000, 200),
+]
+
+# Caixa que envolve o Brasil (lat_min, lat_max, lon_min, lon_max)
+BBOX_BRASIL = (-33.75, 5.27, -73.99, -34.79)
+
+# Polos onde as escolas particulares se concentram (lat, lon, peso)
+POLOS = [
+    (-23.55, -46.63, 0.30),  # Sao Paulo
+    (-22.91, -43.17, 0.15),  # Rio de Janeiro
+    (-19.92, -43.94, 0.10),  # Belo Horizonte
+    (-25.43, -49.27, 0.07),  # Curitiba
+    (-30.03, -51.23, 0.06),  # Porto Alegre
+    (-12.97, -38.50, 0.06),  # Salvador
+    (-8.05, -34.88, 0.06),  # Recife
+    (-3.73, -38.52, 0.05),  # Fortaleza
+    (-15.79, -47.88, 0.05),  # Brasilia
+]
+FRACAO_UNIFORME = 0.10  # resto do pais
+ESPALHAMENTO_GRAUS = 1.5
+
+COBERTURA = 0.35
+GAP = 0.02
+SEED = 2025
+INTERVALO_MEMORIA_S = 0.01
+
+PASTA_SAIDA = Path(__file__).resolve().parent / "resultados"
+
+# ---------------------------------------------------------
+
+
+def gera_instancia(n_escolas, n_consultores, seed=SEED):
+    """
+    Retorna df_afinidade (CO_ENTIDADE, valor_venda, afinidade, lat, lon) e
+    df_consultores (Consultor, lat, lon) sinteticos
+    """
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = BBOX_BRASIL
+
+    def _pontos(n):
+        pesos = np.array([p[2] for p in POLOS])
+        pesos = pesos / pesos.sum()
+        n_uniforme = int(n * FRACAO_UNIFORME)
+        polo = rng.choice(len(POLOS), size=n - n_uniforme, p=pesos)
+
+        lat = np.concatenate(
+            [
+                np.array([POLOS[p][0] for p in polo])
+                + rng.normal(0, ESPALHAMENTO_GRAUS, len(polo)),
+                rng.uniform(lat_min, lat_max, n_uniforme),
+            ]
+        )
+        lon = np.concatenate(
+            [
+                np.array([POLOS[p][1] for p in polo])
+                + rng.normal(0, ESPALHAMENTO_GRAUS, len(polo)),
+                rng.uniform(lon_min, lon_max, n_uniforme),
+            ]
+        )
+        return np.clip(lat, lat_min, lat_max), np.clip(lon, lon_min, lon_max)
+
+    lat, lon = _pontos(n_escolas)
+
+    # alunos por escola com cauda longa e ticket medio por aluno
+    alunos = np.clip(rng.lognormal(mean=5.3, sigma=0.8, size=n_escolas), 21, 5000)
+    ticket = rng.normal(900, 150, n_escolas).clip(400)
+
+    df_afinidade = pd.DataFrame(
+        {
+            "CO_ENTIDADE": np.arange(11_000_000, 11_000_000 + n_escolas),
+            "valor_venda": (alunos * ticket).round(),
+            "afinidade": 1.0,
+            "lat": lat,
+            "lon": lon,
+        }
+    )
+
+    lat_co, lon_co = _pontos(n_consultores)
+    df_consultores = pd.DataFrame(
+        {
+            "Consultor": [f"Consultor {c}" for c in range(n_consultores)],
+            "lat": lat_co,
+            "lon": lon_co,
+        }
+    )
+
+    return df_afinidade, df_consultores
+
+
+def _rss_total(processo):
+    """
+    RSS do processo somado ao dos filhos (o HiGHS_CMD do _resolve_highs roda
+    num subprocesso)
+    """
+    rss = processo.memory_info().rss
+    for filho in processo.children(recursive=True):
+        try:
+            rss += filho.memory_info().rss
+        except psutil.NoSuchProcess:  # terminou entre o children() e a leitura
+            pass
+
+    return rss
+
+
+def _mede(func, *args, **kwargs):
+    """
+    Roda func medindo tempo de parede e o pico de RSS acima do inicio da fase,
+    amostrado em outra thread, somando o processo e os filhos (inclui o solver)
+    Retorna (resultado, tempo_s, pico_mb)
+    """
+    processo = psutil.Process()
+    rss_inicio = _rss_total(processo)
+    pico = [rss_inicio]
+    parar = threading.Event()
+
+    def _amostra():
+        while not parar.wait(INTERVALO_MEMORIA_S):
+            pico[0] = max(pico[0], _rss_total(processo))
+
+    amostrador = threading.Thread(target=_amostra, daemon=True)
+    amostrador.start()
+
+    inicio = time.perf_counter()
+    resultado = func(*args, **kwargs)
+    tempo = time.perf_counter() - inicio
+
+    parar.set()
+    amostrador.join()
+    pico[0] = max(pico[0], _rss_total(processo))
+
+    return resultado, round(tempo, 3), round((pico[0] - rss_inicio) / 2**20, 1)
+
+
+def roda_instancia(n_escolas, n_consultores):
+    print(f"\n>>> N_ESCOLAS={n_escolas} N_CONSULTORES={n_consultores}")
+    df_afinidade, df_consultores = gera_instancia(n_escolas, n_consultores)
+    registro = {"n_escolas": n_escolas, "n_consultores": n_consultores}
+
+    df_dist, registro["distancias_s"], registro["distancias_mb"] = _mede(
+        po_scripts._calcula_distancias, df_afinidade, df_consultores
+    )
+    df_afinidade = po_scripts._add_motivacao(df_afinidade)
+    df_final = df_dist.merge(
+        df_afinidade[["CO_ENTIDADE", "motivacao"]], on="CO_ENTIDADE"
+    )
+
+    (modelo, x), registro["modelo_s"], registro["modelo_mb"] = _mede(
+        po_scripts._monta_modelo, df_final, COBERTURA
+    )
+    registro["n_variaveis"] = len(x)
+
+    caminho_log = str(PASTA_SAIDA / f"log_{n_escolas}x{n_consultores}.txt")
+    modelo, registro["solver_s"], registro["solver_mb"] = _mede(
+        po_scripts._resolve_highs, modelo, caminho_log, GAP
+    )
+    registro["status"] = pulp.LpStatus[modelo.status]
+    registro["objetivo"] = pulp.value(modelo.objective)
+
+    _, registro["extracao_s"], registro["extracao_mb"] = _mede(
+        lambda: po_scripts._formata_solucao(
+            [k for k, v in x.items() if (v.value() or 0) > 0.5]
+        )
+    )
+
+    registro["total_s"] = round(
+        sum(registro[f"{f}_s"] for f in ["distancias", "modelo", "solver", "extracao"]),
+        3,
+    )
+    print(
+        f"    distancias {registro['distancias_s']}s | modelo {registro['modelo_s']}s"
+        f" | solver {registro['solver_s']}s | extracao {registro['extracao_s']}s"
+    )
+
+    return registro
+
+
+def _commit_atual():
+    try:
+        saida = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+        return saida.stdout.strip() or "sem_git"
+    except FileNotFoundError:
+        return "sem_git"
+
+
+def roda_benchmark(tamanhos):
+    commit = _commit_atual()
+    data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
+    PASTA_SAIDA.mkdir(exist_ok=True)
+    saida = PASTA_SAIDA / f"bench_{data_hora}_{commit}.jsonl"
+
+    with open(saida, "w") as f:
+        for n_escolas, n_consultores in tamanhos:
+            registro = roda_instancia(n_escolas, n_consultores)
+            registro.update({"commit": commit, "data_hora": data_hora})
+            f.write(json.dumps(registro) + "\n")
+            f.flush()  # Salva no disco imediatamente
+
+    print(f"\nCONCLUÍDO! Arquivo gerado: {saida}")
+    return saida
+
+
+def compara(arquivo_antes, arquivo_depois):
+    """
+    Imprime a razao depois/antes dos tempos de cada fase por tamanho de instancia
+    """
+    chave = ["n_escolas", "n_consultores"]
+    fases = ["distancias_s", "modelo_s", "solver_s", "extracao_s", "total_s"]
+
+    antes = pd.read_json(arquivo_antes, lines=True).set_index(chave)[fases]
+    depois = pd.read_json(arquivo_depois, lines=True).set_index(chave)[fases]
+
+    razao = (depois / antes).dropna(how="all").round(3)
+    print("Razao depois/antes (< 1 é mais rapido):\n")
+    print(razao)
+
+    return razao
+
+
+def _le_tamanho(texto):
+    n_escolas, n_consultores = texto.lower().split("x")
+    return int(n_escolas), int(n_consultores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--tamanhos",
+        nargs="+",
+        type=_le_tamanho,
+        help="instancias no formato ESCOLASxCONSULTORES, ex: 1000x5",
+    )
+    parser.add_argument(
+        "--grandes",
+        action="store_true",
+        help=f"inclui as instancias grandes {TAMANHOS_GRANDES} (muita memoria)",
+    )
+    parser.add_argument(
+        "--comparar", nargs=2, metavar=("ANTES", "DEPOIS"), help="dois .jsonl"
+    )
+    args = parser.parse_args()
+
+    if args.comparar:
+        compara(*args.comparar)
+    else:
+        tamanhos = args.tamanhos or TAMANHOS
+        if args.grandes:
+            tamanhos = tamanhos + TAMANHOS_GRANDES
+        roda_benchmark(tamanhos)
+
+
+if __name__ == "__main__":
+    main()
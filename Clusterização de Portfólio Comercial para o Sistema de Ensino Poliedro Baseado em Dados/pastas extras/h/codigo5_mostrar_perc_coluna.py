@@ -1,10 +1,17 @@
-import pandas as pd
+import sys
+from pathlib import Path
+
+# perfil pelos metadados do parquet fica no utils do app
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from utils.perfil_dados import converte_para_parquet, perfil_parquet
 
 # === Caminho do seu arquivo ===
-arquivo = r"C:\Users\zzind\OneDrive\Documents\Gustavo\RPVMM\04_dados_completos.csv"
+arquivo = Path(r"C:\Users\zzind\OneDrive\Documents\Gustavo\RPVMM\04_dados_completos.csv")
 
-# === Ler o arquivo ===
-df = pd.read_csv(arquivo, sep=';', low_memory=False)
+# === Versão parquet (convertida uma vez só, em blocos) ===
+arquivo_parquet = arquivo.with_suffix(".parquet")
+if not arquivo_parquet.exists():
+    converte_para_parquet(arquivo, arquivo_parquet, encoding="utf8")
 
 # === Colunas que você quer deixar de fora da análise ===
 cols_ignorar = [
@@ -25,24 +32,16 @@ cols_ignorar = [
     "IN_RESERVA_PCD"
 ]
 
-# === Remover da análise ===
-df = df.drop(columns=cols_ignorar, errors='ignore')
-
-# === Calcular porcentagem de valores faltantes ===
-faltantes = df.isna().mean() * 100
+# === Perfil pelas estatísticas dos row groups (sem carregar os dados) ===
+perfil = perfil_parquet(arquivo_parquet)
+perfil = perfil.drop(index=cols_ignorar, errors='ignore')
 
 # === Selecionar apenas colunas com algum valor faltante ===
-faltantes = faltantes[faltantes > 0].sort_values(ascending=False)
-
-# === Adicionar recomendação de exclusão ===
-limite_excluir = 50  # 50% de dados ausentes
-relatorio = pd.DataFrame({
-    'percentual_faltante': faltantes.round(2),
-    'recomendacao': ['Excluir' if v > limite_excluir else 'Manter' for v in faltantes]
-})
+relatorio = perfil[perfil['percentual_faltante'] > 0].sort_values('percentual_faltante', ascending=False)
+relatorio = relatorio[['percentual_faltante', 'recomendacao']]  # Excluir acima de 50% ausentes
 
 # === Exibir resumo ===
-print(f"Total de colunas analisadas: {len(df.columns)}")
+print(f"Total de colunas analisadas: {len(perfil)}")
 print(f"Colunas com valores faltantes: {len(relatorio)}\n")
 
 print("🧩 Top 20 colunas com mais valores faltantes:\n")
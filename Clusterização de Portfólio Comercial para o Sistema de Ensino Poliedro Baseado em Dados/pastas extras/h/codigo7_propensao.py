@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+# motor de propensao fica no utils do app
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from utils.propensao import carrega_base, calcula_propensao, salva_propensao
+
+# === 1️⃣ Carregar base (uma vez só para os dois segmentos) ===
+arquivo = r"C:\Users\zzind\OneDrive\Documents\Gustavo\RPVMM\04_dados_completos.csv"
+df = carrega_base(arquivo)
+target = "GUIA"
+
+# === 2️⃣ Propensão das escolas com e sem notas do ENEM (segmentos em paralelo) ===
+df_propensao, df_pesos = calcula_propensao(df, target=target)
+print(df_propensao["SEGMENTO"].value_counts())
+
+# === 3️⃣ Saída única: escolas com propensão + pesos nos metadados do parquet ===
+saida = r"C:\Users\zzind\OneDrive\Documents\Gustavo\RPVMM\05_dados_com_propensao.parquet"
+salva_propensao(df_propensao, df_pesos, saida)
+print(f"\n💾 Arquivo salvo com sucesso: {saida}")
+
+# === 4️⃣ Feedback final ===
+for segmento, df_seg in df_propensao.groupby("SEGMENTO"):
+    print(f"\n🏫 [{segmento}] Top 10 escolas não aderentes com maior propensão:\n")
+    print(df_seg[df_seg[target] == 0]
+          .sort_values(by='PROPENSAO_%', ascending=False)
+          .head(10)[['CO_ENTIDADE', 'NO_ENTIDADE', 'SG_UF', 'PROPENSAO_%']])
+
+    print(f"\n📊 [{segmento}] Top 10 variáveis com maior peso no cluster aderente:\n")
+    print(df_pesos[df_pesos["SEGMENTO"] == segmento].head(10))
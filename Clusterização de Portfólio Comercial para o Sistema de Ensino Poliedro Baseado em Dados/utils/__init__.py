@@ -1,4 +1,14 @@
-from utils.st_functions import sh, input_checker, show_result, get_prev_results_infos
+from utils.st_functions import (
+    sh,
+    input_checker,
+    inputs_checker,
+    show_result,
+    get_prev_results_infos,
+    show_historico_metricas,
+    show_etapas,
+    acompanha_job,
+)
 from utils.inputs_handler import build_training_df
 from utils.ml_scripts import get_afinidade_df
 from utils.po_scripts import get_results
+from utils.jobs import inicia_job
@@ -0,0 +1,105 @@
+import re
+import pandas as pd
+from pathlib import Path
+
+# Colunas do RESULTADOS_{ano}.csv do INEP usadas pelo app e pelo codigo2,
+# com o tipo de cada uma, o resto do arquivo nem e lido
+SCHEMA_RESULTADOS = {
+    "NU_ANO": "Int16",
+    "CO_ESCOLA": "Int64",
+    "TP_DEPENDENCIA_ADM_ESC": "Int8",
+    "TP_SIT_FUNC_ESC": "Int8",
+    "TP_PRESENCA_CN": "Int8",
+    "TP_PRESENCA_CH": "Int8",
+    "TP_PRESENCA_LC": "Int8",
+    "TP_PRESENCA_MT": "Int8",
+    "NU_NOTA_CN": "float64",
+    "NU_NOTA_CH": "float64",
+    "NU_NOTA_LC": "float64",
+    "NU_NOTA_MT": "float64",
+    "NU_NOTA_REDACAO": "float64",
+}
+
+COLUNAS_NOTAS = [
+    "NU_NOTA_CN",
+    "NU_NOTA_CH",
+    "NU_NOTA_LC",
+    "NU_NOTA_MT",
+    "NU_NOTA_REDACAO",
+]
+COLUNAS_PRESENCA = [
+    "TP_PRESENCA_CN",
+    "TP_PRESENCA_CH",
+    "TP_PRESENCA_LC",
+    "TP_PRESENCA_MT",
+]
+
+# O que o _add_enem do build_training_df usa
+COLUNAS_APP = ["CO_ESCOLA"] + COLUNAS_PRESENCA + COLUNAS_NOTAS
+
+_RE_VIRGULA_DECIMAL = re.compile(r";\d+,\d+")
+
+
+def _detecta_decimal(caminho, encoding, n_linhas=200) -> str:
+    """
+    Olha as primeiras linhas: o arquivo do INEP vem com ponto, mas as versoes
+    que passaram pelo Excel vem com virgula
+    """
+    with open(caminho, encoding=encoding) as f:
+        for _, linha in zip(range(n_linhas), f):
+            if _RE_VIRGULA_DECIMAL.search(linha):
+                return ","
+
+    return "."
+
+
+def le_resultados_enem(caminho, colunas=None, encoding="latin1", decimal=None):
+    """
+    Le o RESULTADOS do ENEM numa passada so, apenas as colunas do
+    SCHEMA_RESULTADOS (ou as pedidas em colunas) ja com os tipos certos
+    decimal: "," ou ".", None detecta pelas primeiras linhas
+    Presenca vazia vira 0 (faltou)
+    """
+    print("le_resultados_enem()")
+    caminho = Path(caminho)
+    schema = {c: t for c, t in SCHEMA_RESULTADOS.items() if not colunas or c in colunas}
+
+    with open(caminho, encoding=encoding) as f:
+        cabecalho = f.readline().strip().split(";")
+    schema = {c: t for c, t in schema.items() if c in cabecalho}
+
+    df = pd.read_csv(
+        caminho,
+        sep=";",
+        encoding=encoding,
+        usecols=list(schema),
+        dtype=schema,
+        decimal=decimal or _detecta_decimal(caminho, encoding),
+        engine="pyarrow",
+    )
+
+    presenca = [c for c in COLUNAS_PRESENCA if c in df.columns]
+    df[presenca] = df[presenca].fillna(0)
+
+    return df
+
+
+def filtra_resultados_enem(df):
+    """
+    Mantem as provas com todas as notas, de escolas privadas/conveniadas ativas
+    (TP_DEPENDENCIA_ADM_ESC 2 ou 4, TP_SIT_FUNC_ESC 1) e redacao > 0
+    Retorna CO_ESCOLA, NU_ANO, TP_DEPENDENCIA_ADM_ESC e as notas
+    """
+    print("filtra_resultados_enem()")
+    mascara = (
+        df[COLUNAS_NOTAS + ["CO_ESCOLA"]].notna().all(axis=1)
+        & (df["CO_ESCOLA"] != 0)
+        & (df["NU_NOTA_REDACAO"] > 0)
+        & df["TP_DEPENDENCIA_ADM_ESC"].isin([2, 4])
+        & (df["TP_SIT_FUNC_ESC"] == 1)
+    )
+
+    return df.loc[
+        mascara.fillna(False),
+        ["CO_ESCOLA", "NU_ANO", "TP_DEPENDENCIA_ADM_ESC"] + COLUNAS_NOTAS,
+    ]
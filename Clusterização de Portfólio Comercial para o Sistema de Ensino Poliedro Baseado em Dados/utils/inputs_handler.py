@@ -3,8 +3,65 @@ import numpy as np
 from pathlib import Path
 import json, asyncio
 from utils.busca_ceps import cep_to_coords
+from utils.ml_scripts import precalcula_afinidade
+from utils.microdados import get_features_microdados
+from utils.pipeline import executa_etapas
+from utils.metricas import mede_etapa, coleta_etapas
+from utils.perfilador import perfil_opcional
+from utils.enem import le_resultados_enem, COLUNAS_APP
+
+# etapas medidas (@mede_etapa) da ultima montagem do df_training
+ETAPAS_TREINO = Path("dados/temporarios/etapas_treino.jsonl")
+PERFIL_TREINO = "dados/temporarios/perfil_treino"  # prefixo dos arquivos do perfil
+
+# nome -> (titulo, arquivo em dados/inputs)
+INPUTS = {
+    "escolas_atuais": (
+        "Escolas Atuais no Sistema de Ensino Poliedro",
+        "escolas_atuais.xlsx",
+    ),
+    "local_consultores": ("Local dos Consultores", "local_consultores.xlsx"),
+    "ticket_medio": ("Ticket Médio", "ticket_medio.json"),
+    "microdados_ed_basica": (
+        "Micro Dados da Educação Básica",
+        "microdados_ed_basica.csv",
+    ),
+    "RESULTADOS": ("Resultados do ENEM", "RESULTADOS.csv"),
+}
+
+
+def le_input(name):
+    """
+    Le o input, sem mensagem (pode rodar numa thread ou fora do app)
+    Retorna (arquivo, erro)
+    """
+    input_path = Path("dados/inputs") / INPUTS[name][1]
+    try:
+        if name == "microdados_ed_basica":
+            arquivo = pd.read_csv(
+                input_path, sep=";", encoding="latin1", low_memory=False
+            )
+
+        elif name == "RESULTADOS":
+            arquivo = le_resultados_enem(input_path, colunas=COLUNAS_APP)
+
+        elif name == "escolas_atuais":
+            dict_dfs = pd.read_excel(input_path, sheet_name=None)  # dict com os df
+            arquivo = tuple(dict_dfs.values())  # tupla com os dfs
+
+        elif name == "local_consultores":
+            arquivo = pd.read_excel(input_path)
+
+        elif name == "ticket_medio":
+            arquivo = json.loads(input_path.read_text())
 
+        return arquivo, None
 
+    except Exception as e:
+        return None, e
+
+
+@mede_etapa
 def _remove_colunas(df):
 
     cols_interesse = json.loads(
@@ -29,6 +86,7 @@ def _soma_colunas(df: pd.DataFrame, colunas: list[str], novo_nome: str, drop=Tru
     return df
 
 
+@mede_etapa
 def _combina_colunas(df):
     print("_combina_colunas()")
 
@@ -127,19 +185,27 @@ def _combina_colunas(df):
     return df
 
 
+def _mascara_escolas(df):
+    """
+    Escolas que entram no treino, so com colunas do censo original
+    (vale antes e depois do _combina_colunas)
+    """
+    alunos = ["QT_MAT_INF", "QT_MAT_FUND_AI", "QT_MAT_FUND_AF", "QT_MAT_MED"]
+
+    particular = df["TP_DEPENDENCIA"] == 4  # reduz para 52_568
+    nao_confessional = df["TP_CATEGORIA_ESCOLA_PRIVADA"] != 3  # reduz para 52_101
+    em_atividade = df["TP_SITUACAO_FUNCIONAMENTO"] == 1  # reduz para 42_751
+    presencial = df["IN_MEDIACAO_PRESENCIAL"] == 1  # reduz para 42_470
+    mais_de_20_alunos = df[alunos].sum(axis=1) > 20  # reduz para 37_178
+
+    return particular & nao_confessional & em_atividade & presencial & mais_de_20_alunos
+
+
+@mede_etapa
 def _filtra_linhas(df):
     print("_filtra_linhas()")
 
-    df = df[df["TP_DEPENDENCIA"] == 4]  # Mantem escolas particulares, reduz para 52_568
-    df = df[
-        (df["TP_CATEGORIA_ESCOLA_PRIVADA"] != 3)
-    ]  # Remove escolas particulares confessionais, reduz para 52_101
-    df = df[
-        (df["TP_SITUACAO_FUNCIONAMENTO"] == 1)
-    ]  # Mantem escolas em atividade, reduz para 42_751
-    df = df[
-        df["IN_MEDIACAO_PRESENCIAL"] == 1
-    ]  # Remove escolas que nao tem aula presencial, reduz para 42_470
+    df = df[_mascara_escolas(df)]
 
     df = df.drop(
         columns=[
@@ -150,10 +216,6 @@ def _filtra_linhas(df):
         ]
     )
 
-    df = df[
-        df["qt_alunos"] > 20
-    ]  # Remove escolas com menos de 20 alunos, reduz para 37_178
-
     return df
 
 
@@ -177,6 +239,7 @@ def _limita_outliers(serie, x, achatar=False):
     return tratada
 
 
+@mede_etapa
 def _trata_outliers(df):
     print("_trata_outliers()")
 
@@ -208,8 +271,53 @@ def _trata_outliers(df):
     return df
 
 
-def _add_enem(df_training, df_enem):
-    print("_add_enem()")
+def _prepara_censo(df_md_ed_basica):
+    """
+    Cadeia de limpeza do censo, roda num processo separado
+    """
+    df_training = _remove_colunas(df_md_ed_basica)
+    df_training = _combina_colunas(df_training)
+    df_training = _filtra_linhas(df_training)
+    df_training = _trata_outliers(df_training)
+
+    return df_training
+
+
+@mede_etapa
+def _geocodifica(df_md_ed_basica):
+    """
+    lat e lon por CO_ENTIDADE das escolas que passam no _filtra_linhas,
+    roda em thread junto com a limpeza do censo
+    """
+    df_ceps = df_md_ed_basica.loc[
+        _mascara_escolas(df_md_ed_basica), ["CO_ENTIDADE", "CO_CEP"]
+    ]
+
+    return asyncio.run(cep_to_coords(df_ceps, "CO_CEP"))
+
+
+@mede_etapa
+def _add_microdados(df_training, dfs_microdados):
+    """
+    Junta as features agregadas por escola dos microdados de matriculas e
+    docentes, se os arquivos estiverem em dados/inputs (ver utils/microdados.py)
+    """
+    print("_add_microdados()")
+    for df_fonte in dfs_microdados:
+        df_training = df_training.merge(df_fonte, how="left", on="CO_ENTIDADE")
+
+        colunas = [c for c in df_fonte.columns if c != "CO_ENTIDADE"]
+        df_training[colunas] = df_training[colunas].fillna(0)
+
+    return df_training
+
+
+@mede_etapa
+def _agrega_enem(df_enem):
+    """
+    Nota media por escola (cod_escola, nota_enem), roda num processo separado
+    """
+    print("_agrega_enem()")
     # Remover linhas que nao tenham codigo escola
     df_enem = df_enem.dropna(subset="CO_ESCOLA")  # 1.5M linhas
 
@@ -240,6 +348,12 @@ def _add_enem(df_training, df_enem):
     df_enem["cod_escola"] = df_enem["CO_ESCOLA"].astype(int)  # estava com .0 no final
     df_enem = df_enem[["cod_escola", "nota_enem"]]
 
+    return df_enem
+
+
+@mede_etapa
+def _add_enem(df_training, df_enem):
+    print("_add_enem()")
     # Junta os dois df
     df = df_training.merge(
         df_enem, how="left", left_on="CO_ENTIDADE", right_on="cod_escola"
@@ -250,6 +364,7 @@ def _add_enem(df_training, df_enem):
     return df
 
 
+@mede_etapa
 def _add_val_venda(df_training, ticket_medio):
     print("_add_val_venda()")
 
@@ -263,6 +378,7 @@ def _add_val_venda(df_training, ticket_medio):
     return df_training
 
 
+@mede_etapa
 def _add_clientes(df_training: pd.DataFrame, tupla_dfs_atuais):
     """
     Adiciona a coluna "cliente" que discrimina se
@@ -313,23 +429,50 @@ def _add_clientes(df_training: pd.DataFrame, tupla_dfs_atuais):
     return df_training.drop(columns=["co_inep_x", "co_inep_y", "cliente_ban"])
 
 
-def build_training_df(inputs):
+def _junta_etapas(
+    df_training, dfs_microdados, df_enem, df_coords, ticket_medio, tupla_dfs_atuais
+):
+    print("_junta_etapas()")
+    df_training = _add_microdados(df_training, dfs_microdados)
+    df_training = _add_enem(df_training, df_enem)
+    df_training = _add_val_venda(df_training, ticket_medio)
+    df_training = df_training.merge(df_coords, how="left", on="CO_ENTIDADE")
+    df_training = _add_clientes(df_training, tupla_dfs_atuais)
+
+    return df_training
+
+
+def build_training_df(inputs, perfilar=False):
     """
     Recebe uma lista com os seguintes inputs na ordem:
     escolas_atuais, local_consultores, ticket_medio, microdados_ed_basica, RESULTADOS
+    perfilar: grava o perfil por amostragem da montagem (PERFIL_TREINO), com
+    todas as etapas em threads para o perfil enxergar
     """
     print("build_training_df()")
 
     nome_arquivo_temporario = Path("dados/temporarios/df_training.csv")
 
-    df_training = _remove_colunas(inputs[3])  # df_md_ed_basica
-    df_training = _combina_colunas(df_training)
-    df_training = _filtra_linhas(df_training)
-    df_training = _trata_outliers(df_training)
-
-    df_training = _add_enem(df_training, inputs[4])  # df_enem
-    df_training = _add_val_venda(df_training, inputs[2])  # ticket_medio
-    df_training = asyncio.run(cep_to_coords(df_training, "CO_CEP", True))
-    df_training = _add_clientes(df_training, inputs[0])  # escolas_atuais
-
-    df_training.to_csv(nome_arquivo_temporario, index=False)
+    # Censo, ENEM, CEPs e microdados sao independentes ate as juncoes
+    etapas = {
+        "censo": {"func": _prepara_censo, "args": [inputs[3]], "tipo": "processo"},
+        "enem": {"func": _agrega_enem, "args": [inputs[4]], "tipo": "processo"},
+        "coords": {"func": _geocodifica, "args": [inputs[3]]},
+        "microdados": {"func": get_features_microdados},
+        "juncao": {
+            "func": _junta_etapas,
+            "deps": ["censo", "microdados", "enem", "coords"],
+            "args": [inputs[2], inputs[0]],  # ticket_medio, escolas_atuais
+        },
+    }
+    with perfil_opcional(perfilar, PERFIL_TREINO):
+        with coleta_etapas(ETAPAS_TREINO):
+            resultados, _ = executa_etapas(etapas, processos=not perfilar)
+        df_training = resultados["juncao"]
+
+        df_training.to_csv(nome_arquivo_temporario, index=False)
+
+        # Relido do csv para o hash do modelo bater com o que o app carrega
+        df_training = pd.read_csv(nome_arquivo_temporario)
+        df_training["afinidade"] = precalcula_afinidade(df_training)
+        df_training.to_csv(nome_arquivo_temporario, index=False)
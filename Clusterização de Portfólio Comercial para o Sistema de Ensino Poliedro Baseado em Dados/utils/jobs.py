@@ -0,0 +1,447 @@
+import os, json, time, uuid, hashlib, tempfile, threading
+import multiprocessing as mp
+import psutil
+from pathlib import Path
+from utils.manifesto import novo_run_id
+
+PASTA_JOBS = Path("dados/temporarios/jobs")
+PASTA_ARQUIVO = PASTA_JOBS / "arquivo"  # jobs terminados, fora do indice
+INPUTS_PLANEJAMENTO = [
+    Path("dados/temporarios/df_training.csv"),
+    Path("dados/temporarios/df_consultores.csv"),
+]
+
+# Cada planejamento ja usa varios nucleos (solver, portfolio), entao poucos por vez
+MAX_JOBS_SIMULTANEOS = max(1, (os.cpu_count() or 2) // 2)
+
+# Etapas reportadas pelo planejamento, na ordem (a barra de progresso usa a posicao)
+ETAPAS_PLANEJAMENTO = {
+    "afinidade": "Calculando a afinidade",
+    "geocodificacao": "Geocodificando os consultores",
+    "distancias": "Calculando as distancias",
+    "modelo": "Montando o modelo",
+    "solver": "Resolvendo o modelo",
+    "busca_local": "Melhorando a solucao (busca local)",
+    "exportacao": "Salvando o resultado",
+}
+
+# Arquivos de cada job em PASTA_JOBS, cada um com um so processo escrevendo:
+#   {id}.json: estado da fila (servidor): status, chave, parametros, pid...
+#   {id}.etapas.jsonl: etapas iniciadas (processo do job, uma linha por etapa)
+#   {id}.fim.json: status final "concluido" ou "erro" (processo do job)
+# Quando o job termina o servidor copia o status final para o {id}.json e move
+# os tres arquivos para PASTA_ARQUIVO
+
+STATUS_ATIVOS = ("na_fila", "rodando")
+
+_job_atual = None  # id do job rodando neste processo (so no processo do job)
+
+# so no processo do servidor
+_trava = threading.RLock()  # toda escrita do {id}.json passa por ela
+_processos = {}  # job_id -> Process iniciado por este processo
+_despachante = None
+_hashes_arquivos = {}  # (caminho, tamanho, mtime) -> sha1 do arquivo
+_ativos = {}  # job_id -> estado dos jobs na fila ou rodando
+_concluidos = {}  # chave_planejamento -> id do ultimo job concluido
+_indice_carregado = False
+
+
+def _caminho(job_id, sufixo=".json") -> Path:
+    return PASTA_JOBS / f"{job_id}{sufixo}"
+
+
+def _le_json(caminho) -> dict | None:
+    try:
+        return json.loads(caminho.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _le_arquivo_job(job_id, sufixo=".json") -> str | None:
+    """
+    Texto do arquivo do job, na pasta dos jobs ou no arquivo (se foi movido
+    entre uma leitura e outra, a segunda acha)
+    """
+    for pasta in (PASTA_JOBS, PASTA_ARQUIVO):
+        try:
+            return (pasta / f"{job_id}{sufixo}").read_text()
+        except FileNotFoundError:
+            continue
+
+    return None
+
+
+def _grava_json(caminho, dados):
+    """
+    temporario com nome unico + replace, quem le nunca ve o json pela metade
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", dir=caminho.parent, suffix=".tmp", delete=False
+    ) as f:
+        f.write(json.dumps(dados, ensure_ascii=False))
+    os.replace(f.name, caminho)
+
+
+def _arquiva(job_id, estado):
+    """
+    Move os arquivos do job terminado para PASTA_ARQUIVO, o {id}.json por ultimo
+    """
+    PASTA_ARQUIVO.mkdir(parents=True, exist_ok=True)
+    for sufixo in (".etapas.jsonl", ".fim.json", ".json"):
+        if _caminho(job_id, sufixo).exists():
+            _caminho(job_id, sufixo).replace(PASTA_ARQUIVO / f"{job_id}{sufixo}")
+
+    if estado.get("status") == "concluido":
+        _concluidos[estado["chave"]] = job_id
+
+
+def _atualiza_job(job_id, **campos) -> dict:
+    """
+    Grava os campos no {id}.json e mantem o indice: job que sai da fila ou do
+    processo vai para o arquivo
+    """
+    with _trava:
+        estado = _ativos.get(job_id) or _le_json(_caminho(job_id)) or {}
+        estado.update(campos)
+        _grava_json(_caminho(job_id), estado)
+
+        if estado["status"] in STATUS_ATIVOS:
+            _ativos[job_id] = estado
+        else:
+            _ativos.pop(job_id, None)
+            _arquiva(job_id, estado)
+
+    return estado
+
+
+def le_job(job_id) -> dict | None:
+    """
+    Estado do job juntando a fila, as etapas e o fim
+    """
+    texto = _le_arquivo_job(job_id)
+    try:
+        estado = json.loads(texto) if texto else None
+    except json.JSONDecodeError:
+        estado = None
+    if estado is None:
+        return None
+
+    linhas = (_le_arquivo_job(job_id, ".etapas.jsonl") or "").splitlines()
+    estado["historico"] = [json.loads(linha) for linha in linhas if linha]
+    estado["etapa"] = estado["historico"][-1][0] if estado["historico"] else None
+
+    if estado["status"] == "rodando":
+        estado.update(_le_json(_caminho(job_id, ".fim.json")) or {})
+
+    return estado
+
+
+def reporta_etapa(etapa):
+    """
+    Marca a etapa atual do job que roda neste processo, fora de um job nao faz
+    nada (o pipeline chama sempre)
+    """
+    if _job_atual is None:
+        return
+
+    with open(_caminho(_job_atual, ".etapas.jsonl"), "a") as f:
+        f.write(json.dumps([etapa, time.time()]) + "\n")
+
+
+def progresso(estado) -> float:
+    """
+    Fracao (0 a 1) das etapas do planejamento ja iniciadas
+    """
+    if estado.get("status") == "concluido":
+        return 1.0
+
+    etapas = list(ETAPAS_PLANEJAMENTO)
+    if estado.get("etapa") not in etapas:
+        return 0.0
+
+    return etapas.index(estado["etapa"]) / len(etapas)
+
+
+def _roda_planejamento(job_id, parametros):
+    """
+    Processo do job: le os inputs temporarios, calcula a afinidade e roda o
+    get_results, gravando etapa e status no json do job
+    """
+    global _job_atual
+    _job_atual = job_id
+
+    # dentro do processo do job (evita import circular com o po_scripts)
+    import pandas as pd
+    from utils.ml_scripts import get_afinidade_df
+    from utils.po_scripts import get_results
+
+    try:
+        df_training = pd.read_csv(Path("dados/temporarios/df_training.csv"))
+        df_consultores = pd.read_csv(Path("dados/temporarios/df_consultores.csv"))
+
+        reporta_etapa("afinidade")
+        df_afinidade = get_afinidade_df(
+            df_training, parametros["usar_afinidade"], parametros["metodo_afinidade"]
+        )
+        get_results(
+            df_afinidade,
+            df_training,
+            df_consultores,
+            parametros["usar_afinidade"],
+            parametros["cobertura"],
+            parametros["multinivel"],
+            data_hora=parametros["data_hora"],
+            perfilar=parametros.get("perfilar", False),
+        )
+        fim = {"status": "concluido", "fim": time.time()}
+
+    except Exception as e:
+        fim = {"status": "erro", "erro": repr(e), "fim": time.time()}
+        raise
+
+    finally:
+        _grava_json(_caminho(job_id, ".fim.json"), fim)
+
+
+def _hash_inputs() -> str:
+    """
+    sha1 dos inputs temporarios do planejamento, recalculado so quando o
+    arquivo muda
+    """
+    h = hashlib.sha1()
+    for caminho in INPUTS_PLANEJAMENTO:
+        info = caminho.stat()
+        chave = (str(caminho), info.st_size, info.st_mtime_ns)
+        if chave not in _hashes_arquivos:
+            _hashes_arquivos[chave] = hashlib.sha1(caminho.read_bytes()).hexdigest()
+        h.update(_hashes_arquivos[chave].encode())
+
+    return h.hexdigest()
+
+
+def chave_planejamento(parametros) -> str:
+    """
+    Pedidos com a mesma chave dao o mesmo resultado: inputs, cobertura,
+    afinidade (o metodo so conta com ela ligada) e multinivel. O perfilar so
+    muda o diagnostico e fica de fora
+    """
+    usar_afinidade = bool(parametros["usar_afinidade"])
+    dados = {
+        "inputs": _hash_inputs(),
+        "cobertura": parametros["cobertura"],
+        "usar_afinidade": usar_afinidade,
+        "metodo_afinidade": (
+            parametros["metodo_afinidade"] if usar_afinidade else None
+        ),
+        "multinivel": bool(parametros["multinivel"]),
+    }
+    return hashlib.sha1(json.dumps(dados, sort_keys=True).encode()).hexdigest()
+
+
+def _carrega_indice():
+    """
+    Monta o indice uma vez por processo do servidor a partir das pastas (jobs de
+    uma execucao anterior); depois so as escritas do _atualiza_job o mantem
+    Jobs ativos de uma execucao anterior (pagina que volta pelo ?job=) ja ligam o
+    despachante, sem esperar um inicia_job
+    """
+    global _indice_carregado
+    with _trava:
+        if _indice_carregado:
+            return
+
+        for pasta in (PASTA_ARQUIVO, PASTA_JOBS):
+            estados = [_le_json(c) for c in pasta.glob("*.json") if "." not in c.stem]
+            estados = sorted((e for e in estados if e and "id" in e), key=_criado)
+            for estado in estados:
+                if estado["status"] in STATUS_ATIVOS:
+                    _ativos[estado["id"]] = estado
+                else:  # terminou e nao chegou a ser arquivado
+                    _arquiva(estado["id"], estado)
+
+        _indice_carregado = True
+        if _ativos:
+            _inicia_despachante()
+
+
+def _criado(estado):
+    return estado["criado"]
+
+
+def _jobs_ativos() -> list[dict]:
+    """
+    Jobs na fila ou rodando, do mais antigo ao mais novo
+    """
+    _carrega_indice()
+    with _trava:
+        return sorted(_ativos.values(), key=_criado)
+
+
+def _resultado_salvo(estado) -> bool:
+    data_hora = estado["parametros"]["data_hora"]
+    return Path(f"dados/resultados/resultado_{data_hora}.parquet").exists()
+
+
+def inicia_job(parametros: dict) -> str:
+    """
+    Coloca o planejamento na fila do servidor e retorna o id do job
+    parametros: usar_afinidade, metodo_afinidade, cobertura, multinivel, perfilar
+    Pedido igual (mesma chave_planejamento) a um que esta na fila ou rodando
+    recebe o id dele, e igual a um ja concluido recebe o resultado pronto
+    """
+    print("inicia_job()")
+    PASTA_JOBS.mkdir(parents=True, exist_ok=True)
+
+    _carrega_indice()
+    with _trava:
+        chave = chave_planejamento(parametros)
+        for estado in reversed(_jobs_ativos()):
+            if estado["chave"] == chave:
+                _atualiza_job(estado["id"], assinantes=estado["assinantes"] + 1)
+                return estado["id"]
+
+        if chave in _concluidos:
+            estado = le_job(_concluidos[chave])
+            if estado and _resultado_salvo(estado):
+                return estado["id"]
+
+        job_id = uuid.uuid4().hex
+        _atualiza_job(
+            job_id,
+            id=job_id,
+            status="na_fila",
+            chave=chave,
+            assinantes=1,
+            parametros={**parametros, "data_hora": novo_run_id()},
+            criado=time.time(),
+        )
+
+    _inicia_despachante()
+    return job_id
+
+
+def _vivo(pid) -> bool:
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def _finaliza_se_terminou(job_id):
+    """
+    Job "rodando" cujo processo acabou: grava no {id}.json o status do fim (ou
+    erro, se o processo morreu sem gravar o fim), o que tambem o arquiva
+    """
+    with _trava:
+        estado = _ativos.get(job_id)
+        if estado is None or estado["status"] != "rodando" or "pid" not in estado:
+            return
+
+        processo = _processos.get(job_id)
+        vivo = processo.is_alive() if processo else _vivo(estado["pid"])
+        if vivo:
+            return
+
+        fim = _le_json(_caminho(job_id, ".fim.json"))
+        if fim is None:
+            fim = {"status": "erro", "erro": "processo do job terminou"}
+        _atualiza_job(job_id, **fim)
+
+
+def consulta_job(job_id) -> dict | None:
+    """
+    Estado do job, finalizando o job "rodando" cujo processo ja acabou
+    """
+    _carrega_indice()
+    _finaliza_se_terminou(job_id)
+
+    return le_job(job_id)
+
+
+def posicao_fila(job_id) -> int | None:
+    """
+    Posicao (1 = proximo) do job na fila, None se nao esta na fila
+    """
+    fila = [e["id"] for e in _jobs_ativos() if e["status"] == "na_fila"]
+    return fila.index(job_id) + 1 if job_id in fila else None
+
+
+def _despacha():
+    """
+    Finaliza os jobs que terminaram e inicia os mais antigos da fila enquanto
+    houver vaga no pool. So olha o indice dos jobs ativos
+    """
+    with _trava:
+        for job_id in list(_ativos):
+            _finaliza_se_terminou(job_id)
+
+        for job_id, processo in list(_processos.items()):
+            if not processo.is_alive():
+                processo.join()  # recolhe o processo
+                del _processos[job_id]
+
+        jobs = _jobs_ativos()
+        rodando = sum(e["status"] == "rodando" for e in jobs)
+        fila = [e for e in jobs if e["status"] == "na_fila"]
+
+        for estado in fila[: max(0, MAX_JOBS_SIMULTANEOS - rodando)]:
+            # spawn: o processo nao herda o estado do streamlit
+            processo = mp.get_context("spawn").Process(
+                target=_roda_planejamento, args=(estado["id"], estado["parametros"])
+            )
+            processo.start()
+            _processos[estado["id"]] = processo
+            _atualiza_job(
+                estado["id"], status="rodando", pid=processo.pid, inicio=time.time()
+            )
+
+
+def _loop_despachante():
+    while True:
+        try:
+            _despacha()
+        except Exception as e:  # a thread nao pode morrer
+            print(f"Erro no despachante de jobs: {e!r}")
+        time.sleep(0.5)
+
+
+def _inicia_despachante():
+    """
+    Uma thread por processo do servidor, compartilhada por todas as sessoes
+    """
+    global _despachante
+    with _trava:
+        if _despachante is None:
+            _despachante = threading.Thread(target=_loop_despachante, daemon=True)
+            _despachante.start()
+
+
+def cancela_job(job_id) -> bool:
+    """
+    Desiste do job. So mata o processo (e os filhos: solver, portfolio) quando
+    ninguem mais espera por ele, senao apenas tira um assinante
+    Retorna True se o job foi cancelado de fato
+    """
+    print("cancela_job()")
+    with _trava:
+        estado = consulta_job(job_id)
+        if estado is None or estado["status"] not in STATUS_ATIVOS:
+            return False
+
+        if estado["assinantes"] > 1:
+            _atualiza_job(job_id, assinantes=estado["assinantes"] - 1)
+            return False
+
+        if "pid" in estado:
+            try:
+                processo = psutil.Process(estado["pid"])
+                alvos = processo.children(recursive=True) + [processo]
+                for alvo in alvos:
+                    alvo.kill()
+                psutil.wait_procs(alvos, timeout=5)  # recolhe (sem zumbi)
+            except psutil.NoSuchProcess:
+                pass
+
+        _atualiza_job(job_id, status="cancelado", fim=time.time())
+
+    return True
@@ -0,0 +1,230 @@
+import os, ctypes, hashlib, platform, subprocess, tempfile
+import numpy as np
+from pathlib import Path
+from sklearn.cluster import KMeans, kmeans_plusplus
+from sklearn.utils import check_random_state
+
+try:
+    import fcntl
+except ImportError:  # windows: sem trava, o os.replace ainda e atomico
+    fcntl = None
+
+FONTE = Path(__file__).with_name("kmeans_nd.c")
+FLAGS_GCC = ["-O3", "-march=native", "-fopenmp", "-shared", "-fPIC"]
+
+_lib = None
+
+
+def _caminho_biblioteca():
+    """
+    Biblioteca na pasta de cache do usuario, fora do codigo: com -march=native
+    o binario so serve para a maquina que compilou, entao o nome leva o hash do
+    fonte, das flags e da maquina (uma home compartilhada guarda uma por maquina)
+    """
+    if os.name == "nt":
+        base = Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+
+    chave = hashlib.sha1(FONTE.read_bytes())
+    for parte in [*FLAGS_GCC, platform.node(), platform.machine()]:
+        chave.update(parte.encode())
+    extensao = ".dll" if os.name == "nt" else ".so"
+
+    return base / "poliedro_kmeans" / f"_kmeans_nd_{chave.hexdigest()[:16]}{extensao}"
+
+
+def _compila(biblioteca):
+    """
+    Compila o kmeans_nd.c com o gcc se a biblioteca ainda nao existe
+    Varios processos (escolhe_k com n_jobs) podem chegar aqui juntos: um compila
+    sob a trava e os outros esperam, e o gcc grava num temporario que so entra
+    no lugar (os.replace) inteiro, entao ninguem carrega um arquivo pela metade
+    """
+    if biblioteca.exists():
+        return
+
+    biblioteca.parent.mkdir(parents=True, exist_ok=True)
+    with open(biblioteca.with_suffix(".lock"), "w") as trava:
+        if fcntl is not None:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+        if biblioteca.exists():  # outro processo compilou enquanto esperavamos
+            return
+
+        print("_compila()")
+        fd, temporario = tempfile.mkstemp(
+            dir=biblioteca.parent, suffix=biblioteca.suffix
+        )
+        os.close(fd)
+        try:
+            subprocess.run(
+                ["gcc", *FLAGS_GCC, str(FONTE), "-o", temporario],
+                check=True,
+                capture_output=True,
+            )
+            os.replace(temporario, biblioteca)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+
+def _carrega():
+    """
+    Retorna a biblioteca nativa, ou None se nao deu pra compilar/carregar
+    (sem gcc, sem OpenMP...)
+    """
+    global _lib
+    if _lib is not None:
+        return _lib or None
+
+    try:
+        biblioteca = _caminho_biblioteca()
+        _compila(biblioteca)
+        lib = ctypes.CDLL(str(biblioteca))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"kmeans nativo indisponivel, usando o sklearn: {e}")
+        _lib = False
+        return None
+
+    for sufixo, tipo in [("f64", ctypes.c_double), ("f32", ctypes.c_float)]:
+        func = getattr(lib, f"kmeans_nd_{sufixo}")
+        func.restype = ctypes.c_int
+        func.argtypes = [
+            ctypes.POINTER(tipo),  # X
+            ctypes.POINTER(ctypes.c_double),  # W (ou NULL)
+            ctypes.POINTER(ctypes.c_double),  # C
+            ctypes.POINTER(ctypes.c_int),  # assign
+            ctypes.c_longlong,  # N
+            ctypes.c_int,  # D
+            ctypes.c_int,  # K
+            ctypes.c_int,  # max_iter
+            ctypes.c_double,  # tol
+            ctypes.c_int,  # n_threads
+            ctypes.POINTER(ctypes.c_int),  # iters_out
+            ctypes.POINTER(ctypes.c_double),  # sse_out
+        ]
+
+    _lib = lib
+    return _lib
+
+
+def disponivel() -> bool:
+    return _carrega() is not None
+
+
+class KMeansNativo:
+    """
+    K-means (Lloyd) d-dimensional em C com OpenMP, mesma interface basica do
+    KMeans do sklearn (fit, fit_predict, predict, labels_, cluster_centers_,
+    inertia_, n_iter_)
+    X float32 ou float64 C-contiguo e passado para o C sem copia
+    Inicializacao k-means++ do sklearn, n_init rodadas e fica a de menor SSE
+    """
+
+    def __init__(
+        self,
+        n_clusters=8,
+        n_init=1,
+        max_iter=300,
+        tol=1e-4,
+        n_threads=0,
+        random_state=None,
+    ):
+        self.n_clusters = n_clusters
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_threads = n_threads  # 0 = padrao do OpenMP
+        self.random_state = random_state
+
+    def fit(self, X, y=None, sample_weight=None):
+        lib = _carrega()
+        if lib is None:
+            raise RuntimeError("biblioteca kmeans_nd indisponivel")
+
+        if X.dtype not in (np.float32, np.float64):
+            X = X.astype(np.float64)
+        X = np.ascontiguousarray(X)  # nao copia se ja for C-contiguo
+        sufixo = "f32" if X.dtype == np.float32 else "f64"
+        tipo = ctypes.c_float if X.dtype == np.float32 else ctypes.c_double
+
+        W = None
+        if sample_weight is not None:
+            W = np.ascontiguousarray(sample_weight, dtype=np.float64)
+
+        n, d = X.shape
+        rng = check_random_state(self.random_state)
+        melhor = None
+
+        for _ in range(self.n_init):
+            C, _ = kmeans_plusplus(
+                X, self.n_clusters, sample_weight=W, random_state=rng
+            )
+            C = np.ascontiguousarray(C, dtype=np.float64)
+            labels = np.empty(n, dtype=np.intc)
+            iters, sse = ctypes.c_int(), ctypes.c_double()
+
+            erro = getattr(lib, f"kmeans_nd_{sufixo}")(
+                X.ctypes.data_as(ctypes.POINTER(tipo)),
+                (
+                    None
+                    if W is None
+                    else W.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+                ),
+                C.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                labels.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                n,
+                d,
+                self.n_clusters,
+                self.max_iter,
+                self.tol,
+                self.n_threads,
+                ctypes.byref(iters),
+                ctypes.byref(sse),
+            )
+            if erro:
+                raise MemoryError("kmeans_nd sem memoria")
+
+            if melhor is None or sse.value < melhor[2]:
+                melhor = (C, labels, sse.value, iters.value)
+
+        (
+            self.cluster_centers_,
+            self.labels_,
+            self.inertia_,
+            self.n_iter_,
+        ) = melhor
+
+        return self
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        distancias = (
+            (X**2).sum(axis=1)[:, None]
+            - 2 * X @ self.cluster_centers_.T
+            + (self.cluster_centers_**2).sum(axis=1)[None, :]
+        )
+        return distancias.argmin(axis=1)
+
+
+def cria_kmeans(n_clusters, n_init=10, random_state=None, max_iter=300):
+    """
+    KMeansNativo se a biblioteca compilou, senao o KMeans do sklearn
+    """
+    if disponivel():
+        return KMeansNativo(
+            n_clusters=n_clusters,
+            n_init=n_init,
+            max_iter=max_iter,
+            random_state=random_state,
+        )
+
+    return KMeans(
+        n_clusters=n_clusters,
+        n_init=n_init,
+        max_iter=max_iter,
+        random_state=random_state,
+    )
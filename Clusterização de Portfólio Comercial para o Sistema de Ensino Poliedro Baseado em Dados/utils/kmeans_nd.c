@@ -0,0 +1,139 @@
+/*
+   K-means (Lloyd) d-dimensional com OpenMP, versao biblioteca do kmeans_final.c
+   da etapa 1 do trabalho de computacao paralela
+
+   Chamado pelo utils/kmeans_nativo.py via ctypes, os arrays sao os buffers
+   do NumPy (C-contiguos, sem copia):
+     X      [N x D]  pontos (float ou double)
+     W      [N]      peso de cada ponto (double), NULL = todos 1
+     C      [K x D]  centroides iniciais, sobrescritos com os finais
+     assign [N]      cluster de cada ponto (saida)
+
+   Compilar: gcc -O3 -march=native -fopenmp -shared -fPIC kmeans_nd.c -o _kmeans_nd.so
+*/
+
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <omp.h>
+
+/* Passo de assignment: retorna o SSE e quantos pontos mudaram de cluster */
+#define DEFINE_ASSIGN(SUFIXO, T)                                                   \
+static double assign_##SUFIXO(const T *X, const double *W, const double *C,        \
+                              int *assign, long long N, int D, int K,              \
+                              long long *mudou_out)                                \
+{                                                                                  \
+    double sse = 0.0;                                                              \
+    long long mudou = 0;                                                           \
+    _Pragma("omp parallel for reduction(+:sse,mudou) schedule(static)")            \
+    for(long long i=0; i<N; i++){                                                  \
+        const T *x = X + i*D;                                                      \
+        double best_dist = INFINITY;                                               \
+        int best_k = 0;                                                            \
+        for(int k=0; k<K; k++){                                                    \
+            const double *c = C + (long long)k*D;                                  \
+            double d = 0.0;                                                        \
+            for(int j=0; j<D; j++){                                                \
+                double diff = (double)x[j] - c[j];                                 \
+                d += diff*diff;                                                    \
+            }                                                                      \
+            if(d < best_dist){ best_dist = d; best_k = k; }                        \
+        }                                                                          \
+        if(assign[i] != best_k){ assign[i] = best_k; mudou++; }                    \
+        sse += W ? W[i]*best_dist : best_dist;                                     \
+    }                                                                              \
+    *mudou_out = mudou;                                                            \
+    return sse;                                                                    \
+}
+
+/* Passo de update: somas (ponderadas) locais por thread, mescladas uma vez por thread
+   Retorna 0 se ok, -1 se faltou memoria para as somas de alguma thread */
+#define DEFINE_UPDATE(SUFIXO, T)                                                   \
+static int update_##SUFIXO(const T *X, const double *W, double *C,                 \
+                           const int *assign, long long N, int D, int K,           \
+                           double *global_sum, double *global_cnt)                 \
+{                                                                                  \
+    int falhou = 0;                                                                \
+    memset(global_sum, 0, (size_t)K*D*sizeof(double));                             \
+    memset(global_cnt, 0, (size_t)K*sizeof(double));                               \
+    _Pragma("omp parallel shared(falhou)")                                         \
+    {                                                                              \
+        double *my_sum = (double*)calloc((size_t)K*D, sizeof(double));             \
+        double *my_cnt = (double*)calloc((size_t)K, sizeof(double));               \
+        if(!my_sum || !my_cnt){                                                    \
+            _Pragma("omp atomic write")                                            \
+            falhou = 1;                                                            \
+        }                                                                          \
+        /* o omp for precisa de todas as threads ou de nenhuma */                  \
+        _Pragma("omp barrier")                                                     \
+        if(!falhou){                                                               \
+            _Pragma("omp for nowait schedule(static)")                             \
+            for(long long i=0; i<N; i++){                                          \
+                int c = assign[i];                                                 \
+                const T *x = X + i*D;                                              \
+                double *s = my_sum + (long long)c*D;                               \
+                double w = W ? W[i] : 1.0;                                         \
+                for(int j=0; j<D; j++) s[j] += w*(double)x[j];                     \
+                my_cnt[c] += w;                                                    \
+            }                                                                      \
+            _Pragma("omp critical")                                                \
+            {                                                                      \
+                for(long long t=0; t<(long long)K*D; t++) global_sum[t] += my_sum[t];\
+                for(int k=0; k<K; k++) global_cnt[k] += my_cnt[k];                 \
+            }                                                                      \
+        }                                                                          \
+        free(my_sum);                                                              \
+        free(my_cnt);                                                              \
+    }                                                                              \
+    if(falhou) return -1;                                                          \
+    /* cluster vazio mantem o centroide anterior */                                \
+    for(int k=0; k<K; k++){                                                        \
+        if(global_cnt[k] <= 0.0) continue;                                         \
+        for(int j=0; j<D; j++)                                                     \
+            C[(long long)k*D + j] = global_sum[(long long)k*D + j] / global_cnt[k];\
+    }                                                                              \
+    return 0;                                                                      \
+}
+
+/*
+   Retorna 0 se ok, -1 se faltou memoria
+   tol: para quando a variacao relativa do SSE for menor que tol
+        ou nenhum ponto mudar de cluster
+*/
+#define DEFINE_KMEANS(SUFIXO, T)                                                   \
+DEFINE_ASSIGN(SUFIXO, T)                                                           \
+DEFINE_UPDATE(SUFIXO, T)                                                           \
+int kmeans_nd_##SUFIXO(const T *X, const double *W, double *C, int *assign,       \
+                       long long N, int D, int K, int max_iter, double tol,        \
+                       int n_threads, int *iters_out, double *sse_out)             \
+{                                                                                  \
+    if(n_threads > 0) omp_set_num_threads(n_threads);                              \
+    double *global_sum = (double*)malloc((size_t)K*D*sizeof(double));              \
+    double *global_cnt = (double*)malloc((size_t)K*sizeof(double));                \
+    if(!global_sum || !global_cnt){ free(global_sum); free(global_cnt); return -1; }\
+                                                                                   \
+    for(long long i=0; i<N; i++) assign[i] = -1;                                   \
+                                                                                   \
+    double prev_sse = INFINITY, sse = 0.0;                                         \
+    long long mudou = 0;                                                           \
+    int it = 0;                                                                    \
+    while(1){                                                                      \
+        sse = assign_##SUFIXO(X, W, C, assign, N, D, K, &mudou);                   \
+        double rel = fabs(sse - prev_sse) / (prev_sse > 0.0 ? prev_sse : 1.0);     \
+        if(mudou == 0 || rel < tol || it >= max_iter) break;                       \
+        prev_sse = sse;                                                            \
+        if(update_##SUFIXO(X, W, C, assign, N, D, K, global_sum, global_cnt)){     \
+            free(global_sum); free(global_cnt); return -1;                         \
+        }                                                                          \
+        it++;                                                                      \
+    }                                                                              \
+                                                                                   \
+    free(global_sum);                                                              \
+    free(global_cnt);                                                              \
+    *iters_out = it;                                                               \
+    *sse_out = sse;                                                                \
+    return 0;                                                                      \
+}
+
+DEFINE_KMEANS(f64, double)
+DEFINE_KMEANS(f32, float)
@@ -0,0 +1,264 @@
+"""
+Planejamento em lote, sem o streamlit
+
+Monta (ou reaproveita) o df_training e roda os cenarios de um arquivo de
+configuracao json, cada um gravando resultado, metricas e manifesto como no app
+Ao final grava um resumo do lote em dados/resultados/lote_{id}.jsonl
+
+Configuracao (campos de um cenario que faltarem usam o CENARIO_PADRAO, e um
+campo com lista vira uma grade, um cenario para cada combinacao):
+    {
+        "cenarios": [
+            {"nome": "base", "cobertura": 0.35},
+            {"nome": "afinidade", "usar_afinidade": true,
+             "metodo_afinidade": "aproximado", "cobertura": [0.25, 0.35, 0.5]}
+        ]
+    }
+
+Uso (a partir da pasta do projeto):
+    python -m utils.lote cenarios.json
+    python -m utils.lote cenarios.json --processos 4
+    python -m utils.lote cenarios.json --reconstruir
+    python -m utils.lote cenarios.json --reconstruir --perfilar
+"""
+
+import argparse, json, time
+import multiprocessing as mp
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from sklearn.model_selection import ParameterGrid
+from utils.inputs_handler import INPUTS, le_input, build_training_df
+from utils.ml_scripts import get_afinidade_df
+from utils.po_scripts import get_results, _consultores_handler, _calcula_distancias
+from utils.manifesto import PASTA_RESULTADOS, le_manifesto, novo_run_id
+from utils.servico import valida_pedido
+
+DF_TRAINING = Path("dados/temporarios/df_training.csv")
+DF_CONSULTORES = Path("dados/temporarios/df_consultores.csv")
+
+CENARIO_PADRAO = {
+    "usar_afinidade": False,
+    "metodo_afinidade": "exato",
+    "cobertura": 0.35,
+    "multinivel": False,
+    "portfolio": False,
+    "busca_local": True,
+    "perfilar": False,
+}
+
+
+def prepara_inputs(reconstruir=False, perfilar=False):
+    """
+    Le os inputs temporarios do app, montando o df_training a partir de
+    dados/inputs quando ainda nao existe (ou com reconstruir)
+    perfilar: perfil da montagem, se ela acontecer
+    Retorna (df_training, df_consultores)
+    """
+    print("prepara_inputs()")
+    if reconstruir or not (DF_TRAINING.exists() and DF_CONSULTORES.exists()):
+        inputs = []
+        for name in INPUTS:
+            arquivo, erro = le_input(name)
+            if erro is not None:
+                raise RuntimeError(f"Erro ao ler o input {name}: {erro!r}")
+            inputs.append(arquivo)
+
+        build_training_df(inputs, perfilar)
+        inputs[1].to_csv(DF_CONSULTORES, index=False)
+
+    return pd.read_csv(DF_TRAINING), pd.read_csv(DF_CONSULTORES)
+
+
+def expande_cenarios(config) -> list[dict]:
+    """
+    Completa cada cenario com o CENARIO_PADRAO e abre as grades (campos com
+    lista), o nome ganha os valores da grade
+    """
+    cenarios = []
+    for i, cenario in enumerate(config["cenarios"]):
+        cenario = {**CENARIO_PADRAO, **cenario}
+        nome = cenario.pop("nome", f"cenario_{i}")
+
+        desconhecidos = set(cenario) - set(CENARIO_PADRAO)
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos no cenario {nome}: {desconhecidos}")
+
+        grade = {k: v for k, v in cenario.items() if isinstance(v, list)}
+        for valores in ParameterGrid(grade) if grade else [{}]:
+            sufixo = "".join(f"_{k}={v}" for k, v in sorted(valores.items()))
+            cenarios.append(_valida({"nome": nome + sufixo, **cenario, **valores}))
+
+    return cenarios
+
+
+def _valida(cenario):
+    """
+    Mesmas regras do servico.planejar (valida_pedido), antes de gastar tempo
+    com o lote
+    """
+    try:
+        valida_pedido(cenario)
+    except ValueError as e:
+        raise ValueError(f"Cenario {cenario['nome']}: {e}") from None
+
+    return cenario
+
+
+def _chave_afinidade(cenario):
+    # sem afinidade o metodo nao muda o df
+    if not cenario["usar_afinidade"]:
+        return (False, None)
+
+    return (True, cenario["metodo_afinidade"])
+
+
+def _roda_cenario(
+    cenario,
+    df_afinidade,
+    df_training,
+    df_consultores,
+    df_consultores_geo,
+    df_distancias,
+):
+    """
+    Roda um cenario (num processo do pool) e retorna a linha do resumo
+    df_afinidade: o erro, se a afinidade do cenario falhou
+    """
+    data_hora = novo_run_id()
+    inicio = time.time()
+    linha = {"nome": cenario["nome"], "data_hora": data_hora, "cenario": cenario}
+
+    try:
+        if isinstance(df_afinidade, Exception):
+            raise df_afinidade
+
+        get_results(
+            df_afinidade,
+            df_training,
+            df_consultores,
+            cenario["usar_afinidade"],
+            cenario["cobertura"],
+            cenario["multinivel"],
+            busca_local=cenario["busca_local"],
+            portfolio=cenario["portfolio"],
+            data_hora=data_hora,
+            perfilar=cenario["perfilar"],
+            df_consultores_geo=df_consultores_geo,
+            df_distancias=df_distancias,
+        )
+        linha["status"] = "concluido"
+
+    except Exception as e:  # um cenario com erro nao derruba o lote
+        linha.update(status="erro", erro=repr(e))
+
+    linha["tempo_s"] = round(time.time() - inicio, 2)
+    return linha
+
+
+def roda_lote(cenarios, df_training, df_consultores, processos=1) -> list[dict]:
+    """
+    Roda os cenarios, ate processos de uma vez
+    Como no servico, a afinidade (uma vez por metodo), a geocodificacao dos
+    consultores e as distancias sao calculadas antes e repassadas aos cenarios
+    (as escolas sao as mesmas em toda afinidade). Um metodo de afinidade com
+    erro so marca os cenarios dele
+    Retorna as linhas do resumo na ordem dos cenarios, com objetivo_km e
+    n_atribuidas do manifesto
+    """
+    print("roda_lote()")
+    afinidades = {}
+    for cenario in cenarios:
+        chave = _chave_afinidade(cenario)
+        if chave not in afinidades:
+            try:
+                afinidades[chave] = get_afinidade_df(df_training, *chave)
+            except Exception as e:
+                print(f"Afinidade {chave} falhou: {e!r}")
+                afinidades[chave] = e
+
+    df_consultores_geo = _consultores_handler(df_consultores)
+    df_distancias = None
+    prontas = [df for df in afinidades.values() if not isinstance(df, Exception)]
+    if prontas and not all(c["multinivel"] for c in cenarios):
+        df_distancias = _calcula_distancias(prontas[0], df_consultores_geo)
+
+    def _args(cenario):
+        df_afinidade = afinidades[_chave_afinidade(cenario)]
+        return (
+            cenario,
+            df_afinidade,
+            df_training,
+            df_consultores,
+            df_consultores_geo,
+            df_distancias,
+        )
+
+    if processos > 1:
+        # spawn: cada processo do pool com o seu estado (modelo, solver)
+        contexto = mp.get_context("spawn")
+        with ProcessPoolExecutor(processos, mp_context=contexto) as pool:
+            futuros = [pool.submit(_roda_cenario, *_args(c)) for c in cenarios]
+            for futuro in as_completed(futuros):
+                linha = futuro.result()
+                print(f"    {linha['nome']}: {linha['status']} ({linha['tempo_s']}s)")
+            linhas = [futuro.result() for futuro in futuros]
+    else:
+        linhas = [_roda_cenario(*_args(c)) for c in cenarios]
+
+    registros = {r["data_hora"]: r for r in le_manifesto()}
+    for linha in linhas:
+        registro = registros.get(linha["data_hora"], {})
+        linha["objetivo_km"] = registro.get("objetivo_km")
+        linha["n_atribuidas"] = registro.get("n_atribuidas")
+
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("config", help="json com a lista de cenarios")
+    parser.add_argument(
+        "--processos",
+        type=int,
+        default=1,
+        help="cenarios rodando ao mesmo tempo (o solver de cada um ja usa threads)",
+    )
+    parser.add_argument(
+        "--reconstruir",
+        action="store_true",
+        help="monta o df_training de novo a partir de dados/inputs",
+    )
+    parser.add_argument(
+        "--perfilar",
+        action="store_true",
+        help="grava o perfil (flame graph e top funcoes) da montagem e dos cenarios",
+    )
+    args = parser.parse_args()
+
+    cenarios = expande_cenarios(json.loads(Path(args.config).read_text()))
+    if args.perfilar:
+        cenarios = [{**c, "perfilar": True} for c in cenarios]
+    df_training, df_consultores = prepara_inputs(args.reconstruir, args.perfilar)
+
+    inicio = time.perf_counter()
+    linhas = roda_lote(cenarios, df_training, df_consultores, args.processos)
+    tempo = time.perf_counter() - inicio
+
+    PASTA_RESULTADOS.mkdir(parents=True, exist_ok=True)
+    caminho = PASTA_RESULTADOS / f"lote_{novo_run_id()}.jsonl"
+    with open(caminho, "w", encoding="utf-8") as f:
+        for linha in linhas:
+            f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+
+    resumo = pd.DataFrame(linhas).set_index("nome")
+    print(resumo[["status", "tempo_s", "objetivo_km", "n_atribuidas"]])
+    print(f"\n{len(linhas)} cenarios em {tempo:.1f}s, resumo em {caminho}")
+
+    erros = sum(linha["status"] == "erro" for linha in linhas)
+    if erros:
+        raise SystemExit(f"{erros} cenario(s) com erro")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os, json, hashlib, tempfile, threading, uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from datetime import datetime
+from pathlib import Path
+
+PASTA_RESULTADOS = Path("dados/resultados")
+MANIFESTO = PASTA_RESULTADOS / "manifesto.jsonl"
+
+LINHAS_POR_BLOCO = 10_000  # linhas do parquet por vez na exportacao do excel
+
+# Uma linha por planejamento salvo:
+#   data_hora, parametros (cobertura, usar_afinidade, multinivel...),
+#   hashes dos inputs, objetivo_km, tempo_s, n_atribuidas e artefatos (caminhos)
+
+_trava_legado = threading.Lock()  # sessoes do streamlit registrando os antigos
+
+
+def novo_run_id() -> str:
+    """
+    Identificador da rodada nos nomes dos arquivos: data_hora + sufixo aleatorio,
+    rodadas no mesmo segundo nao colidem
+    """
+    return f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+def data_do_run(data_hora) -> datetime:
+    """
+    Data da rodada (tambem para as antigas, sem o sufixo)
+    """
+    return datetime.strptime(data_hora[:15], "%Y%m%d_%H%M%S")
+
+
+def hash_df(df: pd.DataFrame) -> str:
+    h = hashlib.sha1(",".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+    return h.hexdigest()
+
+
+def registra_rodada(registro: dict):
+    """
+    Acrescenta o registro da rodada no manifesto (append, nao reescreve)
+    """
+    print("registra_rodada()")
+    with open(MANIFESTO, "a", encoding="utf-8") as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+def _registro_legado(arquivo):
+    """
+    Registro de um resultado salvo antes do manifesto, os parametros vem do
+    nome da aba (ex: "0.35_com_afinidade")
+    """
+    cobertura, afinidade, _ = pd.ExcelFile(arquivo).sheet_names[0].split("_")
+
+    return {
+        "data_hora": arquivo.stem.replace("resultado_", ""),
+        "parametros": {
+            "cobertura": float(cobertura),
+            "usar_afinidade": afinidade == "com",
+        },
+        "artefatos": {"excel": str(arquivo)},
+        "legado": True,
+    }
+
+
+def _le_registros() -> list[dict]:
+    if not MANIFESTO.exists():
+        return []
+
+    with open(MANIFESTO, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+def _faltando(registros) -> list[Path]:
+    registrados = {r["data_hora"] for r in registros}
+    return [
+        arquivo
+        for arquivo in sorted(PASTA_RESULTADOS.glob("resultado_*.xlsx"))
+        if arquivo.stem.replace("resultado_", "") not in registrados
+    ]
+
+
+def le_manifesto() -> list[dict]:
+    """
+    Retorna os registros do manifesto ordenados pela data_hora
+    Resultados antigos sem registro (so o excel) entram no manifesto na primeira
+    leitura, depois disso nenhum excel e aberto aqui
+    """
+    registros = _le_registros()
+
+    if _faltando(registros):
+        with _trava_legado:
+            # rele sob a trava: outra leitura pode ter registrado enquanto esperava
+            registros = _le_registros()
+            for arquivo in _faltando(registros):
+                registro = _registro_legado(arquivo)
+                registra_rodada(registro)
+                registros.append(registro)
+
+    # um registro por rodada, mesmo que outro processo tenha registrado junto
+    unicos = {r["data_hora"]: r for r in registros}
+    return sorted(unicos.values(), key=lambda r: r["data_hora"])
+
+
+def salva_resultado(df_resultado, data_hora, aba) -> Path:
+    """
+    Salva o resultado do planejamento em parquet, com o nome da aba do excel
+    nos metadados (ex: "0.35_com_afinidade")
+    Retorna o caminho do parquet
+    """
+    print("salva_resultado()")
+    caminho = PASTA_RESULTADOS / f"resultado_{data_hora}.parquet"
+
+    tabela = pa.Table.from_pandas(df_resultado, preserve_index=False)
+    metadados = {**(tabela.schema.metadata or {}), b"aba": aba.encode()}
+    pq.write_table(tabela.replace_schema_metadata(metadados), caminho)
+
+    return caminho
+
+
+def le_resultado(registro) -> pd.DataFrame:
+    """
+    Le o resultado de um registro do manifesto (parquet, ou o excel nos
+    resultados antigos)
+    """
+    artefatos = registro["artefatos"]
+    if "parquet" in artefatos:
+        return pd.read_parquet(artefatos["parquet"])
+
+    return pd.read_excel(artefatos["excel"])
+
+
+def exporta_excel(caminho_parquet) -> Path:
+    """
+    Gera o excel do resultado a partir do parquet (so na primeira vez, depois
+    devolve o que ja esta salvo), escrevendo em modo write_only bloco a bloco
+    Retorna o caminho do excel
+    """
+    caminho_parquet = Path(caminho_parquet)
+    caminho_excel = caminho_parquet.with_suffix(".xlsx")
+    if caminho_excel.exists():
+        return caminho_excel
+
+    print("exporta_excel()")
+    arquivo = pq.ParquetFile(caminho_parquet)
+    aba = arquivo.schema_arrow.metadata[b"aba"].decode()
+
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet(aba)
+    planilha.freeze_panes = "B2"
+    planilha.append(arquivo.schema_arrow.names)
+    for bloco in arquivo.iter_batches(batch_size=LINHAS_POR_BLOCO):
+        for linha in zip(*(coluna.to_pylist() for coluna in bloco.columns)):
+            planilha.append(linha)
+
+    # escreve num temporario (nome unico, dois downloads juntos nao se misturam)
+    # para nao deixar um excel pela metade no cache
+    with tempfile.NamedTemporaryFile(
+        dir=caminho_excel.parent, suffix=".tmp", delete=False
+    ) as f:
+        temporario = f.name
+    livro.save(temporario)
+    os.replace(temporario, caminho_excel)
+
+    return caminho_excel
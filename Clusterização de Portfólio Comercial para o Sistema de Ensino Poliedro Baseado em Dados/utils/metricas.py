@@ -0,0 +1,291 @@
+import re, os, sys, json, time, functools, threading
+import pandas as pd
+import psutil
+from contextlib import contextmanager
+from pathlib import Path
+
+PASTA_RESULTADOS = Path("dados/resultados")
+
+# Arquivo jsonl das etapas medidas (@mede_etapa) durante um coleta_etapas, numa
+# variavel de ambiente para os subprocessos (pipeline, lote) herdarem
+VAR_ETAPAS = "PLANEJAMENTO_ETAPAS"
+
+# etapas medidas em andamento neste processo: chave -> [thread, sobreposta]
+_trava_etapas = threading.Lock()
+_em_andamento = {}
+
+_RE_MODELO = re.compile(
+    r"has (?P<linhas>\d+) rows; (?P<colunas>\d+) cols; (?P<nao_zeros>\d+) nonzeros"
+)
+_RE_PRESOLVE = re.compile(
+    r"[Rr]eductions: rows (?P<linhas>\d+)\((?P<linhas_delta>-?\d+)\); "
+    r"columns (?P<colunas>\d+)\((?P<colunas_delta>-?\d+)\); "
+    r"(?:elements|nonzeros) (?P<nao_zeros>\d+)\((?P<nao_zeros_delta>-?\d+)\)"
+)
+# linha da arvore de B&B: [Src] nos fila folhas expl% dual primal gap ... lp_iters tempo
+_RE_BB = re.compile(
+    r"^\s*(?:(?P<src>[A-Za-z])\s+)?(?P<nos>\d+)\s+(?P<fila>\d+)\s+(?P<folhas>\d+)\s+"
+    r"(?P<explorado>[\d.]+)%\s+(?P<dual>\S+)\s+(?P<primal>\S+)\s+(?P<gap>\S+)"
+    r".*?\s(?P<lp_iters>\d+)\s+(?P<tempo>[\d.]+)s\s*$"
+)
+_RE_RELATORIO = {
+    "status": re.compile(r"^\s*Status\s+(.+?)\s*$"),
+    "primal": re.compile(r"^\s*Primal bound\s+(\S+)"),
+    "dual": re.compile(r"^\s*Dual bound\s+(\S+)"),
+    "gap": re.compile(r"^\s*Gap\s+([\d.eE+-]+)%"),
+    "nos": re.compile(r"^\s*Nodes\s+(\d+)"),
+    "lp_iters": re.compile(r"^\s*LP iterations\s+(\d+)"),
+    "tempo_total": re.compile(r"^\s*Timing\s+([\d.]+)"),
+    "tempo_presolve": re.compile(r"^\s*([\d.]+) \(Presolve\)"),
+    "tempo_solve": re.compile(r"^\s*([\d.]+) \(Solve\)"),
+    "tempo_postsolve": re.compile(r"^\s*([\d.]+) \(Postsolve\)"),
+}
+
+
+def _num(texto):
+    """
+    Converte os numeros do log, "inf", "-inf" e "Large" viram None
+    """
+    try:
+        valor = float(texto.rstrip("%"))
+    except ValueError:
+        return None
+
+    return None if valor in (float("inf"), float("-inf")) else valor
+
+
+def parse_log_highs(caminho) -> dict:
+    """
+    Le o log do HiGHS de uma rodada
+
+    Retorna um dict com:
+      - modelo: linhas, colunas e nao zeros originais
+      - presolve: tamanho depois do presolve e quanto foi removido
+      - linha_do_tempo: lista com nos, limitantes primal/dual e gap ao longo do B&B
+      - o relatorio final (status, primal, dual, gap, nos, lp_iters e tempos por fase)
+    """
+    metricas = {"modelo": {}, "presolve": {}, "linha_do_tempo": []}
+
+    for linha in Path(caminho).read_text(errors="ignore").splitlines():
+        if not metricas["modelo"] and (m := _RE_MODELO.search(linha)):
+            metricas["modelo"] = {k: int(v) for k, v in m.groupdict().items()}
+            continue
+
+        if m := _RE_PRESOLVE.search(linha):
+            metricas["presolve"] = {k: int(v) for k, v in m.groupdict().items()}
+            continue
+
+        if m := _RE_BB.match(linha):
+            metricas["linha_do_tempo"].append(
+                {
+                    "fonte": m["src"] or "",
+                    "nos": int(m["nos"]),
+                    "dual": _num(m["dual"]),
+                    "primal": _num(m["primal"]),
+                    "gap": _num(m["gap"]),
+                    "lp_iters": int(m["lp_iters"]),
+                    "tempo": float(m["tempo"]),
+                }
+            )
+            continue
+
+        for chave, padrao in _RE_RELATORIO.items():
+            if chave not in metricas and (m := padrao.match(linha)):
+                valor = m.group(1)
+                if chave == "status":
+                    metricas[chave] = valor
+                elif chave in ["nos", "lp_iters"]:
+                    metricas[chave] = int(valor)
+                else:
+                    metricas[chave] = _num(valor)
+                break
+
+    return metricas
+
+
+def registra_metricas(data_hora: str, infos: dict) -> dict:
+    """
+    Junta as infos da rodada (tamanho da carteira, consultores, parametros) com as
+    metricas do log do solver e salva em dados/resultados/metricas_{data_hora}.json
+    """
+    print("registra_metricas()")
+    metricas = {"data_hora": data_hora, **infos}
+
+    caminho_log = PASTA_RESULTADOS / f"log_{data_hora}.txt"
+    if caminho_log.exists():
+        metricas["solver"] = parse_log_highs(caminho_log)
+
+    with open(PASTA_RESULTADOS / f"metricas_{data_hora}.json", "w") as f:
+        json.dump(metricas, f, indent=4)
+
+    return metricas
+
+
+def get_historico_metricas() -> pd.DataFrame:
+    """
+    Retorna um df com uma linha por rodada salva, ordenado pela data, com o tamanho
+    da instancia e o desempenho do solver
+    """
+    linhas = []
+    for arquivo in sorted(PASTA_RESULTADOS.glob("metricas_*.json")):
+        metricas = json.loads(arquivo.read_text())
+        solver = metricas.pop("solver", {})
+        solver.pop("linha_do_tempo", None)
+
+        linha = {k: v for k, v in metricas.items() if not isinstance(v, (dict, list))}
+        linha.update({k: v for k, v in solver.items() if not isinstance(v, dict)})
+        linha["variaveis"] = solver.get("modelo", {}).get("colunas")
+        linha["colunas_pos_presolve"] = solver.get("presolve", {}).get("colunas")
+        linhas.append(linha)
+
+    df = pd.DataFrame(linhas)
+    if not df.empty:
+        df["data_hora"] = pd.to_datetime(
+            df["data_hora"].str[:15], format="%Y%m%d_%H%M%S"
+        )
+
+    return df
+
+
+def _pico_rss() -> int:
+    """
+    Maior memoria residente (bytes) que o processo ja usou
+    """
+    info = psutil.Process().memory_info()
+    if hasattr(info, "peak_wset"):  # windows
+        return info.peak_wset
+
+    import resource
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024  # linux em KB
+
+
+def _cpu_subprocessos() -> float:
+    # subprocessos ja terminados do processo todo (o HiGHS_CMD do _run_optimizer)
+    t = psutil.Process().cpu_times()
+    return t.children_user + t.children_system
+
+
+def _entra_etapa():
+    """
+    Marca a etapa como em andamento; ela e as que ja rodam em outras threads
+    ficam sobrepostas (chamadas aninhadas na mesma thread nao contam)
+    """
+    chave, thread = object(), threading.get_ident()
+    with _trava_etapas:
+        sobreposta = False
+        for estado in _em_andamento.values():
+            if estado[0] != thread:
+                estado[1] = sobreposta = True
+        _em_andamento[chave] = [thread, sobreposta]
+
+    return chave
+
+
+def _sai_etapa(chave) -> bool:
+    """
+    Retorna se outra etapa rodou junto em outra thread deste processo
+    """
+    with _trava_etapas:
+        return _em_andamento.pop(chave)[1]
+
+
+def _linhas(valor):
+    if isinstance(valor, tuple):
+        valor = next((v for v in valor if isinstance(v, pd.DataFrame)), None)
+
+    return len(valor) if isinstance(valor, pd.DataFrame) else None
+
+
+def mede_etapa(func):
+    """
+    Decorator das etapas do pipeline: dentro de um coleta_etapas grava tempo,
+    cpu da thread da etapa, linhas do primeiro df de entrada e do df de saida e
+    as medidas que so existem para o processo todo: cpu dos subprocessos
+    terminados e aumento do pico de memoria. Essas ficam None (sobreposta) se
+    outra etapa rodou ao mesmo tempo em outra thread, porque nao da para
+    separar o que e de cada uma. Fora do coleta_etapas so chama a funcao
+    """
+
+    @functools.wraps(func)
+    def medida(*args, **kwargs):
+        caminho = os.environ.get(VAR_ETAPAS)
+        if caminho is None:
+            return func(*args, **kwargs)
+
+        entrada = next(
+            (len(a) for a in args if isinstance(a, pd.DataFrame)),
+            None,
+        )
+        chave = _entra_etapa()
+        pico, subprocessos = _pico_rss(), _cpu_subprocessos()
+        cpu, inicio = time.thread_time(), time.perf_counter()
+        try:
+            resultado = func(*args, **kwargs)
+        finally:
+            sobreposta = _sai_etapa(chave)
+        tempo = time.perf_counter() - inicio
+
+        registro = {
+            "etapa": func.__name__,
+            "fim": time.time(),
+            "tempo_s": round(tempo, 4),
+            "cpu_s": round(time.thread_time() - cpu, 4),
+            "cpu_subprocessos_s": (
+                None if sobreposta else round(_cpu_subprocessos() - subprocessos, 4)
+            ),
+            "pico_rss_mb": (
+                None if sobreposta else round((_pico_rss() - pico) / 2**20, 1)
+            ),
+            "sobreposta": sobreposta,
+            "linhas_entrada": entrada,
+            "linhas_saida": _linhas(resultado),
+            "pid": os.getpid(),
+        }
+        # uma linha por escrita em modo append, threads e processos nao se misturam
+        with open(caminho, "a") as f:
+            f.write(json.dumps(registro) + "\n")
+
+        return resultado
+
+    return medida
+
+
+@contextmanager
+def coleta_etapas(caminho):
+    """
+    Grava em caminho (jsonl, recomecado) as etapas medidas dentro do bloco,
+    inclusive em threads e subprocessos iniciados nele
+    """
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    caminho.unlink(missing_ok=True)
+
+    anterior = os.environ.get(VAR_ETAPAS)
+    os.environ[VAR_ETAPAS] = str(caminho)
+    try:
+        yield caminho
+    finally:
+        if anterior is None:
+            del os.environ[VAR_ETAPAS]
+        else:
+            os.environ[VAR_ETAPAS] = anterior
+
+
+def le_etapas(caminho=None) -> list[dict]:
+    """
+    Etapas gravadas em caminho (padrao: a coleta em andamento), na ordem em que
+    terminaram
+    """
+    caminho = caminho or os.environ.get(VAR_ETAPAS)
+    if caminho is None or not Path(caminho).exists():
+        return []
+
+    linhas = Path(caminho).read_text().splitlines()
+    # campos que etapas gravadas antes nao tinham
+    padrao = {"cpu_subprocessos_s": None, "sobreposta": False}
+    return sorted(
+        ({**padrao, **json.loads(linha)} for linha in linhas if linha),
+        key=lambda e: e["fim"],
+    )
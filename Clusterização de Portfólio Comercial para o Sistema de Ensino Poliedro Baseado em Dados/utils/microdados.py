@@ -0,0 +1,179 @@
+import fnmatch, json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from pathlib import Path
+
+PASTA_INPUTS = Path("dados/inputs")
+PASTA_CACHE = Path("dados/temporarios")
+
+TAMANHO_BLOCO = 16 << 20  # bytes de csv por bloco lido
+BLOCOS_POR_CONSOLIDACAO = 20  # junta as somas parciais a cada N blocos
+
+# Microdados por matricula/docente do censo escolar (opcionais em dados/inputs)
+# Cada feature conta as linhas da escola com coluna em valores, e vira tambem
+# uma proporcao sobre o total da fonte
+FONTES = {
+    "matriculas": {
+        "arquivos": ["matricula*.csv"],  # o INEP separa por regiao (MATRICULA_CO...)
+        "features": {
+            "mat_infantil": ("TP_ETAPA_ENSINO", [1, 2]),
+            "mat_fund_ai": ("TP_ETAPA_ENSINO", [14, 15, 16, 17, 18]),
+            "mat_fund_af": ("TP_ETAPA_ENSINO", [19, 20, 21, 41]),
+            "mat_medio": ("TP_ETAPA_ENSINO", list(range(25, 39))),
+            "mat_integral": ("IN_TEMPO_INTEGRAL", [1]),
+            "mat_transporte": ("IN_TRANSPORTE_PUBLICO", [1]),
+        },
+    },
+    "docentes": {
+        "arquivos": ["docentes*.csv"],
+        "features": {
+            "doc_superior": ("TP_ESCOLARIDADE", [4]),
+            "doc_especializacao": ("IN_ESPECIALIZACAO", [1]),
+            "doc_mestrado": ("IN_MESTRADO", [1]),
+            "doc_doutorado": ("IN_DOUTORADO", [1]),
+            "doc_licenciatura": ("IN_LICENCIATURA_1", [1]),
+        },
+    },
+}
+
+
+def _arquivos_fonte(padroes, pasta=PASTA_INPUTS):
+    """
+    Arquivos da pasta que batem com algum padrao (sem diferenciar maiusculas)
+    """
+    if not pasta.exists():
+        return []
+
+    return sorted(
+        p
+        for p in pasta.iterdir()
+        if any(fnmatch.fnmatch(p.name.lower(), padrao) for padrao in padroes)
+    )
+
+
+def _abre_csv(caminho, colunas, encoding="latin1"):
+    """
+    Leitor em blocos so com as colunas pedidas, todas como inteiro
+    O separador ("|" nos censos antigos, ";" nos novos) vem do cabecalho
+    """
+    with open(caminho, encoding=encoding) as f:
+        cabecalho = f.readline()
+    sep = "|" if cabecalho.count("|") > cabecalho.count(";") else ";"
+    existentes = set(cabecalho.strip().split(sep))
+
+    colunas = [c for c in colunas if c in existentes]
+    leitor = pv.open_csv(
+        caminho,
+        read_options=pv.ReadOptions(encoding=encoding, block_size=TAMANHO_BLOCO),
+        parse_options=pv.ParseOptions(delimiter=sep),
+        convert_options=pv.ConvertOptions(
+            include_columns=colunas,
+            column_types={c: pa.int64() for c in colunas},
+        ),
+    )
+
+    return leitor, colunas
+
+
+def _soma_bloco(lote, features, escolas):
+    """
+    Soma das features por CO_ENTIDADE num bloco, como df
+    """
+    tabela = pa.Table.from_batches([lote])
+    if escolas is not None:
+        tabela = tabela.filter(pc.is_in(tabela["CO_ENTIDADE"], value_set=escolas))
+
+    colunas = {
+        "CO_ENTIDADE": tabela["CO_ENTIDADE"],
+        "_total": pa.repeat(1, len(tabela)),
+    }
+    for nome, (coluna, valores) in features.items():
+        indicador = pc.is_in(tabela[coluna], value_set=pa.array(valores, pa.int64()))
+        colunas[nome] = pc.cast(pc.fill_null(indicador, False), pa.int64())
+
+    somas = (
+        pa.table(colunas)
+        .group_by("CO_ENTIDADE")
+        .aggregate([(c, "sum") for c in colunas if c != "CO_ENTIDADE"])
+    )
+
+    return somas.to_pandas().rename(columns=lambda c: c.removesuffix("_sum"))
+
+
+def _consolida(parciais):
+    return pd.concat(parciais).groupby("CO_ENTIDADE", as_index=False).sum()
+
+
+def agrega_fonte(fonte, arquivos, escolas=None):
+    """
+    Le os arquivos da fonte em blocos e agrega por CO_ENTIDADE com memoria
+    limitada (no maximo BLOCOS_POR_CONSOLIDACAO somas parciais por vez)
+    escolas: CO_ENTIDADE de interesse, as outras linhas sao descartadas no bloco
+    Retorna um df com CO_ENTIDADE, {fonte}_total, as features e as proporcoes
+    """
+    print(f"agrega_fonte({fonte})")
+    features = FONTES[fonte]["features"]
+    if escolas is not None:
+        escolas = pa.array(list(escolas), pa.int64())
+
+    parciais = []
+    for caminho in arquivos:
+        colunas = ["CO_ENTIDADE"] + list({c for c, _ in features.values()})
+        leitor, colunas = _abre_csv(caminho, colunas)
+
+        faltando = [n for n, (c, _) in features.items() if c not in colunas]
+        if faltando:
+            print(f"{caminho.name} sem as colunas de: {faltando}")
+        features_arquivo = {n: f for n, f in features.items() if n not in faltando}
+
+        for lote in leitor:
+            parciais.append(_soma_bloco(lote, features_arquivo, escolas))
+            if len(parciais) >= BLOCOS_POR_CONSOLIDACAO:
+                parciais = [_consolida(parciais)]
+
+    df = _consolida(parciais).fillna(0)
+    df = df.rename(columns={"_total": f"{fonte}_total"})
+
+    for nome in features:
+        if nome not in df.columns:
+            df[nome] = 0
+        df[f"{nome}_pct"] = df[nome] / df[f"{fonte}_total"]
+
+    return df
+
+
+def _assinatura(arquivos):
+    return [[p.name, p.stat().st_size, p.stat().st_mtime] for p in arquivos]
+
+
+def get_features_microdados():
+    """
+    Retorna um df por fonte de microdados encontrada em dados/inputs, ja
+    agregado por CO_ENTIDADE (todas as escolas, o merge filtra depois)
+    O resultado fica em cache (parquet) enquanto os arquivos nao mudarem
+    """
+    print("get_features_microdados()")
+    dfs = []
+    for fonte, config in FONTES.items():
+        arquivos = _arquivos_fonte(config["arquivos"])
+        if not arquivos:
+            continue
+
+        cache = PASTA_CACHE / f"microdados_{fonte}.parquet"
+        assinatura = PASTA_CACHE / f"microdados_{fonte}.json"
+        if (
+            cache.exists()
+            and assinatura.exists()
+            and json.loads(assinatura.read_text()) == _assinatura(arquivos)
+        ):
+            dfs.append(pd.read_parquet(cache))
+            continue
+
+        df = agrega_fonte(fonte, arquivos)
+        df.to_parquet(cache, index=False)
+        assinatura.write_text(json.dumps(_assinatura(arquivos)))
+        dfs.append(df)
+
+    return dfs
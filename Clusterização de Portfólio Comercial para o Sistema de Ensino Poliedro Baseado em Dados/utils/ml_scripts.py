@@ -1,23 +1,51 @@
 import numpy as np
+import pandas as pd
+import os, hashlib, json, joblib, tempfile, threading
+from pathlib import Path
+from joblib import Parallel, delayed
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from sklearn.svm import OneClassSVM
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
 from sklearn.model_selection import ParameterGrid
+from utils.propensao import calcula_propensao, salva_propensao
 
+MODELO_AFINIDADE = Path("dados/temporarios/modelo_afinidade.joblib")
 
-def get_afinidade_df(df_training, use_ml: bool):
+# Escolas pontuadas por vez, limita a memoria do decision_function
+TAMANHO_BLOCO = 50_000
+
+# Modelo aproximado: kernel RBF via Nystroem + SVM de uma classe linear (SGD)
+N_COMPONENTES_NYSTROEM = 300
+NU_APROXIMADO = 0.05
+
+
+METODOS_AFINIDADE = ("exato", "aproximado", "propensao")
+
+
+def get_afinidade_df(df_training, use_ml: bool, metodo="exato"):
     """
     Remove as escolas com ban
+    metodo: "exato" (OneClassSVM), "aproximado" (Nystroem + SGDOneClassSVM) ou
+    "propensao" (distancia ao cluster dos clientes, ver utils/propensao.py)
     Retorna um df com as colunas CO_ENTIDADE, valor_venda, afinidade, lat, lon
     """
     print("=======> get_afinidade_df()")
     # Remove as escolas banidas
     df_afinidade = df_training[df_training["cliente"] != -1].copy()
 
-    if use_ml:
-        df_afinidade["afinidade"] = _ocsvm_prob(df_afinidade)
+    if use_ml and metodo == "propensao":
+        df_afinidade["afinidade"] = _propensao_prob(df_afinidade)
+    elif use_ml:
+        modelo = _le_modelo_afinidade(df_training, metodo)
+        if modelo is None:
+            df_afinidade["afinidade"] = _ocsvm_prob(df_afinidade, metodo=metodo)
+        elif "afinidade" not in df_afinidade.columns:
+            df_afinidade["afinidade"] = _pontua_ocsvm(modelo, df_afinidade)
+        # senao a coluna ja foi precalculada no build_training_df
     else:
         df_afinidade["afinidade"] = 1
 
@@ -31,7 +59,45 @@ def get_afinidade_df(df_training, use_ml: bool):
     return df_afinidade
 
 
-def _ocsvm_prob(df, label_col="cliente"):
+def precalcula_afinidade(df_training, metodo="exato"):
+    """
+    Treina o modelo de afinidade com as escolas nao banidas, salva o modelo junto
+    do df_training (chaveado pelo hash dele) e retorna a coluna afinidade
+    (NaN para as escolas banidas)
+    """
+    print("precalcula_afinidade()")
+    df = df_training[df_training["cliente"] != -1]
+
+    modelo = _treina_ocsvm(df, metodo=metodo)
+    joblib.dump({"hash": _hash_treino(df_training), **modelo}, MODELO_AFINIDADE)
+
+    afinidade = pd.Series(_pontua_ocsvm(modelo, df), index=df.index)
+
+    return afinidade.reindex(df_training.index)
+
+
+def _hash_treino(df_training) -> str:
+    return _hash_features(df_training.drop(columns="afinidade", errors="ignore"))
+
+
+def _le_modelo_afinidade(df_training, metodo="exato"):
+    """
+    Retorna o modelo salvo se ele foi treinado com esse df_training e metodo,
+    senao None
+    """
+    if not MODELO_AFINIDADE.exists():
+        return None
+
+    modelo = joblib.load(MODELO_AFINIDADE)
+    if modelo.get("metodo", "exato") != metodo:
+        return None
+    if modelo["hash"] != _hash_treino(df_training):
+        return None
+
+    return modelo
+
+
+def _ocsvm_prob(df, label_col="cliente", metodo="exato"):
     """
     Retorna uma lista (len=df) com um score de "quão provável" cada linha é (mais alto = mais parecido
     com os clientes conhecidos, label==1), usando One-Class SVM.
@@ -39,22 +105,44 @@ def _ocsvm_prob(df, label_col="cliente"):
     Entradas mínimas:
       - df: DataFrame
       - label_col: coluna binária (1 = cliente conhecido)
-      - pca_var: variância explicada do PCA (use None para desativar PCA)
+      - metodo: "exato" (OneClassSVM RBF) ou "aproximado" (Nystroem + SGDOneClassSVM,
+        linear no numero de clientes, para universos grandes de escolas)
 
     Saída:
       - list[float]: scores (decision_function), na mesma ordem do df
     """
 
+    return _pontua_ocsvm(_treina_ocsvm(df, label_col, metodo), df)
+
+
+def _propensao_prob(df, label_col="cliente"):
+    """
+    PROPENSAO_% do motor de propensao em [0, 1], segmentando as escolas pela
+    nota_enem, o resultado completo fica salvo em dados/temporarios/propensao.parquet
+    """
+    df_propensao, df_pesos = calcula_propensao(
+        df, target=label_col, col_notas="nota_enem", cols_enem=["nota_enem"]
+    )
+    salva_propensao(df_propensao, df_pesos)
+
+    return df_propensao["PROPENSAO_%"] / 100
+
+
+def _treina_ocsvm(df, label_col="cliente", metodo="exato"):
+    """
+    Ajusta o pre-processamento e o One-Class SVM nos clientes conhecidos
+    Retorna um dict com "metodo", "features", "pipeline" e os limites "s_min",
+    "s_max" dos scores em df, usados na normalizacao
+    """
     df_pos = df[df[label_col] == 1]
 
     features = [
         c
         for c in df.select_dtypes(include=[np.number]).columns
-        if c not in [label_col, "CO_ENTIDADE", "CO_CEP", "lat", "lon"]
+        if c not in [label_col, "CO_ENTIDADE", "CO_CEP", "lat", "lon", "afinidade"]
     ]
 
     X_pos = df_pos[features]
-    X_all = df[features]
 
     steps = [
         ("imputer", SimpleImputer(strategy="median")),
@@ -65,42 +153,85 @@ def _ocsvm_prob(df, label_col="cliente"):
     pre = Pipeline(steps)
 
     X_pos_proc = pre.fit_transform(X_pos)
-    X_all_proc = pre.transform(X_all)
 
+    if metodo == "aproximado":
+        # gamma equivalente ao "scale" do OneClassSVM
+        gamma = 1 / (X_pos_proc.shape[1] * X_pos_proc.var())
+        final = [
+            (
+                "nystroem",
+                Nystroem(
+                    gamma=gamma,
+                    n_components=min(N_COMPONENTES_NYSTROEM, X_pos_proc.shape[0]),
+                    random_state=2025,
+                ),
+            ),
+            ("ocsvm", SGDOneClassSVM(nu=NU_APROXIMADO, random_state=2025)),
+        ]
+        Pipeline(final).fit(X_pos_proc)
+    else:
+        final = [("ocsvm", _treina_ocsvm_exato(X_pos, X_pos_proc))]
+
+    pipeline = Pipeline(steps + final)
+    scores = _decision_em_blocos(pipeline, df[features])
+
+    return {
+        "metodo": metodo,
+        "features": features,
+        "pipeline": pipeline,
+        "s_min": scores.min(),
+        "s_max": scores.max(),
+    }
+
+
+def _treina_ocsvm_exato(X_pos, X_pos_proc):
     param_grid = {
         "nu": [0.01, 0.03, 0.05, 0.1],
         "gamma": ["scale", "auto", 0.01, 0.001],
     }
 
-    rng = np.random.default_rng(seed=2025)
-    idx = rng.permutation(X_pos_proc.shape[0])
-    mid = max(1, X_pos_proc.shape[0] // 2)
-    mid = min(mid, X_pos_proc.shape[0] - 1)
-    A, B = X_pos_proc[idx[:mid]], X_pos_proc[idx[mid:]]
+    chave = _hash_features(X_pos)
+    best_params = _le_cache_params(chave)
 
-    # Escolhe parametros que maximizam score medio em positivos "held-out"
-    best_score, best_params = -np.inf, None
-    for params in ParameterGrid(param_grid):
-        oc = OneClassSVM(kernel="rbf", **params)
+    if best_params is None:
+        rng = np.random.default_rng(seed=2025)
+        idx = rng.permutation(X_pos_proc.shape[0])
+        mid = max(1, X_pos_proc.shape[0] // 2)
+        mid = min(mid, X_pos_proc.shape[0] - 1)
+        A, B = X_pos_proc[idx[:mid]], X_pos_proc[idx[mid:]]
 
-        oc.fit(A)
-        s1 = oc.decision_function(B).mean()
+        # Escolhe parametros que maximizam score medio em positivos "held-out"
+        best_params = _busca_params(A, B, param_grid)
+        _salva_cache_params(chave, best_params)
 
-        oc.fit(B)
-        s2 = oc.decision_function(A).mean()
-
-        s = max(s1, s2)
-        if s > best_score:
-            best_score, best_params = s, params
-
-    # Treino final e scores
+    # Treino final
     oc_final = OneClassSVM(kernel="rbf", **best_params)
     oc_final.fit(X_pos_proc)
-    scores = oc_final.decision_function(X_all_proc)
+
+    return oc_final
+
+
+def _decision_em_blocos(pipeline, X):
+    """
+    decision_function em blocos de TAMANHO_BLOCO linhas
+    """
+    return np.concatenate(
+        [
+            pipeline.decision_function(X.iloc[i : i + TAMANHO_BLOCO])
+            for i in range(0, len(X), TAMANHO_BLOCO)
+        ]
+    )
+
+
+def _pontua_ocsvm(modelo, df):
+    """
+    Scores do modelo em df normalizados para [0, 1]
+    """
+    scores = _decision_em_blocos(modelo["pipeline"], df[modelo["features"]])
 
     # normalização para [0, 1]
-    s_min = scores.min()
-    s_max = scores.max()
+    s_min = modelo["s_min"]
+    s_max = modelo["s_max"]
 
     if s_max == s_min:
         probs = np.zeros_like(scores)
@@ -108,3 +239,92 @@ def _ocsvm_prob(df, label_col="cliente"):
         probs = (scores - s_min) / (s_max - s_min)
 
     return probs
+
+
+CACHE_PARAMS = Path("dados/temporarios/ocsvm_params.json")
+_trava_cache = threading.Lock()  # le-altera-grava do cache, entre threads
+
+
+def _hash_features(X: pd.DataFrame) -> str:
+    """
+    Hash da matriz de features (colunas + valores), muda se a base de clientes mudar
+    """
+    h = hashlib.sha1(",".join(map(str, X.columns)).encode())
+    h.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+
+    return h.hexdigest()
+
+
+def _le_cache() -> dict:
+    # um json pela metade ou corrompido vale como cache vazio (a busca roda de novo)
+    try:
+        return json.loads(CACHE_PARAMS.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _le_cache_params(chave):
+    return _le_cache().get(chave)
+
+
+def _salva_cache_params(chave, params):
+    """
+    Grava num temporario com nome unico e troca com os.replace, quem le ao
+    mesmo tempo ve o cache antigo ou o novo, nunca um json pela metade
+    """
+    with _trava_cache:
+        cache = _le_cache()
+        cache[chave] = params
+
+        CACHE_PARAMS.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=CACHE_PARAMS.parent, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(cache, f, indent=4)
+        os.replace(f.name, CACHE_PARAMS)
+
+
+def _avalia_params(params, A, B):
+    """
+    Treina em uma metade dos positivos e pontua na outra, nos dois sentidos
+    """
+    oc = OneClassSVM(kernel="rbf", **params)
+
+    oc.fit(A)
+    s1 = oc.decision_function(B).mean()
+
+    oc.fit(B)
+    s2 = oc.decision_function(A).mean()
+
+    return max(s1, s2)
+
+
+def _busca_params(A, B, param_grid, n_jobs=-1, n_min=200):
+    """
+    Successive halving sobre o grid, avaliado em paralelo (processos):
+    a cada rodada metade dos candidatos é descartada e a amostra dobra,
+    a ultima rodada usa as metades completas
+    n_min: tamanho minimo da amostra de cada metade
+    Retorna os melhores parametros
+    """
+    print("_busca_params()")
+    candidatos = list(ParameterGrid(param_grid))
+    n = min(len(A), len(B))
+
+    n_rodadas = int(np.ceil(np.log2(len(candidatos))))
+    tamanhos = [max(n_min, n // 2 ** (n_rodadas - r)) for r in range(n_rodadas)]
+
+    with Parallel(n_jobs=n_jobs) as paralelo:
+        for tamanho in tamanhos:
+            if tamanho >= n or len(candidatos) == 1:
+                break
+
+            scores = paralelo(
+                delayed(_avalia_params)(p, A[:tamanho], B[:tamanho]) for p in candidatos
+            )
+            ordem = np.argsort(scores)[::-1]
+            candidatos = [candidatos[i] for i in ordem[: max(1, len(candidatos) // 2)]]
+
+        scores = paralelo(delayed(_avalia_params)(p, A, B) for p in candidatos)
+
+    return candidatos[int(np.argmax(scores))]
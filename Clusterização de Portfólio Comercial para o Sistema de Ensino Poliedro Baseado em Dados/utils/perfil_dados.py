@@ -0,0 +1,213 @@
+"""
+Perfil de qualidade dos dados a partir dos metadados do Parquet
+
+Nulos, min e max vem das estatisticas dos row groups (sem ler os dados),
+uma coluna so e lida quando alguma estatistica esta faltando
+
+Uso (a partir da pasta do projeto):
+    python -m utils.perfil_dados dados/inputs/microdados_ed_basica.parquet
+    python -m utils.perfil_dados dados/inputs/microdados_ed_basica.csv --converter
+"""
+
+import re, argparse, time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from pathlib import Path
+
+LIMITE_EXCLUIR = 50  # % de dados ausentes
+BLOCO_BYTES = 64 << 20  # bloco do leitor do csv, os tipos saem do primeiro
+
+
+def _tipo_mais_largo(tipo):
+    """
+    Proximo degrau (inteiro -> float64 -> texto) para uma coluna com um valor
+    que nao coube no tipo
+    """
+    if pa.types.is_integer(tipo):
+        return pa.float64()
+
+    return pa.string()
+
+
+def converte_para_parquet(
+    caminho_csv, caminho_parquet=None, sep=";", encoding="latin1"
+):
+    """
+    Converte o csv em parquet lendo em blocos (memoria limitada), cada bloco
+    vira um row group com as estatisticas de cada coluna
+    Os tipos sao inferidos no primeiro bloco: se um bloco seguinte tem um valor
+    que nao cabe (ArrowInvalid), a coluna sobe um degrau no _tipo_mais_largo e a
+    conversao recomeca
+    Retorna o caminho do parquet
+    """
+    print("converte_para_parquet()")
+    caminho_csv = Path(caminho_csv)
+    caminho_parquet = Path(caminho_parquet or caminho_csv.with_suffix(".parquet"))
+
+    def _abre(tipos):
+        return pv.open_csv(
+            caminho_csv,
+            read_options=pv.ReadOptions(encoding=encoding, block_size=BLOCO_BYTES),
+            parse_options=pv.ParseOptions(delimiter=sep),
+            convert_options=pv.ConvertOptions(
+                strings_can_be_null=True, column_types=tipos
+            ),
+        )
+
+    # tipos inferidos no primeiro bloco, colunas vazias nele ficam como texto
+    leitor = _abre({})
+    tipos = {c.name: pa.string() for c in leitor.schema if pa.types.is_null(c.type)}
+
+    while True:
+        leitor = _abre(tipos)
+        try:
+            with pq.ParquetWriter(caminho_parquet, leitor.schema) as escritor:
+                for bloco in leitor:
+                    escritor.write_table(pa.Table.from_batches([bloco]))
+            return caminho_parquet
+
+        except pa.ArrowInvalid as e:
+            # ex: "In CSV column #12: CSV conversion error to int64: invalid value"
+            achado = re.search(r"column #(\d+)", str(e))
+            if achado is None:
+                raise
+            coluna = leitor.schema.field(int(achado[1]))
+            if pa.types.is_string(coluna.type):
+                raise
+            tipos[coluna.name] = _tipo_mais_largo(coluna.type)
+            print(f"Coluna {coluna.name}: {coluna.type} -> {tipos[coluna.name]}")
+
+
+def _estatisticas_coluna(metadados, i):
+    """
+    Junta as estatisticas da coluna i de todos os row groups
+    Retorna um dict com nulos, min e max (None quando algum row group nao tem)
+    """
+    nulos, minimos, maximos = 0, [], []
+
+    for rg in range(metadados.num_row_groups):
+        stats = metadados.row_group(rg).column(i).statistics
+
+        if stats is None or not stats.has_null_count:
+            nulos = None
+        elif nulos is not None:
+            nulos += stats.null_count
+
+        # row group so de nulos nao tem min/max, e nao muda o resultado
+        if stats is not None and stats.has_min_max:
+            minimos.append(stats.min)
+            maximos.append(stats.max)
+        elif stats is None or stats.null_count != metadados.row_group(rg).num_rows:
+            minimos = maximos = None
+            break
+
+    return {
+        "nulos": nulos,
+        "min": min(minimos) if minimos else None,
+        "max": max(maximos) if maximos else None,
+        "completo": nulos is not None and minimos is not None,
+    }
+
+
+def _scan_coluna(arquivo, coluna, distintos):
+    """
+    Le so essa coluna e calcula as estatisticas que faltaram
+    """
+    valores = arquivo.read(columns=[coluna]).column(0)
+    resultado = {"nulos": valores.null_count}
+
+    if valores.null_count < len(valores) and not pa.types.is_boolean(valores.type):
+        min_max = pc.min_max(valores)
+        resultado["min"] = min_max["min"].as_py()
+        resultado["max"] = min_max["max"].as_py()
+
+    if distintos:
+        resultado["distintos"] = pc.count_distinct(valores).as_py()
+
+    return resultado
+
+
+def perfil_parquet(caminho, colunas=None, distintos=False) -> pd.DataFrame:
+    """
+    Retorna um df com uma linha por coluna: tipo, nulos, percentual_faltante,
+    min, max, distintos (se pedido) e fonte ("metadados" ou "scan")
+    distintos: o pyarrow nao grava distinct_count, entao pedir os distintos
+    faz a leitura das colunas que nao tem essa estatistica
+    """
+    print("perfil_parquet()")
+    arquivo = pq.ParquetFile(caminho)
+    metadados = arquivo.metadata
+    schema = arquivo.schema_arrow
+    n_linhas = metadados.num_rows
+
+    linhas = []
+    for i, nome in enumerate(schema.names):
+        if colunas and nome not in colunas:
+            continue
+
+        tipo = schema.field(nome).type
+        linha = {"coluna": nome, "tipo": str(tipo), "fonte": "metadados"}
+
+        if pa.types.is_null(tipo):  # coluna toda vazia, nem tem estatistica
+            estat = {"nulos": n_linhas, "distintos": 0, "completo": True}
+        else:
+            estat = _estatisticas_coluna(metadados, i)
+            # distinct_count so vale direto quando ha um row group
+            stats = metadados.row_group(0).column(i).statistics
+            if metadados.num_row_groups == 1 and stats and stats.has_distinct_count:
+                estat["distintos"] = stats.distinct_count
+
+        falta_distintos = distintos and "distintos" not in estat
+        if not estat["completo"] or falta_distintos:
+            estat.update(_scan_coluna(arquivo, nome, falta_distintos))
+            linha["fonte"] = "scan"
+
+        chaves = ["nulos", "min", "max"] + (["distintos"] if distintos else [])
+        linha.update({k: estat.get(k) for k in chaves})
+        linhas.append(linha)
+
+    df_perfil = pd.DataFrame(linhas)
+    df_perfil["percentual_faltante"] = (df_perfil["nulos"] / n_linhas * 100).round(2)
+    df_perfil["recomendacao"] = (
+        df_perfil["percentual_faltante"]
+        .gt(LIMITE_EXCLUIR)
+        .map({True: "Excluir", False: "Manter"})
+    )
+
+    return df_perfil.set_index("coluna")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("caminho", help=".parquet (ou .csv com --converter)")
+    parser.add_argument("--converter", action="store_true", help="csv -> parquet antes")
+    parser.add_argument(
+        "--distintos", action="store_true", help="conta distintos (le as colunas)"
+    )
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    caminho = args.caminho
+    if args.converter:
+        caminho = converte_para_parquet(caminho)
+
+    inicio = time.perf_counter()
+    df_perfil = perfil_parquet(caminho, distintos=args.distintos)
+    tempo = time.perf_counter() - inicio
+
+    faltantes = df_perfil[df_perfil["nulos"] > 0].sort_values(
+        "percentual_faltante", ascending=False
+    )
+    print(f"Total de colunas analisadas: {len(df_perfil)}")
+    print(f"Colunas com valores faltantes: {len(faltantes)}")
+    print(f"Colunas lidas (sem estatistica): {(df_perfil['fonte'] == 'scan').sum()}")
+    print(f"Tempo: {tempo:.3f}s\n")
+    print(f"🧩 Top {args.top} colunas com mais valores faltantes:\n")
+    print(faltantes.head(args.top))
+
+
+if __name__ == "__main__":
+    main()
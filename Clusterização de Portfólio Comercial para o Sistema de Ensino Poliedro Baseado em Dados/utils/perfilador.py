@@ -0,0 +1,142 @@
+"""
+Perfil por amostragem (opcional) de uma rodada de planejamento ou da montagem
+do df_training
+
+Uma thread le a pilha das threads do bloco a cada INTERVALO segundos e grava,
+com o prefixo dado:
+    {prefixo}.folded   pilhas no formato "a;b;c N", N em microssegundos
+                       (flamegraph.pl, speedscope)
+    {prefixo}_top.csv  as TOP_N funcoes com mais tempo proprio
+Cada amostra vale o tempo de relogio desde a anterior, e nao o INTERVALO: o
+amostrador precisa do GIL, entao codigo em C que segura o GIL (pandas, pulp,
+builtins) atrasa a amostra seguinte, e esse tempo todo cai na funcao python
+que chamou o C
+Threads que ja existiam antes do bloco (servidor do streamlit) ficam de fora,
+e processos filhos nao sao amostrados
+"""
+
+import sys, time, threading
+import pandas as pd
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from concurrent.futures import thread as _thread_pool
+
+INTERVALO = 0.005  # segundos entre amostras
+TOP_N = 30
+
+# no topo da pilha, a thread do ThreadPoolExecutor esta parada esperando tarefa
+_ESPERA_POOL = _thread_pool._worker.__code__
+
+
+class _Amostrador(threading.Thread):
+    def __init__(self, intervalo):
+        super().__init__(daemon=True, name="perfilador")
+        self.intervalo = intervalo
+        self.pilhas = Counter()  # (thread, funcoes da raiz ao topo) -> segundos
+        self.amostras = Counter()  # mesma chave -> numero de amostras
+        self.parar = threading.Event()
+        self._nomes = {}  # code -> "funcao (arquivo:linha)"
+
+        # a thread que abriu o bloco e as que surgirem depois dele
+        alvo = threading.get_ident()
+        self.ignorar = {t.ident for t in threading.enumerate()} - {alvo}
+
+    def _nome(self, code):
+        if code not in self._nomes:
+            arquivo = Path(code.co_filename).name
+            self._nomes[code] = f"{code.co_name} ({arquivo}:{code.co_firstlineno})"
+
+        return self._nomes[code]
+
+    def run(self):
+        anterior = time.perf_counter()
+        while not self.parar.wait(self.intervalo):
+            agora = time.perf_counter()
+            decorrido, anterior = agora - anterior, agora
+
+            threads = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident or ident in self.ignorar:
+                    continue
+                if frame.f_code is _ESPERA_POOL:  # thread do pool sem tarefa
+                    continue
+
+                pilha = []
+                while frame is not None:
+                    pilha.append(self._nome(frame.f_code))
+                    frame = frame.f_back
+                chave = (threads.get(ident, str(ident)), *pilha[::-1])
+                self.pilhas[chave] += decorrido
+                self.amostras[chave] += 1
+
+
+def _grava(pilhas, amostras, prefixo, top):
+    """
+    Grava o .folded e o _top.csv
+    Retorna (caminho_folded, caminho_top)
+    """
+    caminho_folded = Path(f"{prefixo}.folded")
+    caminho_top = Path(f"{prefixo}_top.csv")
+
+    with open(caminho_folded, "w", encoding="utf-8") as f:
+        for pilha, segundos in pilhas.most_common():
+            f.write(f"{';'.join(pilha)} {round(segundos * 1e6)}\n")
+
+    proprias, totais, n_proprias = Counter(), Counter(), Counter()
+    for pilha, segundos in pilhas.items():
+        proprias[pilha[-1]] += segundos
+        n_proprias[pilha[-1]] += amostras[pilha]
+        for nome in set(pilha[1:]):  # pilha[0] e o nome da thread
+            totais[nome] += segundos
+
+    tempo = max(sum(pilhas.values()), 1e-9)
+    df_top = pd.DataFrame(
+        [
+            {
+                "funcao": nome,
+                "tempo_proprio_s": round(proprias[nome], 3),
+                "tempo_total_s": round(totais[nome], 3),
+                "pct_proprio": round(100 * proprias[nome] / tempo, 1),
+                "pct_total": round(100 * totais[nome] / tempo, 1),
+                "amostras_proprias": n_proprias[nome],
+            }
+            for nome in totais
+        ],
+        columns=[
+            "funcao",
+            "tempo_proprio_s",
+            "tempo_total_s",
+            "pct_proprio",
+            "pct_total",
+            "amostras_proprias",
+        ],
+    )
+    df_top = df_top.sort_values(["tempo_proprio_s", "tempo_total_s"], ascending=False)
+    df_top.head(top).to_csv(caminho_top, index=False)
+
+    return caminho_folded, caminho_top
+
+
+@contextmanager
+def perfila(prefixo, intervalo=INTERVALO, top=TOP_N):
+    """
+    Amostra as pilhas durante o bloco e grava os arquivos ao sair (tambem
+    quando o bloco da erro)
+    """
+    print("perfila()")
+    amostrador = _Amostrador(intervalo)
+    amostrador.start()
+    try:
+        yield
+    finally:
+        amostrador.parar.set()
+        amostrador.join()
+        _grava(amostrador.pilhas, amostrador.amostras, prefixo, top)
+
+
+def perfil_opcional(ativo, prefixo):
+    """
+    perfila quando ativo, senao um bloco vazio (sem thread, sem custo)
+    """
+    return perfila(prefixo) if ativo else nullcontext()
@@ -0,0 +1,129 @@
+import time
+import multiprocessing as mp
+from contextlib import nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+# Cada etapa e um dict:
+#   func: funcao chamada com os resultados das deps (na ordem) e depois os args
+#   deps: nomes das etapas que precisam terminar antes (padrao nenhuma)
+#   args: argumentos extras (padrao nenhum)
+#   tipo: "thread" para I/O e rede, "processo" para pandas pesado (padrao "thread")
+# Etapas "processo" precisam de func definida no nivel do modulo (pickle)
+
+
+def _ordem_valida(etapas):
+    """
+    Confere se as deps existem e se nao ha ciclo
+    """
+    faltando = {
+        d for e in etapas.values() for d in e.get("deps", []) if d not in etapas
+    }
+    if faltando:
+        raise ValueError(f"Etapas desconhecidas nas deps: {faltando}")
+
+    resolvidas = set()
+    while len(resolvidas) < len(etapas):
+        prontas = {
+            nome
+            for nome, e in etapas.items()
+            if nome not in resolvidas and set(e.get("deps", [])) <= resolvidas
+        }
+        if not prontas:
+            raise ValueError(f"Ciclo entre as etapas: {set(etapas) - resolvidas}")
+        resolvidas |= prontas
+
+
+def caminho_critico(etapas, tempos) -> list[str]:
+    """
+    Volta da etapa que terminou por ultimo pela dep que terminou por ultimo
+    Retorna os nomes das etapas do caminho, na ordem de execucao
+    """
+    atual = max(tempos, key=lambda nome: tempos[nome]["fim"])
+    caminho = [atual]
+    while deps := etapas[atual].get("deps", []):
+        atual = max(deps, key=lambda nome: tempos[nome]["fim"])
+        caminho.append(atual)
+
+    return caminho[::-1]
+
+
+def executa_etapas(etapas: dict, max_processos=None, processos=True):
+    """
+    Roda as etapas assim que as deps terminam: as "thread" num
+    ThreadPoolExecutor e as "processo" num ProcessPoolExecutor (spawn, criado
+    so se alguma etapa for "processo")
+    processos: False roda tudo em threads (debug, ou se o spawn falhar)
+
+    Retorna (resultados, relatorio)
+      - resultados: dict nome -> retorno da etapa
+      - relatorio: tempos de cada etapa (inicio, fim, duracao em s desde o
+        comeco), total, caminho_critico e tempo_critico
+    Um erro numa etapa e relancado (depois que as que ja rodavam terminam)
+    """
+    print("executa_etapas()")
+    _ordem_valida(etapas)
+
+    inicio = time.perf_counter()
+    resultados, tempos, rodando = {}, {}, {}
+
+    processos = processos and any(e.get("tipo") == "processo" for e in etapas.values())
+    if processos:
+        # spawn: fork com as threads do streamlit vivas pode herdar travas presas
+        contexto = mp.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=max_processos, mp_context=contexto)
+    else:
+        pool = nullcontext()
+
+    with ThreadPoolExecutor(max_workers=len(etapas)) as threads, pool as pool_processos:
+
+        def _submete():
+            for nome, etapa in etapas.items():
+                if nome in tempos:
+                    continue
+                deps = etapa.get("deps", [])
+                if not all(d in resultados for d in deps):
+                    continue
+
+                executor = (
+                    pool_processos
+                    if processos and etapa.get("tipo") == "processo"
+                    else threads
+                )
+                futuro = executor.submit(
+                    etapa["func"],
+                    *[resultados[d] for d in deps],
+                    *etapa.get("args", ()),
+                )
+                rodando[futuro] = nome
+                tempos[nome] = {"inicio": time.perf_counter() - inicio}
+
+        _submete()
+        while rodando:
+            prontos, _ = wait(rodando, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                nome = rodando.pop(futuro)
+                tempos[nome]["fim"] = time.perf_counter() - inicio
+                tempos[nome]["duracao"] = tempos[nome]["fim"] - tempos[nome]["inicio"]
+                print(f"    etapa {nome}: {tempos[nome]['duracao']:.2f}s")
+
+                resultados[nome] = futuro.result()  # relanca o erro da etapa
+            _submete()
+
+    caminho = caminho_critico(etapas, tempos)
+    relatorio = {
+        "tempos": tempos,
+        "total": time.perf_counter() - inicio,
+        "caminho_critico": caminho,
+        "tempo_critico": sum(tempos[nome]["duracao"] for nome in caminho),
+    }
+    print(
+        f"Caminho critico: {' -> '.join(caminho)}"
+        f" ({relatorio['tempo_critico']:.2f}s de {relatorio['total']:.2f}s)"
+    )
+
+    return resultados, relatorio
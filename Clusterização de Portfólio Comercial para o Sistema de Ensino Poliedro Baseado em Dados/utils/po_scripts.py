@@ -1,13 +1,27 @@
-import asyncio, pulp, re, os
+import asyncio, pulp, os, json, time, queue
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
-from geopy.distance import geodesic
+from sklearn.cluster import MiniBatchKMeans
 from utils.busca_ceps import cep_to_coords
-from datetime import datetime
+from utils.metricas import registra_metricas, mede_etapa, coleta_etapas
+from utils.manifesto import registra_rodada, hash_df, salva_resultado, novo_run_id
+from utils.jobs import reporta_etapa
+from utils.perfilador import perfil_opcional
 from pathlib import Path
 
+RAIO_TERRA_KM = 6371.0088
 
+# candidatos de cada regiao no refinamento do multinivel: os VIZINHOS_REGIAO
+# consultores mais proximos e os que tem a regiao a ate FOLGA_RAIO vezes o raio
+VIZINHOS_REGIAO = 3
+FOLGA_RAIO = 1.5
+
+
+@mede_etapa
 def _consultores_handler(df_consultores):
     print("_consultores_handler()")
+    reporta_etapa("geocodificacao")
     df = df_consultores.dropna()
     df["CEP"] = df["CEP"].str.replace("-", "")
     df = asyncio.run(cep_to_coords(df, "CEP"))
@@ -15,46 +29,76 @@ def _consultores_handler(df_consultores):
     return df[["Consultor", "lat", "lon"]]
 
 
+@mede_etapa
 def _calcula_distancias(df_escolas, df_consultores):
     print("_calcula_distancias()")
+    reporta_etapa("distancias")
+    # mesma distancia (haversine em km inteiros) do multinivel e do limite inferior
+    D = np.round(
+        _haversine_km(
+            df_escolas["lat"].to_numpy()[:, None],
+            df_escolas["lon"].to_numpy()[:, None],
+            df_consultores["lat"].to_numpy()[None, :],
+            df_consultores["lon"].to_numpy()[None, :],
+        )
+    )
     pre_df = {"CO_ENTIDADE": df_escolas["CO_ENTIDADE"]}
-    for _, consultor in df_consultores.iterrows():
-        nome_co = consultor["Consultor"]
-        lat_co = consultor["lat"]
-        lon_co = consultor["lon"]
-
-        dists = []
-        for _, escola in df_escolas.iterrows():
-            lat_es = escola["lat"]
-            lon_es = escola["lon"]
-            dists.append(round(geodesic((lat_es, lon_es), (lat_co, lon_co)).km))
-
-        pre_df.update({nome_co: dists})
+    pre_df.update(zip(df_consultores["Consultor"], D.T))
 
     print("fim _calcula_distancias()")
     return pd.DataFrame(pre_df)
 
 
-def _get_final_df(df_afinidade, df_consultores):
-    print("_get_final_df()")
-    df_consultores = _consultores_handler(df_consultores)
-    df_distancias = _calcula_distancias(df_afinidade, df_consultores)
+def _haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia de grande circulo (km) entre arrays de coordenadas, com o
+    broadcasting do numpy. Fica a menos de 0,5% do geodesic (elipsoide)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(a))
 
+
+def _add_motivacao(df_afinidade):
     df_afinidade["motivacao"] = round(
         df_afinidade["afinidade"] * df_afinidade["valor_venda"]
     )
+
+    return df_afinidade
+
+
+def _get_final_df(
+    df_afinidade, df_consultores, df_consultores_geo=None, df_distancias=None
+):
+    """
+    df_consultores_geo, df_distancias: consultores ja geocodificados e
+    distancias ja calculadas (lote), None calcula aqui
+    """
+    print("_get_final_df()")
+    if df_distancias is None:
+        if df_consultores_geo is None:
+            df_consultores_geo = _consultores_handler(df_consultores)
+        df_distancias = _calcula_distancias(df_afinidade, df_consultores_geo)
+
+    df_afinidade = _add_motivacao(df_afinidade)
     df_afinidade = df_afinidade[["CO_ENTIDADE", "motivacao"]]
 
     return df_distancias.merge(df_afinidade, on="CO_ENTIDADE")
 
 
-def _run_optimizer(df_final, cobertura, data_hora):
+def _monta_modelo(df_final, cobertura, mm=None):
     """
-    Roda o solver
-    Retorna um df com as colunas "cod_escola", "consultor"
+    Monta o modelo de atribuicao
+    Distancias NaN indicam pares escola/consultor fora do modelo
+    mm: motivacao media por consultor, se None é calculada com as escolas do df_final
+    Retorna o modelo e o dict de variaveis {(escola, consultor): x}
     """
-    print("_run_optimizer()")
-    nome_arquivo_log = str(Path(f"dados/resultados/log_{data_hora}.txt"))
+    print("_monta_modelo()")
+    reporta_etapa("modelo")
 
     # --- MODELO ---
     modelo = pulp.LpProblem("Poliedro", pulp.LpMinimize)
@@ -62,54 +106,757 @@ def _run_optimizer(df_final, cobertura, data_hora):
     # --- DADOS ---
     df_final = df_final.set_index("CO_ENTIDADE")
     distancias = df_final.drop(columns="motivacao")
-    motivacao = df_final["motivacao"]
+    motivacao = df_final["motivacao"].to_numpy()
     consultores = distancias.columns.to_list()
-    escolas = df_final.index.tolist()
-    mm = sum(motivacao) / len(consultores)
+    escolas = df_final.index.to_numpy()
+    if mm is None:
+        mm = motivacao.sum() / len(consultores)
 
-    # --- VARIÁVEL ---
-    x = pulp.LpVariable.dicts(
-        "x", [(i, j) for i in escolas for j in consultores], lowBound=0, cat="Binary"
+    # pares fora do NaN, linha a linha (escola) como no df
+    D = distancias.to_numpy(dtype=float)
+    linhas, colunas = np.nonzero(~np.isnan(D))
+    pares = list(
+        zip(
+            escolas[linhas].tolist(),
+            np.array(consultores, dtype=object)[colunas].tolist(),
+        )
     )
 
+    # --- VARIÁVEL ---
+    x = pulp.LpVariable.dicts("x", pares, lowBound=0, cat="Binary")
+    variaveis = [x[par] for par in pares]
+
     # --- FUNÇÃO OBJETIVO ---
+    modelo += pulp.LpAffineExpression(zip(variaveis, D[linhas, colunas].tolist()))
+
+    # --- RESTRIÇÕES ---
+    por_escola, por_consultor = {}, {k: [] for k in range(len(consultores))}
+    for var, i, k, m in zip(variaveis, linhas, colunas, motivacao[linhas].tolist()):
+        por_escola.setdefault(i, []).append(var)
+        por_consultor[k].append((var, m))
+    for (
+        termos
+    ) in por_escola.values():  # Cada escola é atribuida a no maximo um consultor
+        modelo += pulp.lpSum(termos) <= 1
+    for termos in por_consultor.values():
+        modelo += pulp.LpAffineExpression(termos) >= cobertura * mm
+
+    return modelo, x
+
+
+def _formata_solucao(pares_escolhidos):
+    """
+    Recebe as chaves (escola, consultor) escolhidas
+    Retorna um df com as colunas "cod_escola", "consultor"
+    """
+    return pd.DataFrame(
+        {
+            "cod_escola": [str(i) for i, _ in pares_escolhidos],
+            "consultor": [j for _, j in pares_escolhidos],
+        }
+    )
+
+
+def _resolve_highs(modelo, caminho_log, gap):
+    """
+    Resolve o modelo com o HiGHS_CMD (o benchmark usa a mesma chamada)
+    """
+    try:  # no windows
+        solver_path = str(Path(f"solvers/highs.exe"))
+        modelo.solve(pulp.HiGHS_CMD(path=solver_path, logPath=caminho_log, gapRel=gap))
+    except:  # no mac
+        modelo.solve(pulp.HiGHS_CMD(logPath=caminho_log, gapRel=gap))
+
+    return modelo
+
+
+@mede_etapa
+def _run_optimizer(df_final, cobertura, data_hora, mm=None, gap=0.02):
+    """
+    Roda o solver
+    Distancias NaN indicam pares escola/consultor fora do modelo
+    mm: motivacao media por consultor, se None é calculada com as escolas do df_final
+    gap: gap relativo de parada do solver
+    Retorna um df com as colunas "cod_escola", "consultor"
+    """
+    print("_run_optimizer()")
+    nome_arquivo_log = str(Path(f"dados/resultados/log_{data_hora}.txt"))
+
+    modelo, x = _monta_modelo(df_final, cobertura, mm)
+
+    # --- SOLUÇÃO ---
+    reporta_etapa("solver")
+    _resolve_highs(modelo, nome_arquivo_log, gap)
+
+    # --- FORMATANDO SOLUCAO ---
+    # le direto do dict de variaveis, o nome no pulp troca espacos por "_"
+    return _formata_solucao([k for k, v in x.items() if (v.value() or 0) > 0.5])
+
+
+# Configuracoes disputadas no modo portfolio, cada uma roda em um processo
+CONFIGS_PORTFOLIO = [
+    {"nome": "highs_padrao", "solver": "highs", "opcoes": {}},
+    {"nome": "highs_seed_1", "solver": "highs", "opcoes": {"random_seed": 1}},
+    {"nome": "highs_seed_2", "solver": "highs", "opcoes": {"random_seed": 2}},
+    {"nome": "highs_sem_presolve", "solver": "highs", "opcoes": {"presolve": "off"}},
+    {
+        "nome": "highs_heuristica",
+        "solver": "highs",
+        "opcoes": {"mip_heuristic_effort": 0.3},
+    },
+    {"nome": "cbc", "solver": "cbc", "opcoes": {}},
+]
+# segundos entre as conferencias de processos do portfolio que morreram
+ESPERA_PORTFOLIO = 1.0
+
+
+def _resolve_config(caminho_mps, config, gap, fila, caminho_log=None):
+    """
+    Resolve o modelo salvo em MPS com uma configuracao do portfolio
+    caminho_log: arquivo de log do HiGHS (ignorado no CBC)
+    Coloca na fila (nome, nomes das variaveis escolhidas, tempo) ou, quando o
+    solver nao chega no otimo dentro do gap, (nome, None, status ou erro)
+    """
+    inicio = time.time()
+    try:
+        if config["solver"] == "highs":
+            import highspy
+
+            h = highspy.Highs()
+            h.setOptionValue("output_flag", False)
+            h.setOptionValue("threads", 1)
+            h.setOptionValue("mip_rel_gap", gap)
+            if caminho_log:
+                h.setOptionValue("log_file", caminho_log)
+                h.setOptionValue("output_flag", True)
+                h.setOptionValue("log_to_console", False)
+            for opcao, valor in config["opcoes"].items():
+                h.setOptionValue(opcao, valor)
+            h.readModel(caminho_mps)
+            h.run()
+
+            status = h.getModelStatus()
+            if status != highspy.HighsModelStatus.kOptimal:
+                fila.put((config["nome"], None, h.modelStatusToString(status)))
+                return
+            if h.getInfo().mip_gap > gap:
+                fila.put((config["nome"], None, f"gap {h.getInfo().mip_gap:.4f}"))
+                return
+
+            nomes = h.getLp().col_names_
+            valores = h.getSolution().col_value
+            escolhidas = [n for n, v in zip(nomes, valores) if v > 0.5]
+        else:
+            _, modelo = pulp.LpProblem.fromMPS(caminho_mps)
+            modelo.solve(pulp.PULP_CBC_CMD(msg=False, gapRel=gap, threads=1))
+            if pulp.LpStatus[modelo.status] != "Optimal":
+                fila.put((config["nome"], None, pulp.LpStatus[modelo.status]))
+                return
+            escolhidas = [v.name for v in modelo.variables() if (v.value() or 0) > 0.5]
+
+        fila.put((config["nome"], escolhidas, round(time.time() - inicio, 2)))
+    except Exception as e:
+        fila.put((config["nome"], None, str(e)))
+
+
+@mede_etapa
+def _run_portfolio(df_final, cobertura, data_hora, mm=None, gap=0.02, configs=None):
+    """
+    Roda varias configuracoes de solver em paralelo sobre o mesmo modelo e fica
+    com a primeira que chegar no gap, as outras sao canceladas
+    O vencedor de cada instancia fica registrado em dados/resultados/portfolio.jsonl
+
+    Retorna um df com as colunas "cod_escola", "consultor"
+    """
+    print("_run_portfolio()")
+    configs = configs or CONFIGS_PORTFOLIO
+    configs = configs[: os.cpu_count() or 1]
+
+    modelo, x = _monta_modelo(df_final, cobertura, mm)
+    caminho_mps = str(Path(f"dados/temporarios/modelo_{data_hora}.mps"))
+    modelo.writeMPS(caminho_mps)
+    chave_por_nome = {v.name: k for k, v in x.items()}
+
+    def _log(nome):
+        return Path(f"dados/resultados/log_{data_hora}_{nome}.txt")
+
+    reporta_etapa("solver")
+    # spawn: chamado de threads (servico) e de processos do pool (lote)
+    contexto = mp.get_context("spawn")
+    fila = contexto.Queue()
+    processos = {
+        config["nome"]: contexto.Process(
+            target=_resolve_config,
+            args=(caminho_mps, config, gap, fila, str(_log(config["nome"]))),
+        )
+        for config in configs
+    }
+    for p in processos.values():
+        p.start()
+
+    vencedor, escolhidas, tempo = None, None, None
+    falhas = {}
+    pendentes = dict(processos)
+    try:
+        while pendentes:
+            try:
+                nome, resultado, info = fila.get(timeout=ESPERA_PORTFOLIO)
+            except queue.Empty:
+                # o _resolve_config sempre responde e sai com 0, entao um
+                # exitcode diferente e um processo morto sem resposta
+                # (memoria, segfault, cancelamento)
+                for nome, p in list(pendentes.items()):
+                    if p.exitcode not in (None, 0):
+                        print(f"Configuracao {nome} morreu: exitcode {p.exitcode}")
+                        falhas[nome] = f"exitcode {p.exitcode}"
+                        del pendentes[nome]
+                continue
+
+            del pendentes[nome]
+            if resultado is None:  # erro, inviavel ou fora do gap
+                print(f"Configuracao {nome} falhou: {info}")
+                falhas[nome] = info
+                continue
+            vencedor, escolhidas, tempo = nome, resultado, info
+            break
+    finally:
+        for p in processos.values():
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        os.remove(caminho_mps)
+
+        # o log do vencedor vira o log da rodada
+        for config in configs:
+            if config["nome"] == vencedor and _log(vencedor).exists():
+                _log(vencedor).replace(f"dados/resultados/log_{data_hora}.txt")
+            else:
+                _log(config["nome"]).unlink(missing_ok=True)
+
+    if vencedor is None:
+        raise RuntimeError(
+            f"Nenhuma configuracao do portfolio resolveu o modelo: {falhas}"
+        )
+
+    print(f"Vencedor do portfolio: {vencedor} em {tempo}s")
+    registro = {
+        "data_hora": data_hora,
+        "n_escolas": len(df_final),
+        "n_consultores": len(df_final.columns) - 2,
+        "n_variaveis": len(x),
+        "vencedor": vencedor,
+        "tempo_s": tempo,
+        "configs": [c["nome"] for c in configs],
+    }
+    with open(Path("dados/resultados/portfolio.jsonl"), "a") as f:
+        f.write(json.dumps(registro) + "\n")
+
+    return _formata_solucao([chave_por_nome[n] for n in escolhidas])
+
+
+def _melhor_troca(ganho_sai, ganho_entra, m_sai, m_entra, folga_sai, folga_entra):
+    """
+    Avalia todas as trocas entre as listas candidatas (vetorizado)
+    ganho_*: variacao de distancia de cada candidato, m_*: motivacao de cada candidato
+    folga_*: quanto cada lado pode perder de motivacao sem violar a cobertura
+    Retorna (delta, idx_sai, idx_entra) da melhor troca viavel ou None
+    """
+    if len(ganho_sai) == 0 or len(ganho_entra) == 0:
+        return None
+
+    delta = ganho_sai[:, None] + ganho_entra[None, :]
+    saldo = m_entra[None, :] - m_sai[:, None]  # o que o lado "sai" ganha de motivacao
+    viavel = (saldo >= -folga_sai) & (-saldo >= -folga_entra)
+    delta = np.where(viavel, delta, np.inf)
+
+    a, b = np.unravel_index(np.argmin(delta), delta.shape)
+    if not np.isfinite(delta[a, b]):
+        return None
+
+    return delta[a, b], a, b
+
+
+def _top_candidatos(ganho, g, n_cand):
+    """
+    As n_cand escolas do grupo g que menos custam ir para cada coluna do ganho
+    Retorna um array (n_cand, colunas) de indices de escola ou None se g vazio
+    """
+    c = min(n_cand, len(g))
+    if c == 0:
+        return None
+
+    return g[np.argpartition(ganho[g], c - 1, axis=0)[:c]]
+
+
+@mede_etapa
+def _busca_local(
+    df_resultado, df_final, cobertura, mm=None, max_iter=5000, n_cand=20, tempo_max=60
+):
+    """
+    Melhora a solucao do solver com movimentos de realocacao (inclusive tirar a
+    escola do consultor) e de troca entre consultores ou com escolas livres,
+    sempre mantendo a cobertura de cada consultor
+
+    Usa a matriz de distancias do df_final (NaN = par proibido) e avalia os
+    movimentos por delta, atualizando so as linhas que mudaram
+
+    tempo_max: limite em segundos, a solucao corrente é sempre viavel
+
+    Retorna um df com as colunas "cod_escola", "consultor"
+    """
+    print("_busca_local()")
+    reporta_etapa("busca_local")
+    df_final = df_final.set_index("CO_ENTIDADE")
+    df_dist = df_final.drop(columns="motivacao")
+    consultores = df_dist.columns.to_list()
+    escolas = df_final.index.astype(str)
+
+    D = df_dist.to_numpy(dtype=float)
+    D = np.where(np.isnan(D), np.inf, D)
+    m = df_final["motivacao"].to_numpy(dtype=float)
+    n, K = D.shape
+    if mm is None:
+        mm = m.sum() / K
+    alvo = cobertura * mm
+
+    # atribuicao: indice do consultor ou -1 (escola livre)
+    pos_escola = {e: i for i, e in enumerate(escolas)}
+    pos_co = {c: k for k, c in enumerate(consultores)}
+    atrib = np.full(n, -1)
+    for e, c in zip(df_resultado["cod_escola"].astype(str), df_resultado["consultor"]):
+        atrib[pos_escola[e]] = pos_co[c]
+
+    carga = np.bincount(atrib[atrib >= 0], weights=m[atrib >= 0], minlength=K)
+    atual = np.where(atrib >= 0, D[np.arange(n), np.maximum(atrib, 0)], 0.0)
+    custo_inicial = atual.sum()
+
+    # ganho[i, k] = variacao do custo ao mover i para k; coluna K = deixar i livre
+    ganho = np.hstack([D, np.zeros((n, 1))]) - atual[:, None]
+    livre = atrib < 0
+    ganho[livre, K] = np.inf
+
+    # grupo de cada escola: 0..K-1 sao os consultores e K as escolas livres
+    grupo = np.where(livre, K, atrib)
+
+    # melhor realocacao de cada escola, sem olhar a cobertura; so muda nas
+    # linhas das escolas movidas
+    reloc = ganho.copy()
+    reloc[np.arange(n), grupo] = np.inf  # ficar onde esta
+    reloc_k = reloc.argmin(axis=1)
+    reloc_val = reloc[np.arange(n), reloc_k]
+
+    # top[g][:, c] sao as n_cand escolas do grupo g que menos custam ir para c
+    # trocas[j, k] e a melhor troca entre os grupos j e k; os dois so mudam
+    # quando o movimento mexe no grupo (escolas ou folga)
+    top = [
+        _top_candidatos(ganho, np.flatnonzero(grupo == g), n_cand) for g in range(K + 1)
+    ]
+    trocas = {}
+    mudaram = set(range(K + 1))
+
+    inicio = time.time()
+    movimentos = 0
+    for _ in range(max_iter):
+        if time.time() - inicio > tempo_max:
+            break
+
+        folga = carga - alvo
+        sai_ok = livre | (m <= np.where(livre, 0, folga[np.maximum(atrib, 0)]) + 1e-9)
+
+        # --- REALOCACAO ---
+        cand = np.where(sai_ok, reloc_val, np.inf)
+        i = np.argmin(cand)
+        melhor = (cand[i], "realoca", i, reloc_k[i])
+
+        # --- TROCAS ---
+        for j in range(K):
+            for k in range(K + 1):
+                if k == j:
+                    continue
+                if j in mudaram or k in mudaram:
+                    trocas[j, k] = None
+                    if top[j] is not None and top[k] is not None:
+                        # i sai de j para k (k == K: i fica livre), u entra em j vindo de k
+                        cand_sai, cand_entra = top[j][:, k], top[k][:, j]
+                        troca = _melhor_troca(
+                            ganho[cand_sai, k],
+                            ganho[cand_entra, j],
+                            m[cand_sai],
+                            m[cand_entra],
+                            folga[j],
+                            np.inf if k == K else folga[k],
+                        )
+                        if troca:
+                            trocas[j, k] = (
+                                troca[0],
+                                cand_sai[troca[1]],
+                                cand_entra[troca[2]],
+                            )
+
+                troca = trocas[j, k]
+                if troca and troca[0] < melhor[0]:
+                    melhor = (troca[0], "troca", troca[1], troca[2], j, k)
+
+        if melhor[0] >= -1e-9:
+            break
+
+        # --- APLICA O MOVIMENTO ---
+        if melhor[1] == "realoca":
+            movs = [(melhor[2], melhor[3])]
+        else:
+            _, _, i, u, j, k = melhor
+            movs = [(i, k), (u, j)]
+
+        mudaram = set()
+        for i, k in movs:
+            mudaram.update((grupo[i], k))
+            if atrib[i] >= 0:
+                carga[atrib[i]] -= m[i]
+            atrib[i] = -1 if k == K else k
+            livre[i] = atrib[i] < 0
+            grupo[i] = k
+            if not livre[i]:
+                carga[atrib[i]] += m[i]
+            atual[i] = 0.0 if livre[i] else D[i, atrib[i]]
+            ganho[i, :K] = D[i] - atual[i]
+            ganho[i, K] = np.inf if livre[i] else -atual[i]
+
+            reloc[i] = ganho[i]
+            reloc[i, k] = np.inf
+            reloc_k[i] = reloc[i].argmin()
+            reloc_val[i] = reloc[i, reloc_k[i]]
+
+        for g in mudaram:
+            top[g] = _top_candidatos(ganho, np.flatnonzero(grupo == g), n_cand)
+        movimentos += 1
+
+    print(
+        f"busca local: {movimentos} movimentos, custo {round(custo_inicial)} -> {round(atual.sum())}"
+    )
+
+    sel = np.flatnonzero(atrib >= 0)
+    return pd.DataFrame(
+        {
+            "cod_escola": escolas[sel].tolist(),
+            "consultor": [consultores[k] for k in atrib[sel]],
+        }
+    )
+
+
+def _agrupa_escolas(df_escolas, n_regioes):
+    """
+    Agrupa as escolas em micro-regioes por lat/lon, ponderando pela motivacao
+    Retorna um array com a regiao de cada escola e um df com as colunas
+    "regiao", "lat", "lon", "motivacao", "n_escolas"
+    """
+    print("_agrupa_escolas()")
+    n_regioes = min(n_regioes, len(df_escolas))
+
+    # lon achatada pelo cosseno da latitude para a distancia ficar proxima da real
+    coords = np.column_stack(
+        [
+            df_escolas["lat"],
+            df_escolas["lon"] * np.cos(np.radians(df_escolas["lat"])),
+        ]
+    )
+    pesos = df_escolas["motivacao"].to_numpy() + 1  # escolas com motivacao 0 contam
+
+    km = MiniBatchKMeans(n_clusters=n_regioes, random_state=2025, n_init=3)
+    regioes = km.fit_predict(coords, sample_weight=pesos)
+
+    df_regioes = (
+        df_escolas.assign(regiao=regioes, _peso=pesos)
+        .assign(
+            _lat=lambda d: d["lat"] * d["_peso"], _lon=lambda d: d["lon"] * d["_peso"]
+        )
+        .groupby("regiao")
+        .agg(
+            _lat=("_lat", "sum"),
+            _lon=("_lon", "sum"),
+            _peso=("_peso", "sum"),
+            motivacao=("motivacao", "sum"),
+            n_escolas=("CO_ENTIDADE", "size"),
+        )
+        .reset_index()
+    )
+    df_regioes["lat"] = df_regioes["_lat"] / df_regioes["_peso"]
+    df_regioes["lon"] = df_regioes["_lon"] / df_regioes["_peso"]
+
+    return regioes, df_regioes[["regiao", "lat", "lon", "motivacao", "n_escolas"]]
+
+
+def _run_optimizer_regioes(
+    df_regioes,
+    df_consultores,
+    cobertura,
+    mm,
+    vizinhos=VIZINHOS_REGIAO,
+    folga_raio=FOLGA_RAIO,
+):
+    """
+    Resolve a atribuicao agregada (relaxacao continua) das regioes aos consultores
+    Retorna um dict {regiao: [consultores]} com os consultores candidatos de cada
+    regiao: os que receberam alguma fracao dela, os vizinhos mais proximos dela
+    e os que tem o centro dela a ate folga_raio vezes o seu raio de atuacao
+    (a regiao atribuida mais distante)
+    """
+    print("_run_optimizer_regioes()")
+    regioes = df_regioes["regiao"].tolist()
+    consultores = df_consultores["Consultor"].tolist()
+    motivacao = df_regioes.set_index("regiao")["motivacao"]
+
+    # custo de atribuir a regiao inteira: distancia do centro * numero de escolas
+    D = _haversine_km(
+        df_regioes["lat"].to_numpy()[:, None],
+        df_regioes["lon"].to_numpy()[:, None],
+        df_consultores["lat"].to_numpy()[None, :],
+        df_consultores["lon"].to_numpy()[None, :],
+    )
+    n_escolas = df_regioes["n_escolas"].to_numpy()
+    dist_km, custo = {}, {}
+    for a, r in enumerate(regioes):
+        for b, j in enumerate(consultores):
+            dist_km[(r, j)] = D[a, b]
+            custo[(r, j)] = D[a, b] * n_escolas[a]
+
+    modelo = pulp.LpProblem("Poliedro_regioes", pulp.LpMinimize)
+    y = pulp.LpVariable.dicts(
+        "y", [(r, j) for r in regioes for j in consultores], lowBound=0, upBound=1
+    )
+
     modelo += pulp.lpSum(
-        distancias.loc[i, j] * x[(i, j)] for i in escolas for j in consultores
+        custo[(r, j)] * y[(r, j)] for r in regioes for j in consultores
     )
 
-    # --- RESTRIÇÕES ---
-    for i in escolas:  # Cada escola é atribuida a no maximo um consultor
-        modelo += pulp.lpSum(x[(i, j)] for j in consultores) <= 1
+    for r in regioes:  # Cada regiao é dividida no maximo uma vez
+        modelo += pulp.lpSum(y[(r, j)] for j in consultores) <= 1
     for j in consultores:
         modelo += (
-            pulp.lpSum(x[(i, j)] * motivacao[i] for i in escolas) >= cobertura * mm
+            pulp.lpSum(y[(r, j)] * motivacao[r] for r in regioes) >= cobertura * mm
         )
 
-    # --- SOLUÇÃO ---
-    try:  # no windows
-        solver_path = str(Path(f"solvers/highs.exe"))
-        modelo.solve(
-            pulp.HiGHS_CMD(path=solver_path, logPath=nome_arquivo_log, gapRel=0.02)
+    modelo.solve(pulp.HiGHS(msg=False))
+
+    # raio de cada consultor: centro da regiao atribuida mais distante
+    raio = {}
+    for (r, j), var in y.items():
+        if (var.value() or 0) > 1e-6:
+            raio[j] = max(raio.get(j, 0), dist_km[(r, j)])
+
+    # so o raio deixa quase toda escola com um unico candidato no refinamento;
+    # os vizinhos e a folga dao espaco para trocar as escolas da fronteira
+    proximos = np.argsort(D, axis=1, kind="stable")[:, :vizinhos]
+    atribuicao = {}
+    for a, r in enumerate(regioes):
+        candidatos = {consultores[b] for b in proximos[a]}
+        candidatos.update(j for j in raio if dist_km[(r, j)] <= folga_raio * raio[j])
+        atribuicao[r] = [j for j in consultores if j in candidatos]
+
+    return atribuicao
+
+
+def _distancias_candidatas(df_escolas, df_consultores, atribuicao):
+    """
+    Calcula as distancias (haversine, em km inteiros) apenas entre cada escola
+    e os consultores atribuidos a sua regiao
+    Retorna um df no formato do _calcula_distancias, com NaN fora dos pares candidatos
+    """
+    print("_distancias_candidatas()")
+    consultores = df_consultores["Consultor"].tolist()
+    coluna = {nome_co: k for k, nome_co in enumerate(consultores)}
+
+    # candidato[regiao, consultor]
+    regioes = df_escolas["regiao"].to_numpy()
+    n_regioes = int(max(regioes.max(initial=-1), max(atribuicao, default=-1))) + 1
+    candidato = np.zeros((n_regioes, len(consultores)), bool)
+    for regiao, candidatos in atribuicao.items():
+        candidato[int(regiao), [coluna[j] for j in candidatos]] = True
+
+    linhas, colunas = np.nonzero(candidato[regioes])
+    D = np.full((len(df_escolas), len(consultores)), np.nan)
+    D[linhas, colunas] = np.round(
+        _haversine_km(
+            df_escolas["lat"].to_numpy()[linhas],
+            df_escolas["lon"].to_numpy()[linhas],
+            df_consultores["lat"].to_numpy()[colunas],
+            df_consultores["lon"].to_numpy()[colunas],
         )
-    except:  # no mac
-        modelo.solve(pulp.HiGHS_CMD(logPath=nome_arquivo_log, gapRel=0.02))
+    )
 
-    # --- FORMATANDO SOLUCAO ---
-    padrao = re.compile(r"x_\((\d+),_'([^']+)'\)")
-    # padrao = re.compile(r"x_*\((\d+),_['\"]?([^'\")]+)['\"]?\)")
+    return pd.DataFrame(
+        {"CO_ENTIDADE": df_escolas["CO_ENTIDADE"].values, **dict(zip(consultores, D.T))}
+    )
+
+
+def _limite_inferior(df_escolas, df_consultores, cobertura, mm):
+    """
+    Limite inferior barato do custo (km) do modelo completo: sem a restricao de
+    uma escola por consultor, cada consultor vira uma mochila fracionaria, que
+    pega as escolas em ordem de km por motivacao ate cobrir cobertura * mm
+    E uma relaxacao da relaxacao linear, entao nenhuma atribuicao custa menos
+    Retorna None se algum consultor nao consegue cobrir nem com todas as escolas
+    """
+    print("_limite_inferior()")
+    lat = df_escolas["lat"].to_numpy()
+    lon = df_escolas["lon"].to_numpy()
+    motivacao = df_escolas["motivacao"].to_numpy(dtype=float)
+    meta = cobertura * mm
+    if meta <= 0:
+        return 0.0
+
+    limite = 0.0
+    for consultor in df_consultores.itertuples():
+        dist = np.round(_haversine_km(lat, lon, consultor.lat, consultor.lon))
+        ordem = np.argsort(dist / np.maximum(motivacao, 1e-12), kind="stable")
+        acumulado = np.cumsum(motivacao[ordem])
+        k = int(np.searchsorted(acumulado, meta))  # primeira escola que fecha a meta
+        if k >= len(ordem):
+            return None
+
+        anterior = acumulado[k - 1] if k else 0.0
+        fracao = (meta - anterior) / motivacao[ordem[k]]
+        limite += dist[ordem[:k]].sum() + fracao * dist[ordem[k]]
+
+    return float(limite)
+
+
+def _custo_total(df_resultado, df_final):
+    """
+    Soma das distancias (km) dos pares escola/consultor escolhidos
+    """
+    df_dist = df_final.set_index("CO_ENTIDADE").drop(columns="motivacao")
+    df_dist.index = df_dist.index.astype(str)
+
+    return float(
+        sum(
+            df_dist.loc[i, j]
+            for i, j in zip(df_resultado["cod_escola"], df_resultado["consultor"])
+        )
+    )
+
+
+def _atende_cobertura(df_resultado, df_final, cobertura, mm):
+    motivacao = df_final.set_index("CO_ENTIDADE")["motivacao"]
+    motivacao.index = motivacao.index.astype(str)
+
+    atendido = (
+        df_resultado.assign(motivacao=df_resultado["cod_escola"].map(motivacao))
+        .groupby("consultor")["motivacao"]
+        .sum()
+    )
+    consultores = df_final.columns.drop(["CO_ENTIDADE", "motivacao"])
+
+    return all(atendido.get(j, 0) >= cobertura * mm - 1e-6 for j in consultores)
+
+
+def _run_multinivel(
+    df_afinidade,
+    df_consultores,
+    cobertura,
+    data_hora,
+    n_regioes=300,
+    comparar=False,
+    busca_local=True,
+    portfolio=False,
+    df_consultores_geo=None,
+    df_distancias=None,
+):
+    """
+    Atribuicao em dois niveis para instancias grandes:
+    agrupa as escolas em micro-regioes, resolve a atribuicao das regioes e refina
+    escola a escola apenas com os consultores candidatos de cada regiao (ver
+    _run_optimizer_regioes)
+
+    comparar: se True resolve tambem o modelo completo e registra a perda de
+    qualidade (perda_%); sempre registra a perda maxima (perda_max_%) contra o
+    _limite_inferior, que nao precisa do modelo completo
+    busca_local: se True melhora as solucoes com o _busca_local
+    portfolio: se True resolve com o _run_portfolio
+    df_consultores_geo, df_distancias: ver _get_final_df
+
+    Retorna um df com as colunas "cod_escola", "consultor" e o dict do relatorio
+    """
+    print("_run_multinivel()")
+    inicio = time.time()
+
+    df_coords_co = df_consultores_geo
+    if df_coords_co is None:
+        df_coords_co = _consultores_handler(df_consultores)
+    df_escolas = _add_motivacao(df_afinidade)
+    df_escolas = df_escolas[["CO_ENTIDADE", "motivacao", "lat", "lon"]]
+    mm = df_escolas["motivacao"].sum() / len(df_coords_co)
+    limite = _limite_inferior(df_escolas, df_coords_co, cobertura, mm)
 
-    consultores, escolas = [], []
-    for v in modelo.variables():
-        if v.value() != 0:
-            m = padrao.match(v.name)
-            escolas.append(m.group(1))
-            consultores.append(m.group(2))
+    regioes, df_regioes = _agrupa_escolas(df_escolas, n_regioes)
+    df_escolas = df_escolas.assign(regiao=regioes)
 
-    df = pd.DataFrame({"cod_escola": escolas, "consultor": consultores})
+    atribuicao = _run_optimizer_regioes(df_regioes, df_coords_co, cobertura, mm)
+    df_escolas = df_escolas[df_escolas["regiao"].isin(atribuicao.keys())]
 
-    return df
+    df_final = _distancias_candidatas(df_escolas, df_coords_co, atribuicao)
+    df_final = df_final.merge(
+        df_escolas[["CO_ENTIDADE", "motivacao"]], on="CO_ENTIDADE"
+    )
+    resolve = _run_portfolio if portfolio else _run_optimizer
+    df_resultado = resolve(df_final, cobertura, data_hora, mm=mm)
+
+    relatorio = {
+        "n_escolas": int(len(df_afinidade)),
+        "n_regioes": int(len(df_regioes)),
+        "n_escolas_refinadas": int(len(df_escolas)),
+        "n_pares": int(
+            df_final.drop(columns=["CO_ENTIDADE", "motivacao"]).notna().sum().sum()
+        ),
+    }
+
+    if not _atende_cobertura(df_resultado, df_final, cobertura, mm):
+        # regioes divididas entre consultores podem nao fechar com escolas inteiras
+        print("Refinamento inviavel, resolvendo o modelo completo")
+        df_final = _get_final_df(
+            df_afinidade, df_consultores, df_coords_co, df_distancias
+        )
+        df_resultado = resolve(df_final, cobertura, data_hora)
+        relatorio["fallback_modelo_completo"] = True
+        mm = None
+
+    if busca_local:
+        df_resultado = _busca_local(df_resultado, df_final, cobertura, mm)
+
+    relatorio["objetivo_km"] = _custo_total(df_resultado, df_final)
+    relatorio["tempo_s"] = round(time.time() - inicio, 2)
+    if limite is not None:
+        relatorio["limite_inferior_km"] = round(limite, 2)
+        relatorio["perda_max_%"] = round(
+            100 * (relatorio["objetivo_km"] - limite) / max(limite, 1), 2
+        )
+        print(f"Perda maxima do multinivel: {relatorio['perda_max_%']}%")
 
+    if comparar:
+        inicio = time.time()
+        df_final_completo = _get_final_df(
+            df_afinidade, df_consultores, df_coords_co, df_distancias
+        )
+        df_completo = resolve(df_final_completo, cobertura, f"{data_hora}_completo")
+        if busca_local:
+            df_completo = _busca_local(df_completo, df_final_completo, cobertura)
+        objetivo_completo = _custo_total(df_completo, df_final_completo)
+
+        relatorio["objetivo_completo_km"] = objetivo_completo
+        relatorio["tempo_completo_s"] = round(time.time() - inicio, 2)
+        relatorio["perda_%"] = round(
+            100
+            * (relatorio["objetivo_km"] - objetivo_completo)
+            / max(objetivo_completo, 1),
+            2,
+        )
+
+    with open(Path(f"dados/resultados/multinivel_{data_hora}.json"), "w") as f:
+        json.dump(relatorio, f, indent=4)
 
+    return df_resultado, relatorio
+
+
+@mede_etapa
 def _result_handler(
     df_resultado: pd.DataFrame,
     df_training: pd.DataFrame,
@@ -118,13 +865,14 @@ def _result_handler(
     cobertura: float,
 ) -> pd.DataFrame:
     """
-    Gera e salva o excel com o resultado nas seguintes colunas:
-    "consultor", "cod_escola", "cep", "valor_venda"
+    Salva o resultado em parquet (o excel so e gerado quando baixado) com as
+    seguintes colunas: "consultor", "cod_escola", "cep", "valor_venda", "lat", "lon"
 
     Retorna um df com as seguintes colunas:
     "consultor", "cod_escola", "valor_venda", "lat", "lon"
     """
     print("_result_handler()")
+    reporta_etapa("exportacao")
 
     df_training = df_training[["CO_ENTIDADE", "CO_CEP", "valor_venda", "lat", "lon"]]
     df_training["CO_ENTIDADE"] = df_training["CO_ENTIDADE"].astype(str).str.zfill(8)
@@ -149,12 +897,7 @@ def _result_handler(
     else:
         sheet_name = f"{cobertura}_sem_afinidade"
 
-    df_excel.to_excel(
-        Path(f"dados/resultados/resultado_{data_hora}.xlsx"),
-        sheet_name=sheet_name,
-        index=False,
-        freeze_panes=(1, 1),
-    )
+    salva_resultado(df_excel, data_hora, sheet_name)
 
     # df_resultado[["consultor", "cod_escola", "valor_venda", "lat", "lon"]].to_csv(
     #     "dados/temporarios/df_resultado.csv", index=False
@@ -163,13 +906,144 @@ def _result_handler(
     return df_resultado[["consultor", "cod_escola", "valor_venda", "lat", "lon"]]
 
 
-def get_results(df_afinidade, df_training, df_consultores, usar_afinidade, cobertura):
+def get_results(
+    df_afinidade,
+    df_training,
+    df_consultores,
+    usar_afinidade,
+    cobertura,
+    multinivel=False,
+    busca_local=True,
+    portfolio=False,
+    data_hora=None,
+    perfilar=False,
+    df_consultores_geo=None,
+    df_distancias=None,
+):
+    """
+    data_hora: identificador da rodada nos arquivos, None gera um novo_run_id
+    perfilar: grava o perfil por amostragem do planejamento (utils/perfilador.py)
+    junto dos artefatos
+    df_consultores_geo, df_distancias: calculados uma vez para varias rodadas
+    (lote), ver _get_final_df
+    """
     print("get_results()")
-    data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
+    data_hora = data_hora or novo_run_id()
+    # etapas medidas (@mede_etapa) da rodada, ficam junto dos outros artefatos
+    with coleta_etapas(f"dados/resultados/etapas_{data_hora}.jsonl"):
+        perfil = f"dados/resultados/perfil_{data_hora}"
+        with perfil_opcional(perfilar, perfil):
+            inicio = time.time()
 
-    df_final = _get_final_df(df_afinidade, df_consultores)
-    df_resultado = _run_optimizer(df_final, cobertura, data_hora)
+            if multinivel:
+                df_resultado, relatorio = _run_multinivel(
+                    df_afinidade,
+                    df_consultores,
+                    cobertura,
+                    data_hora,
+                    busca_local=busca_local,
+                    portfolio=portfolio,
+                    df_consultores_geo=df_consultores_geo,
+                    df_distancias=df_distancias,
+                )
+                objetivo = relatorio["objetivo_km"]
+            else:
+                resolve = _run_portfolio if portfolio else _run_optimizer
+                df_final = _get_final_df(
+                    df_afinidade, df_consultores, df_consultores_geo, df_distancias
+                )
+                df_resultado = resolve(df_final, cobertura, data_hora)
+                if busca_local:
+                    df_resultado = _busca_local(df_resultado, df_final, cobertura)
+                objetivo = _custo_total(df_resultado, df_final)
 
-    return _result_handler(
-        df_resultado, df_training, data_hora, usar_afinidade, cobertura
+        tempo = round(time.time() - inicio, 2)
+        parametros = {
+            "cobertura": cobertura,
+            "usar_afinidade": bool(usar_afinidade),
+            "multinivel": multinivel,
+            "portfolio": portfolio,
+            "busca_local": busca_local,
+        }
+        hashes = {
+            "df_training": hash_df(df_training),
+            "df_afinidade": hash_df(df_afinidade),
+            "df_consultores": hash_df(df_consultores),
+        }
+
+        return finaliza_rodada(
+            df_resultado,
+            df_training,
+            data_hora,
+            parametros,
+            objetivo,
+            tempo,
+            n_escolas=len(df_afinidade),
+            n_consultores=len(df_consultores.dropna()),
+            hashes=hashes,
+        )
+
+
+def finaliza_rodada(
+    df_resultado,
+    df_training,
+    data_hora,
+    parametros,
+    objetivo,
+    tempo,
+    n_escolas,
+    n_consultores,
+    hashes,
+):
+    """
+    Grava as metricas, o resultado e o registro da rodada no manifesto
+    parametros: precisa de cobertura e usar_afinidade, o resto so vai para os
+    registros
+    Retorna o df do _result_handler
+    """
+    registra_metricas(
+        data_hora,
+        {
+            "n_escolas": n_escolas,
+            "n_consultores": n_consultores,
+            **parametros,
+            "n_atribuidas": len(df_resultado),
+            "tempo_planejamento_s": tempo,
+        },
+    )
+
+    df_resultado = _result_handler(
+        df_resultado,
+        df_training,
+        data_hora,
+        parametros["usar_afinidade"],
+        parametros["cobertura"],
     )
+
+    artefatos = {
+        "parquet": f"dados/resultados/resultado_{data_hora}.parquet",
+        "excel": f"dados/resultados/resultado_{data_hora}.xlsx",  # gerado ao baixar
+        "metricas": f"dados/resultados/metricas_{data_hora}.json",
+    }
+    if Path(f"dados/resultados/log_{data_hora}.txt").exists():
+        artefatos["log"] = f"dados/resultados/log_{data_hora}.txt"
+    if Path(f"dados/resultados/multinivel_{data_hora}.json").exists():
+        artefatos["multinivel"] = f"dados/resultados/multinivel_{data_hora}.json"
+    if Path(f"dados/resultados/etapas_{data_hora}.jsonl").exists():
+        artefatos["etapas"] = f"dados/resultados/etapas_{data_hora}.jsonl"
+    if Path(f"dados/resultados/perfil_{data_hora}.folded").exists():
+        artefatos["perfil"] = f"dados/resultados/perfil_{data_hora}.folded"
+        artefatos["perfil_top"] = f"dados/resultados/perfil_{data_hora}_top.csv"
+    registra_rodada(
+        {
+            "data_hora": data_hora,
+            "parametros": parametros,
+            "hashes": hashes,
+            "objetivo_km": objetivo,
+            "tempo_s": tempo,
+            "n_atribuidas": len(df_resultado),
+            "artefatos": artefatos,
+        }
+    )
+
+    return df_resultado
@@ -0,0 +1,304 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from joblib import Parallel, delayed
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score, calinski_harabasz_score
+from utils.kmeans_nativo import cria_kmeans, disponivel
+
+PROPENSAO_ARQUIVO = Path("dados/temporarios/propensao.parquet")
+
+# Colunas de identificação, nunca entram como feature
+ID_COLS = [
+    "NU_ANO_CENSO",
+    "NO_REGIAO",
+    "SG_UF",
+    "NO_MUNICIPIO",
+    "CO_MUNICIPIO",
+    "NO_ENTIDADE",
+    "CO_ENTIDADE",
+    "TP_DEPENDENCIA",
+    "CO_CEP",
+    "TP_SITUACAO_FUNCIONAMENTO",
+    "CO_ORGAO_REGIONAL",
+    "lat",
+    "lon",
+    "afinidade",
+]
+
+# Colunas irrelevantes do censo
+COLS_IGNORAR = [
+    "IN_VINCULO_SECRETARIA_EDUCACAO",
+    "IN_VINCULO_SEGURANCA_PUBLICA",
+    "IN_VINCULO_SECRETARIA_SAUDE",
+    "IN_VINCULO_OUTRO_ORGAO",
+    "IN_PODER_PUBLICO_PARCERIA",
+    "TP_PODER_PUBLICO_PARCERIA",
+    "IN_FORMA_CONT_TERMO_COLABORA",
+    "IN_FORMA_CONT_TERMO_FOMENTO",
+    "IN_FORMA_CONT_ACORDO_COOP",
+    "IN_FORMA_CONT_PRESTACAO_SERV",
+    "IN_FORMA_CONT_COOP_TEC_FIN",
+    "IN_FORMA_CONT_CONSORCIO_PUB",
+    "IN_FORMA_CONT_MU_TERMO_COLAB",
+    "IN_FORMA_CONT_MU_TERMO_FOMENTO",
+    "IN_FORMA_CONT_MU_ACORDO_COOP",
+    "IN_FORMA_CONT_MU_PREST_SERV",
+    "IN_FORMA_CONT_MU_COOP_TEC_FIN",
+    "IN_FORMA_CONT_MU_CONSORCIO_PUB",
+    "IN_FORMA_CONT_ES_TERMO_COLAB",
+    "IN_FORMA_CONT_ES_TERMO_FOMENTO",
+    "IN_FORMA_CONT_ES_ACORDO_COOP",
+    "IN_FORMA_CONT_ES_PREST_SERV",
+    "IN_FORMA_CONT_ES_COOP_TEC_FIN",
+    "IN_FORMA_CONT_ES_CONSORCIO_PUB",
+    "IN_MANT_ESCOLA_PRIVADA_EMP",
+    "IN_MANT_ESCOLA_PRIVADA_ONG",
+    "IN_MANT_ESCOLA_PRIVADA_OSCIP",
+    "IN_MANT_ESCOLA_PRIV_ONG_OSCIP",
+    "IN_MANT_ESCOLA_PRIVADA_SIND",
+    "IN_MANT_ESCOLA_PRIVADA_SIST_S",
+    "IN_MANT_ESCOLA_PRIVADA_S_FINS",
+    "NU_CNPJ_ESCOLA_PRIVADA",
+    "NU_CNPJ_MANTENEDORA",
+    "TP_REGULAMENTACAO",
+    "TP_RESPONSAVEL_REGULAMENTACAO",
+    "CO_ESCOLA_SEDE_VINCULADA",
+    "CO_IES_OFERTANTE",
+    "CO_LINGUA_INDIGENA_3",
+    "CO_LINGUA_INDIGENA_2",
+    "CO_LINGUA_INDIGENA_1",
+    "TP_INDIGENA_LINGUA",
+    "IN_RESERVA_PUBLICA",
+    "IN_RESERVA_PPI",
+    "IN_RESERVA_RENDA",
+    "IN_RESERVA_OUTROS",
+    "IN_RESERVA_NENHUMA",
+    "IN_RESERVA_PCD",
+]
+
+# Notas do ENEM na base completa (04_dados_completos.csv)
+COLS_ENEM = ["QT_NOTAS", "MEDIA_PARCIAL", "MEDIA_GERAL"]
+
+# Cada segmento tem seu proprio imputer, scaler e clusterizacao
+SEGMENTOS = {
+    "com_enem": {"com_notas": True, "k": None},  # k escolhido pelo escolhe_k
+    "sem_enem": {"com_notas": False, "k": 2},  # MiniBatchKMeans
+}
+
+
+def carrega_base(arquivo, sep=";"):
+    """
+    Le a base completa uma vez so, com as medias do ENEM em float
+    (vem com virgula decimal)
+    """
+    print("carrega_base()")
+    df = pd.read_csv(arquivo, sep=sep, low_memory=False)
+
+    for c in ["MEDIA_PARCIAL", "MEDIA_GERAL"]:
+        if c in df.columns and df[c].dtype == object:
+            df[c] = pd.to_numeric(
+                df[c].astype(str).str.replace(",", ".", regex=False).str.strip(),
+                errors="coerce",
+            )
+
+    return df
+
+
+def calcula_propensao(df, target="GUIA", col_notas="QT_NOTAS", cols_enem=COLS_ENEM):
+    """
+    Separa as escolas com e sem notas do ENEM (col_notas > 0) e ajusta os dois
+    segmentos ao mesmo tempo
+    target: coluna com 1 para as escolas aderentes (clientes)
+    cols_enem: colunas que so fazem sentido no segmento com notas
+    Retorna (df com PROPENSAO_%, cluster e SEGMENTO, df_pesos com Variavel,
+    Peso_no_Modelo e SEGMENTO)
+    """
+    print("calcula_propensao()")
+    com_notas = df[col_notas].notna() & (df[col_notas] > 0)
+
+    tarefas = []
+    for segmento, config in SEGMENTOS.items():
+        df_seg = df[com_notas if config["com_notas"] else ~com_notas]
+        if df_seg.empty:
+            continue
+
+        ignorar = COLS_IGNORAR + [target]
+        if not config["com_notas"]:
+            ignorar = ignorar + cols_enem
+
+        tarefas.append((segmento, df_seg, ignorar, config["k"]))
+
+    # threads: KMeans/BLAS soltam o GIL e os dfs nao precisam ser copiados
+    resultados = Parallel(n_jobs=len(tarefas), prefer="threads")(
+        delayed(_propensao_segmento)(segmento, df_seg, ignorar, k, target)
+        for segmento, df_seg, ignorar, k in tarefas
+    )
+
+    df_propensao = pd.concat([r[0] for r in resultados]).loc[df.index]
+    df_pesos = pd.concat([r[1] for r in resultados], ignore_index=True)
+
+    return df_propensao, df_pesos
+
+
+def _matriz_features(df_seg, ignorar):
+    """
+    Colunas numericas (menos ids e ignoradas), imputadas pela media e padronizadas
+    Retorna (X, nomes das colunas)
+    """
+    df_model = df_seg.drop(columns=ID_COLS + ignorar, errors="ignore")
+    df_model = df_model.select_dtypes(include=[np.number])
+
+    # Colunas 100% nulas viram 0 (so pra manter a estrutura)
+    df_model = df_model.fillna({c: 0 for c in df_model.columns[df_model.isna().all()]})
+
+    X = StandardScaler().fit_transform(
+        SimpleImputer(strategy="mean").fit_transform(df_model)
+    )
+
+    return X, df_model.columns
+
+
+def _propensao_segmento(segmento, df_seg, ignorar, k, target):
+    print(f"_propensao_segmento({segmento})")
+    X, colunas = _matriz_features(df_seg, ignorar)
+
+    if k is None:
+        k, _ = escolhe_k(X)
+        kmeans = cria_kmeans(k, n_init=20, random_state=42)
+    else:
+        kmeans = MiniBatchKMeans(
+            n_clusters=k, random_state=42, batch_size=2048, n_init=5
+        )
+
+    clusters = kmeans.fit_predict(X)
+
+    # Cluster dominante das escolas aderentes
+    aderentes = clusters[(df_seg[target] == 1).to_numpy()]
+    if len(aderentes) == 0:
+        print(f"Segmento {segmento} sem escolas aderentes")
+        cluster_aderente = None
+        propensao = np.zeros(len(df_seg))
+    else:
+        cluster_aderente = np.bincount(aderentes).argmax()
+        distancias = np.linalg.norm(
+            X - kmeans.cluster_centers_[cluster_aderente], axis=1
+        )
+        amplitude = (distancias.max() - distancias.min()) or 1
+        propensao = 1 - (distancias - distancias.min()) / amplitude
+
+    df_seg = df_seg.copy()
+    df_seg.insert(0, "PROPENSAO_%", (propensao * 100).round(2))
+    df_seg["cluster"] = clusters
+    df_seg["SEGMENTO"] = segmento
+
+    # Peso de cada variavel: distancia do centro aderente ate a media global
+    if cluster_aderente is None:
+        pesos = np.zeros(len(colunas))
+    else:
+        pesos = np.abs(kmeans.cluster_centers_[cluster_aderente] - X.mean(axis=0))
+
+    df_pesos = pd.DataFrame(
+        {"Variavel": colunas, "Peso_no_Modelo": pesos.round(3), "SEGMENTO": segmento}
+    ).sort_values("Peso_no_Modelo", ascending=False)
+
+    return df_seg, df_pesos
+
+
+def salva_propensao(df_propensao, df_pesos, caminho=PROPENSAO_ARQUIVO):
+    """
+    Um unico parquet: as escolas com a propensao nas colunas e os pesos
+    das variaveis nos metadados
+    """
+    print("salva_propensao()")
+    tabela = pa.Table.from_pandas(df_propensao, preserve_index=False)
+    metadados = {
+        **(tabela.schema.metadata or {}),
+        b"pesos": df_pesos.to_json(orient="records").encode(),
+    }
+    pq.write_table(tabela.replace_schema_metadata(metadados), caminho)
+
+
+def le_propensao(caminho=PROPENSAO_ARQUIVO):
+    """
+    Retorna (df_propensao, df_pesos) salvos pelo salva_propensao
+    """
+    tabela = pq.read_table(caminho)
+    df_pesos = pd.DataFrame(json.loads(tabela.schema.metadata[b"pesos"]))
+
+    return tabela.to_pandas(), df_pesos
+
+
+# --- ESCOLHA DO NUMERO DE CLUSTERS ---
+
+
+def escolhe_k(
+    X, ks=range(2, 8), criterio="silhueta", n_amostra=5000, n_reps=5, n_jobs=-1
+):
+    """
+    Ajusta um KMeans para cada k em paralelo (processos), todos sobre a mesma
+    matriz X ja imputada e padronizada
+    criterio:
+      - "silhueta": silhueta em n_reps amostras de n_amostra escolas estratificadas
+        pelos clusters, com a media e o intervalo de 95% entre as amostras
+      - "calinski": Calinski-Harabasz na base inteira (linear em n)
+    Retorna (melhor_k, df com uma linha por k)
+    """
+    print("escolhe_k()")
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    disponivel()  # compila o kmeans nativo aqui, antes de abrir os processos
+
+    linhas = Parallel(n_jobs=n_jobs)(
+        delayed(_avalia_k)(X, k, criterio, n_amostra, n_reps) for k in ks
+    )
+
+    df_scores = pd.DataFrame(linhas)
+    melhor_k = int(df_scores.loc[df_scores["score"].idxmax(), "k"])
+
+    return melhor_k, df_scores
+
+
+def _avalia_k(X, k, criterio, n_amostra, n_reps, seed=42):
+    km = cria_kmeans(k, n_init=10, random_state=seed).fit(X)
+    linha = {"k": k, "inercia": km.inertia_}
+
+    if criterio == "calinski":
+        linha["score"] = calinski_harabasz_score(X, km.labels_)
+        return linha
+
+    if n_amostra >= len(X):
+        n_reps = 1  # sem amostragem todas as repeticoes dariam o mesmo valor
+
+    rng = np.random.default_rng(seed)
+    scores = []
+    for _ in range(n_reps):
+        idx = _amostra_estratificada(km.labels_, n_amostra, rng)
+        scores.append(silhouette_score(X[idx], km.labels_[idx]))
+
+    media = np.mean(scores)
+    erro = 1.96 * np.std(scores, ddof=1) / np.sqrt(n_reps) if n_reps > 1 else 0.0
+    linha.update({"score": media, "ic_inf": media - erro, "ic_sup": media + erro})
+
+    return linha
+
+
+def _amostra_estratificada(labels, n_amostra, rng):
+    """
+    Indices de uma amostra com a mesma proporcao de cada cluster da base
+    (pelo menos 2 escolas por cluster)
+    """
+    if n_amostra >= len(labels):
+        return np.arange(len(labels))
+
+    idx = []
+    for cluster in np.unique(labels):
+        membros = np.flatnonzero(labels == cluster)
+        n = max(2, round(n_amostra * len(membros) / len(labels)))
+        idx.append(rng.choice(membros, size=min(n, len(membros)), replace=False))
+
+    return np.concatenate(idx)
@@ -0,0 +1,408 @@
+"""
+Servico local de planejamento (HTTP/JSON) com os dados quentes em memoria
+
+Carrega uma vez os inputs temporarios, os consultores geocodificados, a matriz
+de distancias e a afinidade de cada metodo, e guarda o modelo do HiGHS montado
+para cada afinidade: mudar cobertura, tirar consultores ou excluir escolas so
+troca limites no modelo ja carregado, sem remontar nada
+
+Endpoints:
+    GET  /estado                  o que esta carregado
+    POST /planejar                roda um planejamento (json com os campos de
+                                  PEDIDO_PADRAO), retorna o resumo da rodada
+    GET  /resultados              registros do manifesto
+    GET  /resultados/{data_hora}  escolas atribuidas da rodada
+    POST /recarregar              rele os inputs (depois de "Carregar novos inputs")
+
+Uso (a partir da pasta do projeto):
+    python -m utils.servico
+    python -m utils.servico --porta 8765
+"""
+
+import argparse, json, threading, time
+import highspy
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from utils.ml_scripts import METODOS_AFINIDADE, get_afinidade_df
+from utils.po_scripts import (
+    _consultores_handler,
+    _calcula_distancias,
+    _add_motivacao,
+    _formata_solucao,
+    _busca_local,
+    _custo_total,
+    finaliza_rodada,
+    get_results,
+)
+from utils.manifesto import hash_df, le_manifesto, le_resultado, novo_run_id
+from utils.metricas import coleta_etapas
+
+DF_TRAINING = Path("dados/temporarios/df_training.csv")
+DF_CONSULTORES = Path("dados/temporarios/df_consultores.csv")
+
+PEDIDO_PADRAO = {
+    "usar_afinidade": False,
+    "metodo_afinidade": "exato",
+    "cobertura": 0.35,
+    "multinivel": False,
+    "portfolio": False,
+    "busca_local": True,
+    "gap": 0.02,
+    # what-if: valem so para esse pedido, o modelo volta ao original no proximo
+    "remover_consultores": [],
+    "excluir_escolas": [],
+}
+
+RESULTADOS_EM_MEMORIA = 20  # ultimas rodadas servidas sem ler o parquet
+
+
+def valida_pedido(pedido):
+    """
+    Regras de um pedido completo (com o PEDIDO_PADRAO), tambem usadas pelo lote
+    ValueError vira 400 no servico, antes de gastar tempo com a afinidade
+    """
+    if not 0 < pedido["cobertura"] < 1:
+        raise ValueError("cobertura deve estar entre 0 e 1")
+    if pedido["metodo_afinidade"] not in METODOS_AFINIDADE:
+        raise ValueError(
+            f"metodo_afinidade desconhecido: {pedido['metodo_afinidade']} "
+            f"(use {', '.join(METODOS_AFINIDADE)})"
+        )
+
+
+def _monta_highs(df_final):
+    """
+    Mesmo modelo do _monta_modelo, direto no HiGHS (colunas = pares validos)
+    As linhas 0..n-1 sao "no maximo um consultor" por escola e as n..n+K-1 a
+    cobertura de cada consultor, com limite 0 ate o pedido definir
+    Retorna um dict com o Highs e os indices de escola/consultor das colunas
+    """
+    print("_monta_highs()")
+    df_final = df_final.set_index("CO_ENTIDADE")
+    D = df_final.drop(columns="motivacao").to_numpy(dtype=float)
+    motivacao = df_final["motivacao"].to_numpy(dtype=float)
+    n, K = D.shape
+    i_idx, k_idx = np.nonzero(~np.isnan(D))
+    m = len(i_idx)
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = m
+    lp.num_row_ = n + K
+    lp.col_cost_ = D[i_idx, k_idx]
+    lp.col_lower_ = np.zeros(m)
+    lp.col_upper_ = np.ones(m)
+    lp.row_lower_ = np.r_[np.full(n, -highspy.kHighsInf), np.zeros(K)]
+    lp.row_upper_ = np.r_[np.ones(n), np.full(K, highspy.kHighsInf)]
+
+    # cada coluna tem 2 coeficientes: 1 na linha da escola, motivacao na do consultor
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = np.arange(0, 2 * m + 1, 2)
+    lp.a_matrix_.index_ = np.column_stack([i_idx, n + k_idx]).ravel()
+    lp.a_matrix_.value_ = np.column_stack([np.ones(m), motivacao[i_idx]]).ravel()
+    lp.integrality_ = [highspy.HighsVarType.kInteger] * m
+
+    h = highspy.Highs()
+    h.setOptionValue("log_to_console", False)  # log so no arquivo da rodada
+    h.passModel(lp)
+
+    return {
+        "highs": h,
+        "i_idx": i_idx,
+        "k_idx": k_idx,
+        "escolas": df_final.index.to_numpy(),
+        "consultores": df_final.columns.drop("motivacao").to_list(),
+        "motivacao": motivacao,
+        "df_final": df_final.reset_index(),
+        "solucao": None,  # ultima solucao, vira ponto de partida da proxima
+    }
+
+
+class Sessao:
+    """
+    Estado quente do servico, um planejamento por vez (o Highs nao e thread safe)
+    """
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.carrega()
+
+    def carrega(self):
+        print("Sessao.carrega()")
+        self.df_training = pd.read_csv(DF_TRAINING)
+        self.df_consultores = pd.read_csv(DF_CONSULTORES)
+        self.df_consultores_geo = _consultores_handler(self.df_consultores)
+        self.hashes = {
+            "df_training": hash_df(self.df_training),
+            "df_consultores": hash_df(self.df_consultores),
+        }
+        self.df_distancias = None  # as escolas sao as mesmas em toda afinidade
+        self.afinidades = {}  # (usar_afinidade, metodo) -> df_afinidade
+        self.modelos = {}  # (usar_afinidade, metodo) -> _monta_highs
+        self.resultados = OrderedDict()  # data_hora -> df do resultado
+        self.carregado = time.time()
+
+    def _afinidade(self, chave):
+        if chave not in self.afinidades:
+            self.afinidades[chave] = get_afinidade_df(self.df_training, *chave)
+
+        return self.afinidades[chave]
+
+    def _modelo(self, chave):
+        if chave not in self.modelos:
+            df_afinidade = _add_motivacao(self._afinidade(chave).copy())
+            if self.df_distancias is None:
+                self.df_distancias = _calcula_distancias(
+                    df_afinidade, self.df_consultores_geo
+                )
+            df_final = self.df_distancias.merge(
+                df_afinidade[["CO_ENTIDADE", "motivacao"]], on="CO_ENTIDADE"
+            )
+            self.modelos[chave] = _monta_highs(df_final)
+
+        return self.modelos[chave]
+
+    def _resolve(self, modelo, pedido, data_hora):
+        """
+        Aplica o pedido nos limites do modelo carregado e resolve
+        Retorna (df_resultado, df_final do pedido, mm)
+        """
+        h = modelo["highs"]
+        consultores, escolas = modelo["consultores"], modelo["escolas"]
+        n, K = len(escolas), len(consultores)
+
+        ativo = ~np.isin(consultores, pedido["remover_consultores"])
+        if not ativo.any():
+            raise ValueError("Todos os consultores foram removidos")
+        excluida = np.isin(
+            escolas.astype(str), list(map(str, pedido["excluir_escolas"]))
+        )
+
+        # mesma mm do _monta_modelo, so com as escolas e consultores do pedido
+        mm = modelo["motivacao"][~excluida].sum() / ativo.sum()
+        h.changeRowsBounds(
+            K,
+            np.arange(n, n + K),
+            np.where(ativo, pedido["cobertura"] * mm, -highspy.kHighsInf),
+            np.full(K, highspy.kHighsInf),
+        )
+        livre = ativo[modelo["k_idx"]] & ~excluida[modelo["i_idx"]]
+        m = len(livre)
+        h.changeColsBounds(m, np.arange(m), np.zeros(m), livre.astype(float))
+
+        h.setOptionValue("mip_rel_gap", pedido["gap"])
+        h.setOptionValue("log_file", f"dados/resultados/log_{data_hora}.txt")
+        if modelo["solucao"] is not None:
+            h.setSolution(modelo["solucao"])  # o HiGHS descarta se nao for viavel
+        h.run()
+        h.setOptionValue("log_file", "")
+
+        if h.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+            raise RuntimeError(
+                f"Solver terminou com {h.modelStatusToString(h.getModelStatus())}"
+            )
+
+        modelo["solucao"] = h.getSolution()
+        escolhidas = np.asarray(modelo["solucao"].col_value) > 0.5
+        df_resultado = _formata_solucao(
+            list(
+                zip(
+                    escolas[modelo["i_idx"][escolhidas]],
+                    np.asarray(consultores)[modelo["k_idx"][escolhidas]],
+                )
+            )
+        )
+
+        df_final = modelo["df_final"]
+        df_final = df_final[~excluida].drop(columns=np.asarray(consultores)[~ativo])
+
+        return df_resultado, df_final, mm
+
+    def planejar(self, pedido) -> dict:
+        """
+        Roda o planejamento do pedido e grava como uma rodada do app
+        Retorna o resumo: data_hora, objetivo_km, n_atribuidas e tempos por etapa
+        """
+        print("Sessao.planejar()")
+        desconhecidos = set(pedido) - set(PEDIDO_PADRAO)
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos: {desconhecidos}")
+        pedido = {**PEDIDO_PADRAO, **pedido}
+        valida_pedido(pedido)
+
+        chave = (
+            bool(pedido["usar_afinidade"]),
+            pedido["metodo_afinidade"] if pedido["usar_afinidade"] else "exato",
+        )
+        data_hora = novo_run_id()
+        tempos = {}
+
+        etapas = f"dados/resultados/etapas_{data_hora}.jsonl"
+        with self.trava, coleta_etapas(etapas):
+            inicio = time.perf_counter()
+            df_afinidade = self._afinidade(chave)
+            tempos["afinidade"] = time.perf_counter() - inicio
+
+            # multinivel e portfolio tem o proprio fluxo, so a afinidade vem quente
+            if pedido["multinivel"] or pedido["portfolio"]:
+                df_resultado = get_results(
+                    df_afinidade,
+                    self.df_training,
+                    self.df_consultores,
+                    pedido["usar_afinidade"],
+                    pedido["cobertura"],
+                    pedido["multinivel"],
+                    busca_local=pedido["busca_local"],
+                    portfolio=pedido["portfolio"],
+                    data_hora=data_hora,
+                )
+                tempos["planejamento"] = time.perf_counter() - inicio
+                registro = next(
+                    r for r in le_manifesto() if r["data_hora"] == data_hora
+                )
+                objetivo = registro["objetivo_km"]
+            else:
+                modelo = self._modelo(chave)
+                tempos["modelo"] = time.perf_counter() - inicio
+
+                df_resultado, df_final, mm = self._resolve(modelo, pedido, data_hora)
+                tempos["solver"] = time.perf_counter() - inicio
+
+                if pedido["busca_local"]:
+                    df_resultado = _busca_local(
+                        df_resultado, df_final, pedido["cobertura"], mm
+                    )
+                    tempos["busca_local"] = time.perf_counter() - inicio
+                objetivo = _custo_total(df_resultado, df_final)
+
+                parametros = {
+                    k: pedido[k]
+                    for k in PEDIDO_PADRAO
+                    if k not in ("metodo_afinidade", "gap")
+                }
+                parametros["usar_afinidade"] = bool(parametros["usar_afinidade"])
+                df_resultado = finaliza_rodada(
+                    df_resultado,
+                    self.df_training,
+                    data_hora,
+                    parametros,
+                    objetivo,
+                    round(
+                        tempos["busca_local" if pedido["busca_local"] else "solver"], 2
+                    ),
+                    n_escolas=len(df_final),
+                    n_consultores=len(df_final.columns) - 2,
+                    hashes={**self.hashes, "df_afinidade": hash_df(df_afinidade)},
+                )
+                tempos["gravacao"] = time.perf_counter() - inicio
+
+            self.resultados[data_hora] = df_resultado
+            while len(self.resultados) > RESULTADOS_EM_MEMORIA:
+                self.resultados.popitem(last=False)
+
+        # tempos acumulados -> duracao de cada etapa
+        anteriores = [0.0] + list(tempos.values())[:-1]
+        duracoes = {
+            etapa: round(t - t0, 4)
+            for (etapa, t), t0 in zip(tempos.items(), anteriores)
+        }
+
+        return {
+            "data_hora": data_hora,
+            "objetivo_km": objetivo,
+            "n_atribuidas": len(df_resultado),
+            "tempos_s": duracoes,
+        }
+
+    def resultado(self, data_hora) -> pd.DataFrame:
+        if data_hora in self.resultados:
+            return self.resultados[data_hora]
+
+        registros = {r["data_hora"]: r for r in le_manifesto()}
+        if data_hora not in registros:
+            raise KeyError(data_hora)
+
+        return le_resultado(registros[data_hora])
+
+    def estado(self) -> dict:
+        return {
+            "n_escolas": len(self.df_training),
+            "consultores": self.df_consultores_geo["Consultor"].to_list(),
+            "afinidades": [list(c) for c in self.afinidades],
+            "modelos": [list(c) for c in self.modelos],
+            "resultados_em_memoria": list(self.resultados),
+            "carregado": self.carregado,
+        }
+
+
+def _handler(sessao):
+    class Handler(BaseHTTPRequestHandler):
+        def _responde(self, status, dados):
+            corpo = json.dumps(dados, ensure_ascii=False, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def _trata(self, func):
+            try:
+                self._responde(200, func())
+            except (ValueError, json.JSONDecodeError) as e:
+                self._responde(400, {"erro": str(e)})
+            except KeyError as e:
+                self._responde(404, {"erro": f"nao encontrado: {e}"})
+            except Exception as e:
+                self._responde(500, {"erro": repr(e)})
+
+        def _corpo(self):
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(tamanho) or b"{}")
+
+        def do_GET(self):
+            partes = self.path.strip("/").split("/")
+            if partes == ["estado"]:
+                self._trata(sessao.estado)
+            elif partes == ["resultados"]:
+                self._trata(le_manifesto)
+            elif len(partes) == 2 and partes[0] == "resultados":
+                df = lambda: json.loads(
+                    sessao.resultado(partes[1]).to_json(orient="records")
+                )
+                self._trata(df)
+            else:
+                self._responde(404, {"erro": f"rota desconhecida: {self.path}"})
+
+        def do_POST(self):
+            if self.path == "/planejar":
+                self._trata(lambda: sessao.planejar(self._corpo()))
+            elif self.path == "/recarregar":
+
+                def _recarrega():
+                    with sessao.trava:
+                        sessao.carrega()
+                    return sessao.estado()
+
+                self._trata(_recarrega)
+            else:
+                self._responde(404, {"erro": f"rota desconhecida: {self.path}"})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    args = parser.parse_args()
+
+    sessao = Sessao()
+    servidor = ThreadingHTTPServer((args.host, args.porta), _handler(sessao))
+    print(f"Servico de planejamento em http://{args.host}:{args.porta}")
+    servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,44 @@
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-from datetime import datetime
-import json
+import json, time
+import numpy as np
 import plotly.graph_objects as go
 import random
+from utils.metricas import get_historico_metricas, le_etapas
+from utils.inputs_handler import INPUTS, le_input
+from utils.pipeline import executa_etapas
+from utils.manifesto import (
+    MANIFESTO,
+    le_manifesto,
+    le_resultado,
+    exporta_excel,
+    data_do_run,
+)
+from utils.jobs import (
+    consulta_job,
+    cancela_job,
+    progresso,
+    posicao_fila,
+    ETAPAS_PLANEJAMENTO,
+)
 
 
 DIVIDER = "rainbow"
 
+CORES = [
+    "#E41A1C",
+    "#377EB8",
+    "#4DAF4A",
+    "#FF7F00",
+    "#FFFF33",
+    "#A65628",
+    "#F781BF",
+    "#999999",
+]
+LIMITE_PONTOS = 5_000  # acima disso o mapa mostra celulas em vez de escolas
+CELULAS_ALVO = 1_500  # quantas celulas (aprox.) o mapa agregado tem
+
 
 def sh(text: str = ""):
     """
@@ -20,6 +50,26 @@ def sh(text: str = ""):
         st.subheader(text)
 
 
+def _mensagem_input(name, arquivo, erro):
+    """
+    Imprime a mensagem do input no app (tem que ser na thread do streamlit)
+    """
+    title, file_name = INPUTS[name]
+
+    if erro is None:
+        st.success(title)
+        return arquivo
+
+    if isinstance(erro, FileNotFoundError):
+        st.error(
+            f"**{title}** não encontrado, o nome deve ser exatamente: **{file_name}** e deve estar localizado em: **dados/inputs**"
+        )
+    else:
+        st.error(f"Erro desconhecido: {erro}")
+
+    return None
+
+
 def input_checker(name) -> pd.DataFrame:
     """
     Recebe o path para o arquivo
@@ -30,151 +80,365 @@ def input_checker(name) -> pd.DataFrame:
 
     Retorna o input como um df
     """
-    try:
-        if name in ["microdados_ed_basica", "RESULTADOS"]:
-            if name == "microdados_ed_basica":
-                title = "Micro Dados da Educação Básica"
-            else:
-                title = "Resultados do ENEM"
-
-            file_name = name + ".csv"
-            input_path = Path(f"dados/inputs/{file_name}")
-            arquivo = pd.read_csv(
-                input_path, sep=";", encoding="latin1", low_memory=False
-            )
+    return _mensagem_input(name, *le_input(name))
 
-        elif name == "escolas_atuais":
-            title = "Escolas Atuais no Sistema de Ensino Poliedro"
-            file_name = name + ".xlsx"
-            input_path = Path(f"dados/inputs/{file_name}")
 
-            dict_dfs = pd.read_excel(input_path, sheet_name=None)  # dict com os df
-            arquivo = tuple(dict_dfs.values())  # tupla com os dfs
+def inputs_checker(names) -> list:
+    """
+    Como o input_checker, mas le todos os inputs ao mesmo tempo (threads)
+    As mensagens saem na ordem de names, retorna a lista na mesma ordem
+    """
+    print("inputs_checker()")
+    etapas = {name: {"func": le_input, "args": [name]} for name in names}
+    resultados, _ = executa_etapas(etapas)
 
-        elif name == "local_consultores":
-            title = "Local dos Consultores"
-            file_name = name + ".xlsx"
-            input_path = Path(f"dados/inputs/{file_name}")
-            arquivo = pd.read_excel(input_path)
+    return [_mensagem_input(name, *resultados[name]) for name in names]
 
-        elif name == "ticket_medio":
-            title = "Ticket Médio"
-            file_name = name + ".json"
-            input_path = Path(f"dados/inputs/{file_name}")
-            arquivo = json.loads(input_path.read_text())
 
-        st.success(title)
-        return arquivo
-
-    except FileNotFoundError as e:
-        st.error(
-            f"**{title}** não encontrado, o nome deve ser exatamente: **{file_name}** e deve estar localizado em: **{input_path.parent}**"
+def _agrega_grade(df, n_celulas=CELULAS_ALVO):
+    """
+    Agrupa as escolas de cada consultor em celulas quadradas de lat/lon com
+    um groupby so, o lado da celula se ajusta a area para dar ~n_celulas
+    Retorna um df com consultor, lat, lon (media), escolas e valor_venda (soma)
+    e o lado da celula em graus
+    """
+    area = np.ptp(df["lat"]) * np.ptp(df["lon"])
+    lado = max(np.sqrt(area / n_celulas), 1e-4)
+
+    df_celulas = (
+        df.groupby(
+            [
+                (df["lat"] // lado).rename("cel_lat"),
+                (df["lon"] // lado).rename("cel_lon"),
+                "consultor",
+            ],
+            observed=True,
         )
-        return None
+        .agg(
+            lat=("lat", "mean"),
+            lon=("lon", "mean"),
+            escolas=("lat", "size"),
+            valor_venda=("valor_venda", "sum"),
+        )
+        .reset_index()
+        .drop(columns=["cel_lat", "cel_lon"])
+    )
+
+    return df_celulas, lado
 
-    except Exception as e:
-        st.error(f"Erro desconhecido: {e}")
+
+def _janela_selecionada(evento):
+    """
+    Caixa (lat/lon min e max) dos pontos selecionados no mapa, ou None
+    """
+    pontos = [p for p in evento.selection.points if "lat" in p and "lon" in p]
+    if not pontos:
         return None
 
+    lats = [p["lat"] for p in pontos]
+    lons = [p["lon"] for p in pontos]
+    return min(lats), max(lats), min(lons), max(lons)
 
-def _draw_map(df_resultado):
+
+def _draw_map(df_resultado, key="mapa"):
+    """
+    Um trace por consultor (clicar na legenda esconde as escolas dele), separados
+    com um groupby so. Com muitas escolas mostra celulas agregadas, e ao
+    selecionar uma area (caixa ou laco) redesenha so ela, com as escolas quando
+    couberem
+    """
     print("draw_map()")
 
-    cores = [
-        "#E41A1C",
-        "#377EB8",
-        "#4DAF4A",
-        "#FF7F00",
-        "#FFFF33",
-        "#A65628",
-        "#F781BF",
-        "#999999",
-    ]
+    consultores_unicos = pd.unique(df_resultado["consultor"])
+    janela = None
+    if key in st.session_state:
+        janela = _janela_selecionada(st.session_state[key])
+
+    df = df_resultado
+    if janela is not None:
+        lat_min, lat_max, lon_min, lon_max = janela
+        # no mapa agregado a selecao pega os centros das celulas, e as escolas de
+        # uma celula ficam a ate um lado de distancia do centro
+        margem = st.session_state.get(f"{key}_lado", 0.0)
+        df = df[
+            df["lat"].between(lat_min - margem, lat_max + margem)
+            & df["lon"].between(lon_min - margem, lon_max + margem)
+        ]
+
+    agregado = len(df) > LIMITE_PONTOS
+    lado = 0.0
+    if agregado:
+        df, lado = _agrega_grade(df)
+    st.session_state[f"{key}_lado"] = lado  # vale para a proxima selecao
 
     fig = go.Figure()
-
-    consultores_unicos = df_resultado["consultor"].unique()
-
+    grupos = dict(tuple(df.groupby("consultor", sort=False, observed=True)))
     for idx, cons in enumerate(consultores_unicos):
-        dfc = df_resultado[df_resultado["consultor"] == cons]
+        dfc = grupos.get(cons, df.iloc[:0])  # fora da janela: so a legenda
+
+        if agregado:
+            tamanho = np.clip(6 + 3 * np.sqrt(dfc["escolas"]), 6, 30)
+            customdata = dfc[["valor_venda", "escolas"]]
+            hovertemplate = (
+                "<b>%{customdata[1]} escolas</b><br>Valor: %{customdata[0]:,.0f}"
+                f"<br>Consultor: {cons}<extra></extra>"
+            )
+        else:
+            tamanho = 10
+            customdata = dfc[["valor_venda"]]
+            hovertemplate = (
+                f"<b>%{{customdata[0]}}</b><br>Consultor: {cons}<extra></extra>"
+            )
 
         fig.add_trace(
             go.Scattermap(
                 lat=dfc["lat"],
                 lon=dfc["lon"],
                 mode="markers",
-                name=str(cons),  # aparece na legenda
-                marker=dict(size=10, color=cores[idx % len(cores)]),  # cor distinta
-                text=dfc["valor_venda"],  # aparece no hover
-                hovertemplate="<b>%{text}</b><br>Consultor: " + str(cons),
+                name=str(cons),
+                marker=dict(size=tamanho, color=CORES[idx % len(CORES)]),
+                customdata=customdata,
+                hovertemplate=hovertemplate,
             )
         )
 
+    centro, zoom = dict(lat=-14.2350, lon=-51.9253), 3
+    if janela is not None:
+        centro = dict(lat=(lat_min + lat_max) / 2, lon=(lon_min + lon_max) / 2)
+        extensao = max(lat_max - lat_min, lon_max - lon_min, 0.01)
+        zoom = float(np.clip(np.log2(360 / extensao) - 1, 3, 15))
+
     fig.update_layout(
-        map=dict(
-            style="open-street-map", center=dict(lat=-14.2350, lon=-51.9253), zoom=3
-        ),
+        map=dict(style="open-street-map", center=centro, zoom=zoom),
         legend=dict(x=0.02, y=0.98, xanchor="left", yanchor="top"),
         height=500,
         margin=dict(r=0, t=0, l=0, b=0),
     )
 
-    st.plotly_chart(fig, width="stretch")
+    st.plotly_chart(
+        fig,
+        width="stretch",
+        key=key,
+        on_select="rerun",
+        selection_mode=("box", "lasso"),
+    )
 
 
-def _downl_button(result_idx: int = -1):
-    pasta = Path("dados/resultados")
-    arquivos = sorted(pasta.glob("resultado_*.xlsx"))
-    file_path = arquivos[result_idx]
+def _versao_manifesto():
+    """
+    Muda a cada rodada registrada, entra na chave dos caches do historico
+    """
+    try:
+        info = MANIFESTO.stat()
+        return info.st_mtime_ns, info.st_size
+    except FileNotFoundError:
+        return None
 
-    with file_path.open("rb") as f:
-        st.download_button(
-            "Baixar resultado em Excel",
-            data=f,
-            file_name=file_path.name,
-            on_click="ignore",
-            type="primary",
-            icon=":material/download:",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key=random.randint(1, 1000),  # miau
-        )
+
+@st.cache_data(show_spinner=False)
+def _manifesto(versao):
+    return le_manifesto()
 
 
+@st.cache_data(max_entries=8, show_spinner=False)
+def _resultado(registro):
+    # o resultado de uma rodada nao muda depois de salvo
+    return le_resultado(registro)
+
+
+@st.cache_data(show_spinner=False)
+def _historico_metricas(versao):
+    return get_historico_metricas()
+
+
+def _downl_button(registro):
+    """
+    O excel so e gerado (e fica salvo) quando o botao e clicado
+    """
+    artefatos = registro["artefatos"]
+    file_path = Path(artefatos["excel"])
+
+    def _dados():
+        if "parquet" in artefatos:
+            return exporta_excel(artefatos["parquet"]).read_bytes()
+        return file_path.read_bytes()
+
+    st.download_button(
+        "Baixar resultado em Excel",
+        data=_dados,
+        file_name=file_path.name,
+        on_click="ignore",
+        type="primary",
+        icon=":material/download:",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        key=random.randint(1, 1000),  # miau
+    )
+
+
+@st.fragment
 def show_result(result_idx: int, header="Resultado"):
+    """
+    Fragmento: selecionar uma area do mapa redesenha so o resultado
+    """
     print("show_result()")
     sh(header)
 
-    pasta = Path("dados/resultados")
-    path = sorted(pasta.glob("resultado_*.xlsx"))[result_idx]
+    registro = _manifesto(_versao_manifesto())[result_idx]
 
-    df_resultado = pd.read_excel(path)
+    df_resultado = _resultado(registro)
 
-    _draw_map(df_resultado)
-    _downl_button()
+    _draw_map(df_resultado, key=f"mapa_{registro['data_hora']}_{header}")
+    _downl_button(registro)
 
+    if "etapas" in registro["artefatos"]:
+        with st.expander("Etapas do planejamento"):
+            show_etapas(registro["artefatos"]["etapas"])
 
-def get_prev_results_infos():
+    if "perfil" in registro["artefatos"]:
+        with st.expander("Perfil de execução"):
+            show_perfil(
+                registro["artefatos"]["perfil"], registro["artefatos"]["perfil_top"]
+            )
+
+
+def show_etapas(caminho):
     """
-    retorna uma lista de tuplas com data, hora, cobertura, afinidade, file_path
+    Tempo, cpu, memoria e linhas de cada etapa medida (@mede_etapa), somando
+    as chamadas repetidas da mesma etapa. Memoria e cpu dos subprocessos ficam
+    vazias nas etapas que rodaram junto com outras (sobreposta)
     """
-    pasta = Path("dados/resultados")
-    paths = sorted(pasta.glob("resultado_*.xlsx"))
+    etapas = le_etapas(caminho)
+    if not etapas:
+        st.info("Nenhuma etapa medida")
+        return
+
+    df = (
+        pd.DataFrame(etapas)
+        .groupby("etapa", sort=False)
+        .agg(
+            chamadas=("etapa", "size"),
+            tempo_s=("tempo_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            cpu_subprocessos_s=("cpu_subprocessos_s", lambda s: s.sum(min_count=1)),
+            pico_rss_mb=("pico_rss_mb", "max"),
+            sobreposta=("sobreposta", "any"),
+            linhas_entrada=("linhas_entrada", "first"),
+            linhas_saida=("linhas_saida", "last"),
+        )
+    )
+
+    st.bar_chart(df["tempo_s"], horizontal=True, x_label="Tempo (s)", y_label="")
+    st.dataframe(df)
+
+
+def show_perfil(caminho_folded, caminho_top):
+    """
+    Funcoes com mais tempo proprio no perfil da rodada e o arquivo das pilhas
+    para abrir num visualizador de flame graph
+    """
+    st.dataframe(pd.read_csv(caminho_top), hide_index=True)
+    st.download_button(
+        "Baixar pilhas (flame graph)",
+        data=Path(caminho_folded).read_bytes(),
+        file_name=Path(caminho_folded).name,
+        help="Formato folded: abra no speedscope.app ou no flamegraph.pl",
+        icon=":material/local_fire_department:",
+        key=f"perfil_{caminho_folded}",
+    )
 
+
+@st.fragment(run_every=1)
+def _progresso_job(job_id):
+    """
+    Atualiza sozinho a cada segundo, e recarrega o app quando o job termina
+    """
+    estado = consulta_job(job_id)
+    if estado is None or estado["status"] not in ("na_fila", "rodando"):
+        st.rerun(scope="app")
+
+    decorrido = round(time.time() - estado["criado"])
+    if estado["status"] == "na_fila":
+        texto = f"Na fila, posição {posicao_fila(job_id)}"
+    else:
+        texto = ETAPAS_PLANEJAMENTO.get(estado["etapa"], "Iniciando")
+    st.progress(progresso(estado), text=f"{texto}... ({decorrido}s)")
+
+    if st.button("Cancelar", icon=":material/cancel:"):
+        # com outros esperando o mesmo planejamento ele continua para eles
+        cancela_job(job_id)
+        del st.query_params["job"]
+        st.rerun(scope="app")
+
+
+def acompanha_job(job_id):
+    """
+    Mostra o progresso do job do planejamento, ou o resultado quando termina
+    """
+    estado = consulta_job(job_id)
+    if estado is None:
+        st.warning("Planejamento não encontrado")
+        return
+
+    if estado["status"] in ("na_fila", "rodando"):
+        _progresso_job(job_id)
+    elif estado["status"] == "concluido":
+        datas = [r["data_hora"] for r in _manifesto(_versao_manifesto())]
+        show_result(datas.index(estado["parametros"]["data_hora"]))
+    elif estado["status"] == "cancelado":
+        st.warning("Planejamento cancelado")
+    else:
+        st.error(f"O planejamento falhou: {estado.get('erro')}")
+
+
+def get_prev_results_infos():
+    """
+    retorna uma lista de tuplas com data, hora, cobertura, afinidade, result_idx
+    (posicao no manifesto, a mesma que o show_result recebe)
+    """
     infos = []
-    for result_idx, arquivo in enumerate(paths):
-        data_hora = arquivo.stem.replace("resultado_", "")
-        dt = datetime.strptime(data_hora, "%Y%m%d_%H%M%S")
+    for result_idx, registro in enumerate(_manifesto(_versao_manifesto())):
+        dt = data_do_run(registro["data_hora"])
         data = dt.strftime("%d/%m/%Y")
         hora = dt.strftime("%H:%M:%S")
 
-        xls = pd.ExcelFile(arquivo)
-        nome_aba = xls.sheet_names[0].split("_")
-        cobertura = nome_aba[0]
-        if nome_aba[1] == "sem":
-            afinidade = "Não"
-        else:
-            afinidade = "Sim"
+        cobertura = registro["parametros"]["cobertura"]
+        afinidade = "Sim" if registro["parametros"]["usar_afinidade"] else "Não"
 
         infos.append((data, hora, cobertura, afinidade, result_idx))
 
     return infos
+
+
+def show_historico_metricas():
+    """
+    Mostra como o desempenho do solver muda com o tamanho da carteira e o numero
+    de consultores ao longo das rodadas
+    """
+    df = _historico_metricas(_versao_manifesto())
+    if df.empty:
+        st.info("Nenhuma métrica de rodada salva ainda")
+        return
+
+    st.scatter_chart(
+        df,
+        x="n_escolas",
+        y="tempo_planejamento_s",
+        color="n_consultores",
+        x_label="Escolas na carteira",
+        y_label="Tempo do planejamento (s)",
+    )
+
+    colunas = [
+        "data_hora",
+        "n_escolas",
+        "n_consultores",
+        "cobertura",
+        "variaveis",
+        "colunas_pos_presolve",
+        "nos",
+        "gap",
+        "tempo_presolve",
+        "tempo_solve",
+        "tempo_planejamento_s",
+    ]
+    st.dataframe(df[[c for c in colunas if c in df.columns]], hide_index=True)